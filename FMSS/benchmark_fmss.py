@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the throughput of the FMSS clients against the local mock service.
+
+For each load profile (see PROFILES), a `mock_fmss.py` server is started, and
+the REST client in `fmss.py` (all the asset pages for all the parks) and the
+SOAP client in `fmss2.py` (all the location queries) are run against it with
+each of the WORKER_COUNTS.  The time, requests, rows, handshakes, and requests
+and rows per second of each run are printed as a table.  The output of the
+clients is not printed.
+
+Usage:
+
+python benchmark_fmss.py [profile ...]
+
+The default is all the profiles.
+
+Written for Python 2.7; it may with Python 3.x.
+
+Third party requirements:
+* pyodbc - https://pypi.python.org/pypi/pyodbc (imported by fmss2.py)
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+import time
+
+import fmss
+import fmss2
+import fmss_http
+import mock_fmss
+
+# The options for mock_fmss.start() for each load profile.
+PROFILES = {
+    "local": {"delay": 0},
+    "wan": {"delay": 0.05, "jitter": 0.05},
+    "large": {"delay": 0.02, "scale": 10.0},
+    "flaky": {"delay": 0.02, "error_rate": 0.05},
+}
+
+PROFILE_ORDER = ["local", "wan", "large", "flaky"]
+
+# The number of requests at the same time to test for each client.
+WORKER_COUNTS = [1, 4, 8, 16]
+
+# The seed for the random errors and jitter, so runs can be compared.
+SEED = 42
+
+# A shorter backoff and circuit breaker reset than the defaults, so the flaky
+# profile does not take all day.
+BACKOFF = 0.1
+BREAKER_RESET = 1.0
+
+
+class Quiet(object):
+    """A replacement for sys.stdout that ignores the client's output."""
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+def rest_client(server, workers):
+    """Run the REST client and return the number of rows and pages that failed."""
+
+    url = server.base_url + "/fmss/api/assets?siteid={0}&page={1}"
+    pager = fmss.Pager(url)
+    rows = fmss.paged_rows(url, fmss.asset_data, list(fmss.sites), workers, pager)
+    return sum(1 for _ in rows), len(pager.failed)
+
+
+def soap_client(server, workers):
+    """Run the SOAP client and return the number of rows and queries that failed."""
+
+    fmss2.location_endpoint = server.base_url + "/meaweb/services/FMSSGISLOCQ"
+    pager = fmss.Pager(fmss2.location_endpoint)
+    rows = fmss2.all_location_rows(workers=workers, pager=pager)
+    return sum(1 for _ in rows), len(pager.failed)
+
+
+CLIENTS = [("REST", rest_client), ("SOAP", soap_client)]
+
+
+def measure(profile, client, workers):
+    """Return a dictionary of the measurements for one run of a client."""
+
+    options = dict(PROFILES[profile], seed=SEED)
+    server = mock_fmss.start(**options)
+    # A new transport, so every run starts with no open connections
+    fmss_http.transport = fmss_http.Transport()
+    stdout = sys.stdout
+    sys.stdout = Quiet()
+    start = time.time()
+    try:
+        rows, failed = client(server, workers)
+    finally:
+        seconds = time.time() - start
+        sys.stdout = stdout
+        server.shutdown()
+        server.server_close()
+    stats = fmss_http.transport.stats.values()
+    return {
+        "seconds": seconds,
+        "requests": server.request_count,
+        "errors": server.error_count,
+        "rows": rows,
+        "failed": failed,
+        "handshakes": sum(endpoint["handshakes"] for endpoint in stats),
+    }
+
+
+def main(profiles):
+    fmss.BACKOFF = BACKOFF
+    fmss.BREAKER_RESET = BREAKER_RESET
+    header = (
+        "{0:<7} {1:<5} {2:>7} {3:>8} {4:>8} {5:>6} {6:>7} {7:>6} {8:>10} {9:>9}"
+    )
+    line = (
+        "{0:<7} {1:<5} {2:>7} {3:>8.2f} {4:>8} {5:>6} {6:>7} {7:>6} "
+        "{8:>10.1f} {9:>9.0f}"
+    )
+    print(
+        header.format(
+            "Profile",
+            "Client",
+            "Workers",
+            "Seconds",
+            "Requests",
+            "Errors",
+            "Failed",
+            "Shakes",
+            "Requests/s",
+            "Rows/s",
+        )
+    )
+    for profile in profiles:
+        for name, client in CLIENTS:
+            for workers in WORKER_COUNTS:
+                result = measure(profile, client, workers)
+                seconds = max(result["seconds"], 1e-6)
+                print(
+                    line.format(
+                        profile,
+                        name,
+                        workers,
+                        result["seconds"],
+                        result["requests"],
+                        result["errors"],
+                        result["failed"],
+                        result["handshakes"],
+                        result["requests"] / seconds,
+                        result["rows"] / seconds,
+                    )
+                )
+
+
+if __name__ == "__main__":
+    NAMES = sys.argv[1:] or PROFILE_ORDER
+    UNKNOWN = [name for name in NAMES if name not in PROFILES]
+    if UNKNOWN:
+        print("Unknown profile(s): {0}".format(", ".join(UNKNOWN)))
+        print("Choose from: {0}".format(", ".join(PROFILE_ORDER)))
+        sys.exit(1)
+    main(NAMES)
@@ -2,6 +2,24 @@
 """
 Creates a CSV file of facilities data for a SOAP request to the FMSS web service.
 
+The first page for every park is requested at the same time (with at most
+MAX_WORKERS requests at once), and then the remaining pages (the number of
+pages is in the first page) are requested the same way.  The rows are
+written to the CSV file in park and page order as soon as each page arrives.
+A failed request is tried again (after an exponential backoff with jitter) up
+to MAX_RETRIES times, with no more than RETRY_BUDGET retries for all the pages
+of a park.  After BREAKER_LIMIT failures in a row, no more requests are sent to
+the service (the circuit breaker is open) until BREAKER_RESET seconds have
+passed, and then only one trial request until it succeeds; the other requests
+wait (up to MAX_WAIT seconds) for their turn.  The pages that could not be
+retrieved are listed at the end, and the script exits with an error, so a
+scheduled task can tell that data is missing.
+The requests share the pooled keep-alive connections in `fmss_http.py`, and the
+transport statistics are printed at the end.
+Run `mock_fmss.py` to test against a local stand-in for the web service.
+Run with `--record` to save the responses in a cache folder (and use them on
+the next run), or with `--replay` to only use the saved responses (offline).
+
 File paths are hard coded in the script and relative to the current working directory.
 
 Written for Python 2.7; it may with Python 3.x.
@@ -11,25 +29,43 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import csv
 import json
-
-try:
-    import urllib2
-except ImportError:
-    # Python 3 replacement
-    import urllib.request as urllib2
-
-try:
-    from urllib2 import HTTPError
-except ImportError:
-    # Python 3 replacement
-    from urllib.error import HTTPError
+from multiprocessing.pool import ThreadPool
+import random
+import sys
+import threading
+import time
 
 import csv23
+import fmss_http
 
 # These URLs return JSON
 location_url = "http://inpniscvnpunit2/fmss/api/locations?siteid={0}&page={1}"
 asset_url = "http://inpniscvnpunit2/fmss/api/assets?siteid={0}&page={1}"
 
+# The largest number of requests to the web service at the same time.
+MAX_WORKERS = 8
+
+# The number of times to try a failed request again.
+MAX_RETRIES = 6
+
+# The largest number of retries for all the pages of one park (or one SOAP query).
+RETRY_BUDGET = 10
+
+# The seconds to wait before the first retry (doubled for each retry).
+BACKOFF = 1.0
+
+# The longest wait (in seconds) before a retry.
+MAX_BACKOFF = 30.0
+
+# The number of failed requests in a row that opens the circuit breaker.
+BREAKER_LIMIT = 5
+
+# The seconds until a request is tried again after the circuit breaker opens.
+BREAKER_RESET = 60.0
+
+# The longest time (in seconds) a request waits for the circuit breaker to close.
+MAX_WAIT = 600.0
+
 # Response is JSON, converted to Python it looks like (as of July 20115):
 response = {
     "TotalItems": 2,
@@ -160,30 +196,228 @@ def my_str(s):
         return ""
 
 
-def locations(park):
-    page = 1
-    done, data = locations_page(park, page)
-    while not done:
-        page += 1
-        done, moredata = locations_page(park, page)
-        data += moredata
+def get_page(url_template, park, page):
+    """
+    Return the JSON response for a page of a park (raises an error on failure).
+
+    Raises a ValueError if the response is not JSON, or not a page (a dictionary
+    with a TotalPages number and a PagedList list).
+    """
+
+    data = fmss_http.get(url_template.format(sites[park], page))
+    data = json.loads(data.decode("utf-8"))
+    if (
+        not isinstance(data, dict)
+        or not isinstance(data.get("TotalPages"), int)
+        or not isinstance(data.get("PagedList"), list)
+    ):
+        msg = "Unexpected response for page {0} of {1}: {2:.100}"
+        raise ValueError(msg.format(page, park, json.dumps(data)))
     return data
 
 
-def locations_page(park, page):
+def is_retryable(error):
+    """Return True if a request that failed with error may work if tried again."""
+
+    if isinstance(error, fmss_http.CacheMiss):
+        return False
+    if isinstance(error, fmss_http.HTTPError):
+        # Client errors (except Too Many Requests) will not change
+        return error.status >= 500 or error.status == 429
+    # Network errors, timeouts, and incomplete (invalid) JSON
+    return True
+
+
+class Pager(object):
+    """
+    Makes requests to a service with retries and a circuit breaker.
+
+    The requests that failed (after retries) are in `failed`, a list of
+    (key, description, reason) tuples, where key is the park for a page.
+    A Pager can be used by several threads.
+    """
+
+    def __init__(
+        self,
+        url_template,
+        retries=MAX_RETRIES,
+        budget=RETRY_BUDGET,
+        breaker_limit=BREAKER_LIMIT,
+        max_wait=MAX_WAIT,
+    ):
+        # The URL template for get_page() (or the endpoint for call()), for messages
+        self.url_template = url_template
+        self.retries = retries
+        self.budget = budget
+        self.breaker_limit = breaker_limit
+        self.max_wait = max_wait
+        self.budgets = {}
+        self.failures_in_a_row = 0
+        self.breaker_opened = None
+        # True while the one trial request after BREAKER_RESET is being sent
+        self.half_open = False
+        self.failed = []
+        self.lock = threading.Lock()
+        # Notified when the circuit breaker closes or opens again
+        self.breaker_changed = threading.Condition(self.lock)
+
+    def get_page(self, park, page):
+        """Return the JSON response for a page of a park, or None if it failed."""
+
+        if page == 1:
+            description = "page 1 (and any other pages) for {0}".format(park)
+        else:
+            description = "page {0} for {1}".format(page, park)
+        return self.call(park, description, get_page, self.url_template, park, page)
+
+    def call(self, key, description, request, *args):
+        """
+        Return request(*args), or None if it failed (after retries).
+
+        request makes one request to the service, and raises a ValueError or one
+        of fmss_http.REQUEST_ERRORS if it fails.  The retries come out of the
+        budget for key (i.e. a park, so all its pages share a budget), and
+        description is used in the messages.  While the
+        circuit breaker is open, the request waits (up to max_wait seconds in
+        all) for its turn to be sent.
+        """
+
+        attempt = 0
+        deadline = time.time() + self.max_wait
+        while True:
+            if not self.wait_to_send(deadline):
+                reason = "circuit breaker is open (after waiting {0:.0f}s)"
+                return self.fail(key, description, reason.format(self.max_wait))
+            try:
+                result = request(*args)
+            except (ValueError,) + fmss_http.REQUEST_ERRORS as ex:
+                self.record_failure()
+                if not is_retryable(ex):
+                    return self.fail(key, description, ex)
+                if attempt >= self.retries:
+                    reason = "{0} (after {1} retries)".format(ex, attempt)
+                    return self.fail(key, description, reason)
+                if not self.use_retry(key):
+                    reason = "{0} (no retries left)".format(ex)
+                    return self.fail(key, description, reason)
+                attempt += 1
+                delay = min(MAX_BACKOFF, BACKOFF * 2 ** (attempt - 1))
+                time.sleep(random.uniform(0, delay))
+                continue
+            self.record_success()
+            return result
+
+    def wait_to_send(self, deadline):
+        """
+        Wait until a request may be sent, and return False if deadline passes first.
+
+        A request may be sent at once if the circuit breaker is closed.  When
+        BREAKER_RESET seconds have passed since it opened, the breaker is half
+        open: one trial request is sent, and the rest wait until the trial
+        succeeds (which closes the breaker) or fails (which opens it again).
+        """
+
+        with self.lock:
+            while True:
+                now = time.time()
+                if self.breaker_opened is None:
+                    return True
+                reset = self.breaker_opened + BREAKER_RESET
+                if not self.half_open and now >= reset:
+                    self.half_open = True
+                    return True
+                if now >= deadline:
+                    return False
+                until = deadline if self.half_open else min(reset, deadline)
+                self.breaker_changed.wait(until - now)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures_in_a_row += 1
+            if self.half_open or self.failures_in_a_row >= self.breaker_limit:
+                if self.breaker_opened is None:
+                    print("Too many failures; pausing requests to", self.url_template)
+                self.breaker_opened = time.time()
+                self.half_open = False
+                self.breaker_changed.notify_all()
+
+    def record_success(self):
+        with self.lock:
+            self.failures_in_a_row = 0
+            if self.breaker_opened is not None:
+                self.breaker_opened = None
+                self.half_open = False
+                self.breaker_changed.notify_all()
+
+    def use_retry(self, key):
+        """Return True (and use one) if there is a retry left in the budget for key."""
+
+        with self.lock:
+            left = self.budgets.get(key, self.budget)
+            if left <= 0:
+                return False
+            self.budgets[key] = left - 1
+            return True
+
+    def fail(self, key, description, reason):
+        with self.lock:
+            self.failed.append((key, description, "{0}".format(reason)))
+        msg = "Unable to retrieve {0} from {1}: {2}"
+        print(msg.format(description, self.url_template, reason))
+        return None
+
+    def report(self):
+        """Print the requests that failed."""
+
+        if not self.failed:
+            return
+        print("{0} requests failed:".format(len(self.failed)))
+        for _, description, reason in sorted(self.failed, key=lambda f: f[0]):
+            print("  {0}: {1}".format(description, reason))
+
+
+def paged_rows(url_template, row_maker, parks, workers=MAX_WORKERS, pager=None):
+    """
+    Yield the rows for all the pages for each park in parks.
+
+    url_template is location_url or asset_url, and row_maker is location_data or
+    asset_data.  Up to workers pages are requested at the same time, but the
+    rows are yielded in park and page order as soon as they are available.
+    A page that fails (after retries) is skipped, and is in pager.failed.
+    """
+
+    if pager is None:
+        pager = Pager(url_template)
+    # Keep a connection for each worker, so none need a new handshake
+    fmss_http.keep_idle(workers)
+    pool = ThreadPool(workers)
     try:
-        f = urllib2.urlopen(location_url.format(sites[park], page))
-    except HTTPError:
-        print("Unable to retrieve Location page {0} for {1}.".format(page, park))
-        return False, []
+        first_pages = pool.map(lambda park: pager.get_page(park, 1), parks)
+        # TotalPages may be 0 if there is no data
+        page_counts = [
+            data["TotalPages"] if data is not None else 0 for data in first_pages
+        ]
+        requests = [
+            (park, page)
+            for park, page_count in zip(parks, page_counts)
+            for page in range(2, page_count + 1)
+        ]
+        other_pages = pool.imap(lambda args: pager.get_page(*args), requests)
+        for park, first_page, page_count in zip(parks, first_pages, page_counts):
+            if first_page is not None:
+                for row in row_maker(first_page["PagedList"], park):
+                    yield row
+            for _ in range(2, page_count + 1):
+                data = next(other_pages)
+                if data is not None:
+                    for row in row_maker(data["PagedList"], park):
+                        yield row
+    finally:
+        pool.terminate()
 
-    data = json.load(f)
-    # print(data)
-    total_pages = data["TotalPages"]  # maybe 0 if there is no data
-    current_page = data["Page"]  # will always be 1 or greater
-    done = current_page >= total_pages
-    data = location_data(data["PagedList"], park)
-    return done, data
+
+def locations(park):
+    return list(paged_rows(location_url, location_data, [park]))
 
 
 def location_data(page, park):
@@ -245,60 +479,39 @@ loc_header = [
 ]
 
 
-def lshowone(park, csv_path=None):
+def show(url_template, row_maker, header, parks, csv_path=None):
+    """
+    Write the rows for parks to csv_path (or print them if there is no path).
+
+    Return a list of the pages that could not be retrieved (see Pager.failed).
+    """
+
+    pager = Pager(url_template)
+    rows = paged_rows(url_template, row_maker, parks, pager=pager)
     if csv_path:
         with csv23.open(csv_path, "w") as csv_file:
             csv_writer = csv.writer(csv_file)
-            csv23.write(csv_writer, loc_header)
-            for row in locations(park):
+            csv23.write(csv_writer, header)
+            for row in rows:
                 csv23.write(csv_writer, row)
     else:
-        print(",".join(loc_header))
-        for item in locations(park):
+        print(",".join(header))
+        for item in rows:
             print(",".join([my_str(x) for x in item]))
+    pager.report()
+    return pager.failed
 
 
-def lshowall(csv_path=None):
-    if csv_path:
-        with csv23.open(csv_path, "w") as csv_file:
-            csv_writer = csv.writer(csv_file)
-            csv23.write(csv_writer, loc_header)
-            for park in sites:
-                for row in locations(park):
-                    csv23.write(csv_writer, row)
-    else:
-        print(",".join(loc_header))
-        for park in sites:
-            for item in locations(park):
-                print(",".join([my_str(x) for x in item]))
+def lshowone(park, csv_path=None):
+    return show(location_url, location_data, loc_header, [park], csv_path)
 
 
-def assets(park):
-    page = 1
-    done, data = assets_page(park, page)
-    while not done:
-        page += 1
-        done, moredata = assets_page(park, page)
-        data += moredata
-    return data
+def lshowall(csv_path=None):
+    return show(location_url, location_data, loc_header, list(sites), csv_path)
 
 
-def assets_page(park, page):
-    try:
-        f = urllib2.urlopen(asset_url.format(sites[park], page))
-    except HTTPError:
-        print("Unable to retrieve Asset page {0} for {1}.".format(page, park))
-        return False, []
-
-    data = json.load(f)
-    f.close()
-    # print(data)
-    total_pages = data["TotalPages"]
-    current_page = data["Page"]
-    print(park, current_page, total_pages)
-    done = current_page >= total_pages
-    data = asset_data(data["PagedList"], park)
-    return done, data
+def assets(park):
+    return list(paged_rows(asset_url, asset_data, [park]))
 
 
 def asset_data(page, park):
@@ -371,35 +584,20 @@ asset_header = [
 
 
 def ashowone(park, csv_path=None):
-    if csv_path:
-        with csv23.open(csv_path, "w") as csv_file:
-            csv_writer = csv.writer(csv_file)
-            csv23.write(csv_writer, asset_header)
-            for row in assets(park):
-                csv23.write(csv_writer, row)
-    else:
-        print(",".join(asset_header))
-        for item in assets(park):
-            print(",".join([my_str(x) for x in item]))
+    return show(asset_url, asset_data, asset_header, [park], csv_path)
 
 
 def ashowall(csv_path=None):
-    if csv_path:
-        with csv23.open(csv_path, "w") as csv_file:
-            csv_writer = csv.writer(csv_file)
-            csv23.write(csv_writer, asset_header)
-            for park in sites:
-                for row in assets(park):
-                    csv23.write(csv_writer, row)
-    else:
-        print(",".join(asset_header))
-        for park in sites:
-            for item in assets(park):
-                print(",".join([my_str(x) for x in item]))
-
-
-# lshowall('fmss.csv')
-# lshowone('AKRO')
-ashowall("assets.csv")
-# ashowone('KLGO','klgo.csv')
-# ashowone('LACL','lacl.csv')
+    return show(asset_url, asset_data, asset_header, list(sites), csv_path)
+
+
+if __name__ == "__main__":
+    fmss_http.use_cache(fmss_http.cache_mode(sys.argv))
+    # FAILED = lshowall('fmss.csv')
+    # FAILED = lshowone('AKRO')
+    FAILED = ashowall("assets.csv")
+    # FAILED = ashowone('KLGO','klgo.csv')
+    # FAILED = ashowone('LACL','lacl.csv')
+    fmss_http.print_report()
+    if FAILED:
+        sys.exit(1)
@@ -6,6 +6,22 @@ Note: Worked with the older REST service as of June 21, 2016.
 The old webservice was retired.
 As of June 4, 2018, this worked with the new SOAP services (still underdevelopment)
 
+The location queries for every site and asset code are made by a pool of
+threads (at most MAX_WORKERS requests at once), and each response is parsed
+(with `iterparse`) by the thread that requested it as it arrives from the
+network, while the other threads wait on the network.
+The results are used in the same (site, asset code) order as the queries.
+A failed query is tried again with the retries, backoff, and circuit breaker
+in `fmss.py`, and the queries that still fail are listed at the end.
+All the requests share the pooled keep-alive connections in `fmss_http.py`.
+Run `mock_fmss.py` to test against a local stand-in for the web service.
+Run with `--record` to save the responses in a cache folder (and use them on
+the next run), or with `--replay` to only use the saved responses (offline),
+i.e. to rerun `build_csv()` or `update_db()` without the web service.
+
+`update_db()` rebuilds the FMSSExport table, and `sync_db()` only inserts,
+updates, and deletes the rows that changed since the last run.
+
 File paths are hard coded in the script and relative to the current working directory.
 
 Written for Python 2.7; it may with Python 3.x.
@@ -17,29 +33,38 @@ Third party requirements:
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import csv
+from decimal import Decimal, InvalidOperation
+import hashlib
+import io
+import json
+from multiprocessing.pool import ThreadPool
 import sys
+import time
 import xml.etree.ElementTree as eT
 
-try:
-    import urllib2
-except ImportError:
-    # Python 3 replacement
-    import urllib.request as urllib2
-
 import pyodbc
 
 import csv23
+import fmss
+import fmss_http
 
-# Use `xrange` as a replacement for `range` on Python 2
-# pylint: disable=undefined-variable,redefined-builtin
-if sys.version_info[0] < 3:
-    range = xrange
+# SOAP endpoints
+location_endpoint = "https://uat1mif.pfmd.nps.gov/meawebuat1/services/FMSSGISLOCQ"
+frpp_endpoint = "https://uat1mif.pfmd.nps.gov/meawebuat1/services/FMSSGISFRPPQ"
+asset_endpoint = "https://uat1mif.pfmd.nps.gov/meawebuat1/services/FMSSGISASSETQ"
 
+# The largest number of requests to the web service at the same time.
+MAX_WORKERS = 8
+
+# The number of rows to insert into the database at a time.
+BATCH_SIZE = 1000
+
+
+def location_request(site_id, asset_code):
+    """Return the body (bytes) and headers for a location query."""
 
-def location_query(site_id, asset_code):
     # host = "mif.pfmd.nps.gov"
     # action = '"urn:processDocument"'
-    endpoint = "https://uat1mif.pfmd.nps.gov/meawebuat1/services/FMSSGISLOCQ"
 
     query = """<soapenv:Envelope xmlns:soapenv="http://www.w3.org/2003/05/soap-envelope">
       <soapenv:Header/>
@@ -65,9 +90,12 @@ def location_query(site_id, asset_code):
         # "SOAPAction": action,
         "Content-Length": "{0}".format(len(encoded_query)),
     }
+    return encoded_query, headers
 
-    request = urllib2.Request(url=endpoint, headers=headers, data=encoded_query)
-    response = urllib2.urlopen(request).read()
+
+def location_query(site_id, asset_code):
+    encoded_query, headers = location_request(site_id, asset_code)
+    response = fmss_http.post(location_endpoint, encoded_query, headers)
     return response
 
 
@@ -79,8 +107,6 @@ def location_query(site_id, asset_code):
 
 
 def frpp_query(location_id):
-    endpoint = "https://uat1mif.pfmd.nps.gov/meawebuat1/services/FMSSGISFRPPQ"
-
     query = """<soapenv:Envelope xmlns:soapenv="http://www.w3.org/2003/05/soap-envelope">
       <soapenv:Header/>
       <soapenv:Body>
@@ -106,14 +132,11 @@ def frpp_query(location_id):
         "Content-Length": "{0}".format(len(encoded_query)),
     }
 
-    request = urllib2.Request(url=endpoint, headers=headers, data=encoded_query)
-    response = urllib2.urlopen(request).read()
+    response = fmss_http.post(frpp_endpoint, encoded_query, headers)
     return response
 
 
 def asset_query(site_id, asset_code):
-    endpoint = "https://uat1mif.pfmd.nps.gov/meawebuat1/services/FMSSGISASSETQ"
-
     query = """<soapenv:Envelope xmlns:soapenv="http://www.w3.org/2003/05/soap-envelope">
       <soapenv:Header/>
       <soapenv:Body>
@@ -138,8 +161,7 @@ def asset_query(site_id, asset_code):
         "Content-Length": "{0}".format(len(encoded_query)),
     }
 
-    request = urllib2.Request(url=endpoint, headers=headers, data=encoded_query)
-    response = urllib2.urlopen(request).read()
+    response = fmss_http.post(asset_endpoint, encoded_query, headers)
     return response
 
 
@@ -255,10 +277,31 @@ def location_to_rows(data, location):
     return row
 
 
+def iter_location_rows(data, source):
+    """
+    Yield a row for each LOCATIONS element in the XML read from source.
+
+    source is a file-like object (i.e. a response from `fmss_http.open_url()`).
+    The XML is parsed as it is read, and each LOCATIONS element is removed from
+    the tree when its row is made, so the memory used does not grow with the
+    size of the response.
+    """
+
+    parents = []
+    for event, element in eT.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+        parents.pop()
+        if element.tag == ns + "LOCATIONS":
+            yield location_to_rows(data, element)
+            element.clear()
+            if parents:
+                parents[-1].remove(element)
+
+
 def convert_xml_to_rows(data, response):
-    xml_root = eT.fromstring(response)
-    locations = xml_root.iter(ns + "LOCATIONS")
-    return [location_to_rows(data, location) for location in locations]
+    return list(iter_location_rows(data, io.BytesIO(response)))
 
 
 def convert_xml_to_csv(data, response, csv_writer):
@@ -287,17 +330,88 @@ def test_csv(csv_path):
         convert_xml_to_csv(["ANIA", "4100", "Building"], response, csv_writer)
 
 
+def location_queries():
+    """Return a list of the (site, asset code) queries in sites and asset_types."""
+
+    return [(site, asset_code) for site in sites for asset_code in asset_types]
+
+
+def query_rows(query):
+    """
+    Return the data, rows, and the response and read times for a location query.
+
+    query is a (site, asset code) tuple.  The response time is the time until
+    the response headers arrive, and the read time is the time to read and
+    parse the body (which is parsed as it arrives).  Raises a ValueError if the
+    response is not valid XML.
+    """
+
+    site, asset_code = query
+    data = [site, "{0}".format(asset_code), asset_types[asset_code]]
+    body, headers = location_request(sites[site], "{0}".format(asset_code))
+    start = time.time()
+    with fmss_http.open_url("POST", location_endpoint, body, headers) as response:
+        received = time.time()
+        try:
+            rows = list(iter_location_rows(data, response))
+        except eT.ParseError as ex:
+            msg = "Invalid XML for the location query for {0} {1}: {2}"
+            raise ValueError(msg.format(site, asset_code, ex))
+    return data, rows, received - start, time.time() - received
+
+
+def all_location_rows(queries=None, workers=MAX_WORKERS, pager=None):
+    """
+    Yield the rows for the location queries (default is all location_queries()).
+
+    Up to workers queries are made at the same time, but the rows are yielded
+    in the order of the queries.  The time for each request is printed.
+    A failed query is tried again with the retries and circuit breaker of
+    pager (a new fmss.Pager by default), and each query has its own retry
+    budget; if it still fails, it is skipped, and is in pager.failed and
+    listed at the end.
+    """
+
+    if queries is None:
+        queries = location_queries()
+    if pager is None:
+        pager = fmss.Pager(location_endpoint)
+
+    def query_with_retries(query):
+        description = "location query for {0} {1}".format(*query)
+        return pager.call(query, description, query_rows, query)
+
+    start = time.time()
+    total = 0
+    # Keep a connection for each worker, so none need a new handshake
+    fmss_http.keep_idle(workers)
+    pool = ThreadPool(workers)
+    try:
+        for result in pool.imap(query_with_retries, queries):
+            if result is None:
+                continue
+            data, rows, request_time, parse_time = result
+            msg = "{0}: {1} rows; response {2:.3f}s, read and parse {3:.3f}s"
+            print(msg.format(data, len(rows), request_time, parse_time))
+            total += len(rows)
+            for row in rows:
+                yield row
+    finally:
+        pool.terminate()
+    msg = "{0} queries ({1} failed), {2} rows in {3:.1f} seconds with {4} workers"
+    print(
+        msg.format(len(queries), len(pager.failed), total, time.time() - start, workers)
+    )
+    pager.report()
+    fmss_http.print_report()
+
+
 def build_csv(csv_path):
     with csv23.open(csv_path, "w") as csv_file:
         csv_writer = csv.writer(csv_file)
         csv23.write(csv_writer, table_column_names)
-        for site in sites:
-            site_id = sites[site]
-            for asset_code in asset_types:
-                data = [site, "{0}".format(asset_code), asset_types[asset_code]]
-                print(data)
-                response = location_query(site_id, "{0}".format(asset_code))
-                convert_xml_to_csv(data, response, csv_writer)
+        for row in all_location_rows():
+            csv23.write(csv_writer, row)
 
 
 def get_connection_or_die(server, database):
@@ -341,10 +455,17 @@ def execute_sql(connection, sql):
         print("Database error ocurred", de)
 
 
-def chunks(l, n):
-    """Yield successive n-sized chunks from list l."""
-    for i in range(0, len(l), n):
-        yield l[i : i + n]
+def batches(rows, size):
+    """Yield lists of (up to) size rows from the iterable rows."""
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 def create_table(connection, name):
@@ -379,12 +500,70 @@ def delete_table(connection, name):
     execute_sql(connection, sql)
 
 
-def escape_single_quote(s):
-    return s.replace("'", "''")
+def as_text(value):
+    """Return the text of an XML element (None stays None)."""
+
+    return value
+
+
+def as_int(value):
+    """
+    Return the text of an XML element as an int, or None if it is empty.
+
+    Raises a ValueError if the number has a fraction (i.e. "12.7"), rather than
+    truncating it; "12.0" is 12.
+    """
+
+    if value is None or not value.strip():
+        return None
+    number = Decimal(value.strip())
+    if not number.is_finite() or number != number.to_integral_value():
+        raise ValueError("{0} is not a whole number".format(value))
+    return int(number)
+
+
+def as_decimal(value):
+    """Return the text of an XML element as a Decimal, or None if it is empty."""
+
+    if value is None or not value.strip():
+        return None
+    return Decimal(value.strip())
+
+
+# The conversion from text to the type of each column in table_column_names.
+column_types = [
+    as_text,  # UNITCODE
+    as_int,  # Asset_Code
+    as_text,  # Asset_Type
+    as_text,  # Parent_FACLOCID
+    as_text,  # Status
+    as_text,  # FACLOCID
+    as_text,  # Description
+    as_int,  # API
+    as_decimal,  # CRV
+    as_decimal,  # FCI
+    as_decimal,  # DM
+    as_text,  # UM
+    as_text,  # Qty
+    as_int,  # YearBlt
+]
 
 
-def sql_clean(row):
-    return [escape_single_quote(n) if n is not None else "NULL" for n in row]
+def typed_row(row):
+    """
+    Return the row (text from the web service) with the values in column_types.
+
+    Raises a ValueError if a number is not valid.
+    """
+
+    values = []
+    for column, convert, value in zip(table_column_names, column_types, row):
+        try:
+            values.append(convert(value))
+        except (ValueError, InvalidOperation):
+            msg = "Invalid {0} '{1}' for location {2}"
+            raise ValueError(msg.format(column, value, row[5]))
+    return values
 
 
 def test_fill_table(connection, name):
@@ -401,34 +580,185 @@ def test_fill_table(connection, name):
         print("Database error ocurred", de)
 
 
-def fill_table(connection, name):
+def insert_sql(name):
+    """Return the parameterized SQL to insert a row into the table name."""
+
+    return "insert into [{0}] ({1}) values ({2})".format(
+        name, ",".join(table_column_names), ",".join("?" for _ in table_column_names)
+    )
+
+
+def fill_table(connection, name, rows=None, batch_size=BATCH_SIZE):
+    """
+    Insert the rows (default is all_location_rows()) into the table name.
+
+    The values are converted to the column types (see typed_row()) and sent as
+    parameters with executemany() (fast_executemany with pyodbc), batch_size
+    rows at a time, while the rows are still arriving from the web service.
+    Any DB-API connection with the qmark parameter style will work, i.e. to
+    test with SQLite:
+
+    sqlite3.register_adapter(Decimal, str)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("create table t ({0})".format(",".join(table_column_names)))
+    fill_table(conn, "t", rows)
+    """
+
+    if rows is None:
+        rows = all_location_rows()
     wcursor = connection.cursor()
-    sql = "insert into [{0}] ({1}) values ".format(name, ",".join(table_column_names))
-    for site in sites:  # in ['ANIA']:
-        site_id = sites[site]
-        for asset_code in asset_types:  # in [4100]:
-            data = [site, "{0}".format(asset_code), asset_types[asset_code]]
-            print(data)
-            response = location_query(site_id, "{0}".format(asset_code))
-            rows = convert_xml_to_rows(data, response)
-
-            # SQL Server is limited to 1000 rows in an insert
-            for chunk in chunks(rows, 999):
-                values = ",".join(
-                    [
-                        (
-                            "('{0}',{1},'{2}','{3}','{4}','{5}','{6}',{7},{8},{9},"
-                            "{10},'{11}','{12}',{13})"
-                        ).format(*sql_clean(row))
-                        for row in chunk
-                    ]
-                )
-                # print(sql + values)
-                wcursor.execute(sql + values)
+    if hasattr(wcursor, "fast_executemany"):
+        wcursor.fast_executemany = True
+    sql = insert_sql(name)
+    start = time.time()
+    total = 0
+    for batch in batches((typed_row(row) for row in rows), batch_size):
+        wcursor.executemany(sql, batch)
+        total += len(batch)
     try:
-        wcursor.commit()
+        connection.commit()
     except pyodbc.Error as de:
         print("Database error ocurred", de)
+    seconds = time.time() - start
+    msg = "Inserted {0} rows in {1:.1f} seconds ({2:.0f} rows/sec)"
+    print(msg.format(total, seconds, total / seconds if seconds else 0))
+
+
+def row_hash(values):
+    """
+    Return a hash of the values for a row in table_column_names order.
+
+    The values may be from typed_row() or from the database; numbers are
+    compared by value (i.e. 12.5 and 12.50000000 are the same).
+    """
+
+    parts = []
+    for convert, value in zip(column_types, values):
+        if value is None:
+            parts.append(None)
+        elif convert is as_text:
+            parts.append("{0}".format(value))
+        else:
+            number = Decimal("{0}".format(value)).normalize()
+            parts.append("{0:f}".format(number))
+    return hashlib.sha1(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def stored_hashes(connection, name, batch_size=BATCH_SIZE):
+    """
+    Return a dictionary of FACLOCID: (row_hash(), query) for the rows in the table.
+
+    query is the (UNITCODE, Asset_Code) location query that returns the row.
+    """
+
+    key = table_column_names.index("FACLOCID")
+    hashes = {}
+    cursor = connection.cursor()
+    cursor.execute("select {0} from [{1}]".format(",".join(table_column_names), name))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            hashes[row[key]] = (row_hash(row), query_key(row))
+    cursor.close()
+    return hashes
+
+
+def query_key(values):
+    """Return the (UNITCODE, Asset_Code) of a row from typed_row() or the database."""
+
+    unit_code, asset_code = values[0], values[1]
+    return unit_code, None if asset_code is None else int(asset_code)
+
+
+def execute_batches(connection, sql, rows, batch_size=BATCH_SIZE):
+    """Execute sql for each of the rows, and commit every batch_size rows."""
+
+    wcursor = connection.cursor()
+    if hasattr(wcursor, "fast_executemany"):
+        wcursor.fast_executemany = True
+    for batch in batches(rows, batch_size):
+        wcursor.executemany(sql, batch)
+        connection.commit()
+
+
+def sync_table(connection, name, rows=None, batch_size=BATCH_SIZE):
+    """
+    Change the table name to match the rows (default is all_location_rows()).
+
+    Instead of rebuilding the table, the rows are compared (by row_hash() for
+    each FACLOCID) to the rows in the table, and only the new rows are
+    inserted, the changed rows updated, and the missing rows deleted.  The
+    changes are committed every batch_size rows, so the table stays available
+    and each transaction is small.  Long_Description is not changed.  Rows are
+    only deleted for the (UNITCODE, Asset_Code) queries that returned rows, so
+    a query that failed (or returned nothing) does not delete its rows.
+    Nothing is changed if there are no rows.  Return a dictionary with the
+    number of rows in each group.
+    """
+
+    if rows is None:
+        rows = all_location_rows()
+    start = time.time()
+    key = table_column_names.index("FACLOCID")
+    stored = stored_hashes(connection, name, batch_size)
+    inserts, updates, seen, queries = [], [], set(), set()
+    for row in rows:
+        values = typed_row(row)
+        faclocid = values[key]
+        if faclocid in seen:
+            print("Skipping duplicate location {0}".format(faclocid))
+            continue
+        seen.add(faclocid)
+        queries.add(query_key(values))
+        if faclocid not in stored:
+            inserts.append(values)
+        elif stored[faclocid][0] != row_hash(values):
+            updates.append(values[:key] + values[key + 1 :] + [faclocid])
+    if not seen:
+        print("No rows to sync; {0} was not changed".format(name))
+        return None
+    deletes, kept = [], 0
+    for faclocid, (_, query) in stored.items():
+        if faclocid in seen:
+            continue
+        if query in queries:
+            deletes.append([faclocid])
+        else:
+            kept += 1
+    if kept:
+        msg = "Not deleting {0} rows for location queries that failed or had no rows"
+        print(msg.format(kept))
+    columns = [column for column in table_column_names if column != "FACLOCID"]
+    update_sql = "update [{0}] set {1} where [FACLOCID] = ?".format(
+        name, ",".join("[{0}] = ?".format(column) for column in columns)
+    )
+    delete_sql = "delete from [{0}] where [FACLOCID] = ?".format(name)
+    execute_batches(connection, insert_sql(name), inserts, batch_size)
+    execute_batches(connection, update_sql, updates, batch_size)
+    execute_batches(connection, delete_sql, deletes, batch_size)
+    counts = {
+        "inserted": len(inserts),
+        "updated": len(updates),
+        "deleted": len(deletes),
+        "unchanged": len(seen) - len(inserts) - len(updates),
+    }
+    msg = (
+        "Synced {0}: {1} inserted, {2} updated, {3} deleted, {4} unchanged "
+        "in {5:.1f} seconds"
+    )
+    print(
+        msg.format(
+            name,
+            counts["inserted"],
+            counts["updated"],
+            counts["deleted"],
+            counts["unchanged"],
+            time.time() - start,
+        )
+    )
+    return counts
 
 
 def rename_table(connection, old_name, new_name):
@@ -450,9 +780,14 @@ def copy_column(connection, column_name, from_table, to_table):
 
 def update_db():
     conn = get_connection_or_die("inpakrovmais", "akr_facility2")
+    pager = fmss.Pager(location_endpoint)
     try:
         create_table(conn, "FMSSExport_New")
-        fill_table(conn, "FMSSExport_New")
+        fill_table(conn, "FMSSExport_New", all_location_rows(pager=pager))
+        if pager.failed:
+            msg = "{0} location queries failed; FMSSExport was not changed"
+            print(msg.format(len(pager.failed)))
+            return
         copy_column(conn, "Long_Description", "FMSSExport", "FMSSExport_New")
         delete_table(conn, "FMSSExport")
         #  delete_table(conn, 'FMSSExport_Old')
@@ -470,7 +805,22 @@ def update_db():
             pass
 
 
-print(test_service2())
-# test_csv('out.csv')
-# build_csv('out.csv')
-# update_db()
+def sync_db():
+    conn = get_connection_or_die("inpakrovmais", "akr_facility2")
+    try:
+        sync_table(conn, "FMSSExport")
+    except (ValueError,) + fmss_http.REQUEST_ERRORS as ex:
+        # Raised while the rows are read, before any changes
+        print(ex)
+        print("FMSSExport was not changed")
+    except pyodbc.Error as de:
+        print("Database error ocurred", de)
+
+
+if __name__ == "__main__":
+    fmss_http.use_cache(fmss_http.cache_mode(sys.argv))
+    print(test_service2())
+    # test_csv('out.csv')
+    # build_csv('out.csv')
+    # update_db()
+    # sync_db()
@@ -0,0 +1,619 @@
+# -*- coding: utf-8 -*-
+"""
+The HTTP transport shared by the FMSS web service clients.
+
+`urllib2.urlopen()` opens a new connection (and for HTTPS does a new TLS
+handshake) for every request, and does not ask for a compressed response.
+This module keeps the connections to each host open (HTTP/1.1 keep-alive) in
+a pool, so a client that makes hundreds of requests (even from several
+threads) only does a handful of handshakes.  Every request asks for a gzip
+response, and every connection has a timeout.  The pool keeps an idle
+connection for each thread that may be making requests (see `keep_idle()`),
+so a connection is not closed just because all the threads were busy.
+
+Like `urllib2.urlopen()`, requests go through the proxy in the `http_proxy`
+and `https_proxy` environment variables (except for the hosts in `no_proxy`),
+and redirects are followed (up to MAX_REDIRECTS): a 301, 302 or 303 with a GET,
+and a 307 or 308 with the same method and body.  A proxy that needs a user
+name and password is not supported.
+
+The number of requests and handshakes, the bytes sent and received (as sent
+over the network, i.e. before the response is decompressed), and the latency
+(time from sending the request to reading the end of the response) are kept for
+each endpoint (the URL without the query) and can be printed with
+`print_report()`.
+
+The responses can also be saved in a cache folder (`use_cache("record")`),
+keyed by a hash of the method, URL (with the query) and request body, and used
+again instead of a request while they are younger than the time to live.  In
+"replay" mode, only the saved responses are used (of any age) and nothing is
+sent over the network, so a script can be rerun offline; a request that is not
+in the cache raises a `CacheMiss` (an `HTTPError` with status 504).
+
+Usage:
+
+import fmss_http
+data = fmss_http.get(url)  # bytes (decompressed)
+data = fmss_http.post(url, body, {"Content-Type": "application/soap+xml"})
+fmss_http.print_report()
+
+fmss_http.keep_idle(16)  # before requests from up to 16 threads at once
+fmss_http.use_cache("record")  # or "replay", or None to stop using the cache
+
+or to read the response as it arrives (i.e. with `ElementTree.iterparse()`):
+
+with fmss_http.open_url("POST", url, body, headers) as response:
+    for event, element in xml.etree.ElementTree.iterparse(response):
+        ...
+
+A status of 400 or more raises an `fmss_http.HTTPError`, and a network problem
+or timeout raises a `socket.error` (`OSError` on Python 3); see REQUEST_ERRORS.
+
+Written for Python 2.7; it may work with Python 3.x.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import hashlib
+from io import BytesIO, open
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import httplib
+    from urllib import getproxies, proxy_bypass
+    from urlparse import urljoin, urlsplit
+except ImportError:
+    # Python 3 replacement
+    import http.client as httplib
+    from urllib.parse import urljoin, urlsplit
+    from urllib.request import getproxies, proxy_bypass
+
+# The seconds to wait to connect to the server, or for the next data.
+TIMEOUT = 60
+
+# The smallest number of idle connections to keep open for each host (see
+# Transport.keep_idle()).
+MAX_IDLE = 8
+
+# The largest number of redirects to follow for one request (like urllib2).
+MAX_REDIRECTS = 10
+
+# The redirect statuses, and if the request is sent again with the same method.
+REDIRECTS = {301: False, 302: False, 303: False, 307: True, 308: True}
+
+# The number of bytes to read from the network at a time.
+CHUNK_SIZE = 64 * 1024
+
+# The folder for the response cache (relative to the current working directory).
+CACHE_FOLDER = "fmss_cache"
+
+# The seconds a saved response is used in record mode (None for no limit).
+CACHE_TTL = 24 * 60 * 60
+
+CACHE_MODES = ["record", "replay"]
+
+# The errors a request may raise (an HTTPError is an IOError).
+REQUEST_ERRORS = (IOError, socket.error, httplib.HTTPException)
+
+
+class HTTPError(IOError):
+    """The server responded with an error status."""
+
+    def __init__(self, url, status, reason):
+        msg = "HTTP Error {0}: {1} for {2}".format(status, reason, url)
+        IOError.__init__(self, msg)
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+
+class CacheMiss(HTTPError):
+    """The response to a request is not in the cache (in replay mode)."""
+
+    def __init__(self, url):
+        HTTPError.__init__(self, url, 504, "Not in the response cache")
+
+
+class CachedResponse(BytesIO):
+    """A saved response body, as a read only file-like object."""
+
+    status = 200
+
+
+class ResponseCache(object):
+    """
+    A folder of response bodies keyed by a hash of the request.
+
+    Each response is saved as `{key}.body` (the decompressed body) and
+    `{key}.json` (the method, URL, and time it was saved).  The JSON file is
+    written last, so a response is only used if it was saved completely.
+    """
+
+    def __init__(self, folder=CACHE_FOLDER, mode="record", ttl=CACHE_TTL):
+        if mode not in CACHE_MODES:
+            raise ValueError("Unknown cache mode: {0}".format(mode))
+        self.folder = folder
+        self.mode = mode
+        self.ttl = ttl
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+
+    @staticmethod
+    def key(method, url, body):
+        """Return the key (a hex digest) for a request."""
+
+        digest = hashlib.sha256()
+        digest.update("{0} {1}\n".format(method, url).encode("utf-8"))
+        if body:
+            if not isinstance(body, bytes):
+                body = body.encode("utf-8")
+            digest.update(body)
+        return digest.hexdigest()
+
+    def paths(self, key):
+        """Return the paths to the body and the info files for key."""
+
+        base = os.path.join(self.folder, key)
+        return base + ".body", base + ".json"
+
+    def load(self, key):
+        """
+        Return the saved response body for key, or None.
+
+        In record mode, a response older than the time to live is not used.
+        """
+
+        body_path, info_path = self.paths(key)
+        try:
+            with open(info_path, "r", encoding="utf-8") as info_file:
+                info = json.load(info_file)
+            if self.mode == "record" and self.ttl is not None:
+                if time.time() - info["time"] > self.ttl:
+                    return None
+            with open(body_path, "rb") as body_file:
+                return body_file.read()
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def store(self, key, method, url, data):
+        """Save the response body data for the request."""
+
+        body_path, info_path = self.paths(key)
+        info = {"method": method, "url": url, "time": time.time()}
+        text = json.dumps(info, indent=2, sort_keys=True).encode("utf-8")
+        for path, content in [(body_path, data), (info_path, text)]:
+            handle, temp_path = tempfile.mkstemp(dir=self.folder)
+            with os.fdopen(handle, "wb") as temp_file:
+                temp_file.write(content)
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(temp_path, path)
+            except OSError:
+                # Another thread saved the same response at the same time.
+                os.remove(temp_path)
+
+
+def endpoint_of(url):
+    """Return the endpoint for url (the URL without the query)."""
+
+    parts = urlsplit(url)
+    return "{0}://{1}{2}".format(parts.scheme, parts.netloc, parts.path)
+
+
+def decompressor(encoding):
+    """Return a decompress object for the Content-Encoding (or None)."""
+
+    if encoding and encoding.lower() == "gzip":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding and encoding.lower() == "deflate":
+        return zlib.decompressobj()
+    return None
+
+
+class Response(object):
+    """
+    The (decompressed) body of a response, as a read only file-like object.
+
+    When the body has been read to the end, the statistics for the request
+    are recorded and the connection goes back to the transport's pool.
+    """
+
+    def __init__(
+        self, transport, host, endpoint, connection, response, is_new, sent, start
+    ):
+        # pylint: disable=too-many-arguments
+        self.transport = transport
+        self.host = host
+        self.endpoint = endpoint
+        self.connection = connection
+        self.response = response
+        self.is_new = is_new
+        self.sent = sent
+        self.start = start
+        self.status = response.status
+        self.received = 0
+        self.buffer = b""
+        self.done = False
+        # The request and the pieces of the body, when saving the response.
+        self.method = None
+        self.url = None
+        self.cache_key = None
+        self.pieces = []
+        self.decompressor = decompressor(response.getheader("Content-Encoding"))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def read(self, size=-1):
+        """Return up to size bytes of the body (all the rest if size < 0)."""
+
+        if size is None or size < 0:
+            pieces = [self.buffer]
+            self.buffer = b""
+            while not self.done:
+                pieces.append(self.read_chunk())
+            return b"".join(pieces)
+        while not self.buffer and not self.done:
+            self.buffer = self.read_chunk()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def read_chunk(self):
+        """Return the next (decompressed) piece of the body; may be empty."""
+
+        data = self.read_network()
+        if self.cache_key is not None:
+            self.pieces.append(data)
+            if self.done:
+                cache = self.transport.cache
+                if cache is not None:
+                    body = b"".join(self.pieces)
+                    cache.store(self.cache_key, self.method, self.url, body)
+                self.pieces = []
+        return data
+
+    def read_network(self):
+        """Return the next piece of the body from the network (decompressed)."""
+
+        try:
+            data = self.response.read(CHUNK_SIZE)
+        except (httplib.HTTPException, socket.error):
+            self.close()
+            raise
+        self.received += len(data)
+        if not data:
+            self.finish()
+            return self.decompressor.flush() if self.decompressor else b""
+        if self.decompressor:
+            return self.decompressor.decompress(data)
+        return data
+
+    def finish(self):
+        """Record the request, and return the connection to the pool."""
+
+        self.done = True
+        latency = time.time() - self.start
+        if self.response.will_close:
+            self.connection.close()
+        else:
+            self.transport.release(self.host, self.connection)
+        self.connection = None
+        self.transport.record(
+            self.endpoint, self.is_new, self.sent, self.received, latency
+        )
+
+    def close(self):
+        """Close the connection if the body has not been read to the end."""
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            self.done = True
+
+
+class Transport(object):
+    """
+    A pool of persistent HTTP(S) connections, with statistics per endpoint.
+
+    A Transport can be used by several threads at the same time; each request
+    gets an idle connection to the host from the pool (or opens a new one) and
+    returns it to the pool when the response has been read.  proxies is a
+    dictionary of scheme: proxy URL (the default is from the environment).
+    """
+
+    def __init__(self, timeout=TIMEOUT, max_idle=MAX_IDLE, proxies=None):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.proxies = getproxies() if proxies is None else proxies
+        self.idle = {}
+        self.stats = {}
+        self.cache = None
+        self.lock = threading.Lock()
+
+    def keep_idle(self, count):
+        """
+        Keep at least count idle connections to each host.
+
+        Call with the number of threads that will make requests at the same
+        time, so every connection they open can be reused.
+        """
+
+        with self.lock:
+            self.max_idle = max(self.max_idle, count)
+
+    def get(self, url, headers=None):
+        """Return the (decompressed) body of the response to a GET of url."""
+
+        return self.request("GET", url, None, headers)
+
+    def post(self, url, body, headers=None):
+        """Return the (decompressed) body of the response to a POST to url."""
+
+        return self.request("POST", url, body, headers)
+
+    def request(self, method, url, body=None, headers=None):
+        """Return the (decompressed) body of the response to a request."""
+
+        with self.open(method, url, body, headers) as response:
+            return response.read()
+
+    def open(self, method, url, body=None, headers=None):
+        """
+        Send a request and return the Response, before the body has been read.
+
+        The Response is a file-like object that can be read (decompressed) a
+        piece at a time; the connection goes back to the pool when it has been
+        read to the end (or is closed if the Response is closed first).
+        Redirects are followed (see REDIRECTS), up to MAX_REDIRECTS times.
+        """
+
+        cache = self.cache
+        key = None
+        if cache is not None:
+            key = cache.key(method, url, body)
+            data = cache.load(key)
+            if data is not None:
+                self.record_hit(endpoint_of(url))
+                return CachedResponse(data)
+            if cache.mode == "replay":
+                raise CacheMiss(url)
+        original = method, url
+        for _ in range(MAX_REDIRECTS + 1):
+            result = self.send_request(method, url, body, headers)
+            location = None
+            if result.status in REDIRECTS:
+                location = result.response.getheader("Location")
+            if not location:
+                if key is not None:
+                    # Saved for the original request, not the redirected one
+                    (result.method, result.url), result.cache_key = original, key
+                return result
+            # Read the rest of the response so the connection can be reused.
+            result.read()
+            url = urljoin(url, location)
+            if not REDIRECTS[result.status]:
+                method, body = "GET", None
+        raise HTTPError(url, result.status, "Too many redirects")
+
+    def send_request(self, method, url, body=None, headers=None):
+        """Send a request and return the Response (without following redirects)."""
+
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        if parts.scheme == "http" and self.proxy(host):
+            # A plain HTTP proxy is sent the whole URL.
+            path = "http://{0}{1}".format(parts.netloc, path)
+        all_headers = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        all_headers.update(headers or {})
+        start = time.time()
+        connection, is_new = self.connection(host)
+        try:
+            response = self.send(connection, method, path, body, all_headers)
+        except (httplib.HTTPException, socket.error):
+            if is_new:
+                connection.close()
+                raise
+            # The server closed the idle connection; try again with a new one.
+            connection.close()
+            connection, is_new = self.new_connection(host), True
+            try:
+                response = self.send(connection, method, path, body, all_headers)
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                raise
+        sent = len(body) if body else 0
+        result = Response(
+            self, host, endpoint_of(url), connection, response, is_new, sent, start
+        )
+        if response.status >= 400:
+            # Read the rest of the response so the connection can be reused.
+            result.read()
+            raise HTTPError(url, response.status, response.reason)
+        return result
+
+    @staticmethod
+    def send(connection, method, path, body, headers):
+        """Send the request on connection and return the response (not read)."""
+
+        connection.request(method, path, body, headers)
+        return connection.getresponse()
+
+    def proxy(self, host):
+        """Return the netloc of the proxy for host (scheme, netloc), or None."""
+
+        scheme, netloc = host
+        proxy = self.proxies.get(scheme)
+        if not proxy or proxy_bypass(netloc.split(":")[0]):
+            return None
+        return urlsplit(proxy).netloc or proxy
+
+    def new_connection(self, host):
+        """Return a new (unopened) connection to host, a (scheme, netloc) tuple."""
+
+        scheme, netloc = host
+        proxy = self.proxy(host)
+        if scheme == "https":
+            if proxy:
+                # Connect to the proxy, and tunnel to the host with CONNECT.
+                connection = httplib.HTTPSConnection(proxy, timeout=self.timeout)
+                connection.set_tunnel(netloc)
+                return connection
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+        return httplib.HTTPConnection(proxy or netloc, timeout=self.timeout)
+
+    def connection(self, host):
+        """Return an idle connection to host (or a new one) and True if it is new."""
+
+        with self.lock:
+            connections = self.idle.get(host)
+            if connections:
+                return connections.pop(), False
+        return self.new_connection(host), True
+
+    def release(self, host, connection):
+        """Return a connection to the pool (or close it if the pool is full)."""
+
+        with self.lock:
+            connections = self.idle.setdefault(host, [])
+            if len(connections) < self.max_idle:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def record(self, endpoint, is_new, sent, received, latency):
+        """Add a request to the statistics for the endpoint."""
+
+        with self.lock:
+            stats = self.endpoint_stats(endpoint)
+            stats["requests"] += 1
+            stats["handshakes"] += 1 if is_new else 0
+            stats["sent"] += sent
+            stats["received"] += received
+            stats["latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+
+    def record_hit(self, endpoint):
+        """Add a response from the cache to the statistics for the endpoint."""
+
+        with self.lock:
+            self.endpoint_stats(endpoint)["cached"] += 1
+
+    def endpoint_stats(self, endpoint):
+        """Return the statistics for endpoint (call with the lock held)."""
+
+        if endpoint not in self.stats:
+            self.stats[endpoint] = {
+                "requests": 0,
+                "cached": 0,
+                "handshakes": 0,
+                "sent": 0,
+                "received": 0,
+                "latency": 0.0,
+                "max_latency": 0.0,
+            }
+        return self.stats[endpoint]
+
+    def report(self):
+        """Return a list of lines (text) with the statistics for each endpoint."""
+
+        lines = []
+        with self.lock:
+            for endpoint in sorted(self.stats):
+                stats = self.stats[endpoint]
+                msg = (
+                    "{0}: {1} requests, {2} from the cache, {3} handshakes, "
+                    "{4} bytes sent, {5} bytes received, "
+                    "latency {6:.3f}s average, {7:.3f}s max"
+                )
+                lines.append(
+                    msg.format(
+                        endpoint,
+                        stats["requests"],
+                        stats["cached"],
+                        stats["handshakes"],
+                        stats["sent"],
+                        stats["received"],
+                        stats["latency"] / max(stats["requests"], 1),
+                        stats["max_latency"],
+                    )
+                )
+        return lines
+
+    def close(self):
+        """Close all the idle connections."""
+
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+
+# The transport used by the FMSS scripts.
+transport = Transport()
+
+
+def get(url, headers=None):
+    """Return the body of the response to a GET of url with the shared transport."""
+
+    return transport.get(url, headers)
+
+
+def post(url, body, headers=None):
+    """Return the body of the response to a POST to url with the shared transport."""
+
+    return transport.post(url, body, headers)
+
+
+def open_url(method, url, body=None, headers=None):
+    """Return the Response (not read yet) to a request with the shared transport."""
+
+    return transport.open(method, url, body, headers)
+
+
+def keep_idle(count):
+    """Keep at least count idle connections to each host in the shared transport."""
+
+    transport.keep_idle(count)
+
+
+def use_cache(mode="record", folder=CACHE_FOLDER, ttl=CACHE_TTL):
+    """
+    Use a response cache with the shared transport.
+
+    mode is "record" (use a saved response if it is younger than ttl seconds,
+    otherwise make the request and save the response), "replay" (only use
+    saved responses), or None (do not use the cache).
+    """
+
+    transport.cache = ResponseCache(folder, mode, ttl) if mode else None
+
+
+def cache_mode(argv):
+    """Return the cache mode for the --record or --replay command line options."""
+
+    if "--replay" in argv:
+        return "replay"
+    if "--record" in argv:
+        return "record"
+    return None
+
+
+def print_report():
+    """Print the statistics for each endpoint used by the shared transport."""
+
+    for line in transport.report():
+        print(line)
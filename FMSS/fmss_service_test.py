@@ -6,16 +6,15 @@ Note: Worked with the older REST service as of June 21, 2016.
 The old webservice was retired.
 As of June 4, 2018, this worked with the new SOAP services (still underdevelopment)
 
+The request is made with the shared transport in `fmss_http.py`, which prints
+the number of handshakes, bytes transferred and latency.
+
 Written for Python 2.7; it may with Python 3.x.
 """
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-try:
-    import urllib2
-except ImportError:
-    # Python 3 replacement
-    import urllib.request as urllib2
+import fmss_http
 
 
 endpoint1 = "https://mif.pfmd.nps.gov/meaweb/services/FMSSGISLOCQ"
@@ -98,7 +97,6 @@ headers = {
     "Content-Length": "{0}".format(len(encoded_query)),
 }
 
-request = urllib2.Request(url=endpoint, headers=headers, data=encoded_query)
-
-response = urllib2.urlopen(request).read()
+response = fmss_http.post(endpoint, encoded_query, headers)
 print(response)
+fmss_http.print_report()
@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the FMSS web services, for testing without the network.
+
+Serves the paged JSON REST service used by `fmss.py`:
+    /fmss/api/locations?siteid={site}&page={page}
+    /fmss/api/assets?siteid={site}&page={page}
+
+and the SOAP queries used by `fmss2.py` and `fmss_service_test.py` (POST a
+SOAP envelope with any of the LO2 (asset code), SITEID, LOCATION, or FRPP):
+    .../services/FMSSGISLOCQ    (locations)
+    .../services/FMSSGISFRPPQ   (real property records)
+    .../services/FMSSGISASSETQ  (assets)
+    .../services/FMSSGISWOQ     (work orders)
+
+The data is synthetic, but it is always the same for a site, so the output of
+a client can be compared between runs.  The empty sites in `fmss.sites` have
+no data, and the amount of data at the other sites can be scaled.  Each
+response can be delayed (plus a random jitter) to simulate the network
+latency of the real service, and a fraction of the requests can fail with a
+503 error.  The server keeps connections open (HTTP/1.1) and sends a gzip
+response when the client asks for one, like the real service.
+See `benchmark_fmss.py` to measure the clients against it.
+
+Usage:
+
+python mock_fmss.py [port [delay [error_rate [scale]]]]
+
+or in a test:
+
+import fmss
+import fmss2
+import mock_fmss
+# on a free port, in a background thread
+server = mock_fmss.start(delay=0.05, scale=2.0, error_rate=0.01, jitter=0.02)
+fmss.location_url = server.base_url + "/fmss/api/locations?siteid={0}&page={1}"
+fmss2.location_endpoint = server.base_url + "/meaweb/services/FMSSGISLOCQ"
+...
+server.shutdown()
+
+Written for Python 2.7; it may with Python 3.x.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gzip
+import io
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    # Python 3 replacement
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+PAGE_SIZE = 25
+
+# Sites with no data (see fmss.sites)
+EMPTY_SITES = ["P165", "P119", "P124", "P125"]
+
+STATUSES = [
+    ("OPERATING", "OPERATING"),
+    ("EXCESS", "OPERATING"),
+    ("PLANNED", "NOTREADY"),
+    ("REMOVED", "DECOMMISSIONED"),
+]
+
+ASSET_CODES = ["1100", "1300", "2100", "3100", "4100", "5100", "7100"]
+
+
+def site_size(site_id, scale=1.0):
+    """Return the number of (synthetic) locations or assets at a site."""
+
+    if site_id in EMPTY_SITES:
+        return 0
+    seed = sum(ord(c) * (i + 1) for i, c in enumerate(site_id))
+    return int((40 + seed % 160) * scale)
+
+
+def make_location(site_id, index):
+    """Return a synthetic location like the ones from the REST service."""
+
+    number = int(site_id[1:]) * 10000 + index
+    status, max_status = STATUSES[index % len(STATUSES)]
+    return {
+        "LOCATIONSID": 5000000000 + number,
+        "STATUS": {"maxvalue": max_status, "Value": status},
+        "SOURCESYSID": "",
+        "DESCRIPTION": "Location {0} at {1}".format(index, site_id),
+        "LO11": "SF",
+        "LO6": round(1000 + index * 17.25, 2),
+        "CHANGEBY": "MOCK",
+        "LO2": ASSET_CODES[index % len(ASSET_CODES)],
+        "LOCHIERARCHY": {
+            "ORGID": "NPS",
+            "LOCHIERARCHYID": 1500000000 + number,
+            "SYSTEMID": "PRIMARY",
+            "PARENT": site_id if index % 10 == 0 else "{0}".format(number - index % 10),
+        },
+        "SITEID": site_id,
+        "LOCATION": "{0}".format(number),
+        "SITE": {"SITEUID": site_id[1:], "PARKALPHA": site_id},
+        "LO5": index % 100,
+        "ORGID": "NPS",
+        "LO14": "",
+        "LO9": round(index * 3.5, 2),
+        "LOCOPER": {
+            "FL03": "" if index % 7 else "4",
+            "SHIFTNUM": "",
+            "LOCOPERID": 3000000000 + number,
+            "WARRANTYEXPDATE": None,
+        },
+        "CHANGEDATE": "2014-02-14T12:24:44-07:00",
+        "LO7": round((index % 50) / 100.0, 3),
+    }
+
+
+def make_asset(site_id, index):
+    """Return a synthetic asset like the ones from the REST service."""
+
+    number = int(site_id[1:]) * 10000 + index
+    return {
+        "ASSETTYPE": "EQUIPMENT",
+        "EQ4": ASSET_CODES[index % len(ASSET_CODES)],
+        "ASSETID": 7000000000 + number,
+        "ASSETNUM": "{0}".format(number),
+        "ASSETUID": 8000000000 + number,
+        "LOCATION": "{0}".format(number - index % 10),
+        "DESCRIPTION": "Asset {0} at {1}".format(index, site_id),
+        "EQ19": None,
+        "EQ20": None,
+        "EQ21": None,
+        "EQ5": None,
+        "EQ6": None,
+        "EQ7": "{0}".format(index % 5 + 1),
+        "EQ8": "EA",
+        "EQ9": None,
+        "INSTALLDATE": "2001-06-01T00:00:00-08:00",
+        "REPLACECOST": round(500 + index * 12.5, 2),
+        "ORGID": "NPS",
+        "LOCHIERARCHY": {"ORGID": "NPS", "PARENT": site_id},
+        "LOCOPER": {"FL03": ""},
+    }
+
+
+def rest_page(make_item, site_id, page, scale=1.0, page_size=PAGE_SIZE):
+    """Return a page of the REST service as a dictionary."""
+
+    total = site_size(site_id, scale)
+    total_pages = (total + page_size - 1) // page_size
+    start = (page - 1) * page_size
+    items = [make_item(site_id, i) for i in range(start, min(start + page_size, total))]
+    return {
+        "TotalItems": total,
+        "TotalPages": total_pages,
+        "PagedList": items,
+        "Page": page,
+        "PageSize": page_size,
+    }
+
+
+SOAP_NAMESPACE = "http://www.ibm.com/maximo"
+
+SOAP_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<soapenv:Envelope xmlns:soapenv="http://www.w3.org/2003/05/soap-envelope">
+<soapenv:Body>
+<{0}Response xmlns="{1}" rsCount="{2}" rsStart="0" rsTotal="{2}">
+<{3}Set>
+{4}
+</{3}Set>
+</{0}Response>
+</soapenv:Body>
+</soapenv:Envelope>"""
+
+
+def xml_element(tag, value):
+    """Return the XML text for an element (nested for a dictionary value)."""
+
+    if isinstance(value, dict):
+        children = "".join(xml_element(k, v) for k, v in sorted(value.items()))
+        return "<{0}>{1}</{0}>".format(tag, children)
+    if value is None:
+        return "<{0}/>".format(tag)
+    return "<{0}>{1}</{0}>".format(tag, escape("{0}".format(value)))
+
+
+def soap_location(site_id, index):
+    """Return the fields of a synthetic location for the SOAP service."""
+
+    item = make_location(site_id, index)
+    return {
+        "DESCRIPTION": item["DESCRIPTION"],
+        "LO11": item["LO11"],
+        "LO12": "{0}".format(index % 9 + 1),
+        "LO2": item["LO2"],
+        "LO5": item["LO5"],
+        "LO6": item["LO6"],
+        "LO7": item["LO7"],
+        "LO9": item["LO9"],
+        "LOCATION": item["LOCATION"],
+        "LOCHIERARCHY": {"PARENT": item["LOCHIERARCHY"]["PARENT"]},
+        "SITEID": site_id,
+        "STATUS": item["STATUS"]["Value"],
+        "YEARBUILT": 1900 + index % 120,
+    }
+
+
+def make_work_order(site_id, index, number):
+    """Return the fields of the number-th synthetic work order for a location."""
+
+    location = make_location(site_id, index)
+    return {
+        "DESCRIPTION": "Work order {0} for {1}".format(number, location["DESCRIPTION"]),
+        "ESTLABCOST": round(250 + (index * 7 + number) % 40 * 125.0, 2),
+        "LO2": location["LO2"],
+        "LOCATION": location["LOCATION"],
+        "REPORTDATE": "2018-0{0}-15T08:00:00-08:00".format(number % 9 + 1),
+        "SITEID": site_id,
+        "STATUS": ["WAPPR", "APPR", "INPRG", "COMP"][(index + number) % 4],
+        "WONUM": "{0}-{1}".format(location["LOCATION"], number),
+        "WORKTYPE": ["CM", "PM", "EM"][number % 3],
+    }
+
+
+def soap_frpp(site_id, index):
+    """Return the fields of the FRPP (real property) record of a location."""
+
+    location = make_location(site_id, index)
+    return {
+        "DESCRIPTION": location["DESCRIPTION"],
+        "FRPPNUMBER": location["LOCATION"],
+        "LEGALINTEREST": ["G", "L", "S"][index % 3],
+        "LOCATION": location["LOCATION"],
+        "PREDOMINANTUSE": ["Office", "Housing", "Storage", "Other"][index % 4],
+        "SITEID": site_id,
+        "SQFT": round(location["LO6"] / 10.0, 1),
+        "STATUS": location["STATUS"]["Value"],
+    }
+
+
+def split_location(location):
+    """Return the site and index of a synthetic location number (or None)."""
+
+    try:
+        number = int(location)
+    except (TypeError, ValueError):
+        return None
+    return "P{0:03d}".format(number // 10000), number % 10000
+
+
+def query_locations(query, scale=1.0):
+    """
+    Yield the (site, index) of the locations that match the query.
+
+    query is a dictionary with the (optional) SITEID, LO2, LOCATION, and
+    FRPP (the FRPPNUMBER, which is the same as the LOCATION) in the request.
+    """
+
+    location = query.get("LOCATION") or query.get("FRPP")
+    if location is not None:
+        found = split_location(location)
+        if found is None:
+            return
+        site_id, index = found
+        if query.get("SITEID") not in (None, site_id):
+            return
+        indexes = [index] if index < site_size(site_id, scale) else []
+    else:
+        site_id = query.get("SITEID")
+        if site_id is None:
+            return
+        indexes = range(site_size(site_id, scale))
+    asset_code = query.get("LO2")
+    for index in indexes:
+        if asset_code in (None, ASSET_CODES[index % len(ASSET_CODES)]):
+            yield site_id, index
+
+
+def soap_location_items(query, scale):
+    return [soap_location(site, index) for site, index in query_locations(query, scale)]
+
+
+def soap_frpp_items(query, scale):
+    return [soap_frpp(site, index) for site, index in query_locations(query, scale)]
+
+
+def soap_asset_items(query, scale):
+    # Assets are numbered like the locations they are in.
+    return [
+        make_asset(site, index) for site, index in query_locations(query, scale)
+    ]
+
+
+def soap_work_order_items(query, scale):
+    return [
+        make_work_order(site, index, number)
+        for site, index in query_locations(query, scale)
+        for number in range(index % 3)
+    ]
+
+
+# The SOAP services by the end of the path: (service, element tag, item maker)
+SOAP_SERVICES = {
+    "FMSSGISLOCQ": ("FMSSGISLOC", "LOCATIONS", soap_location_items),
+    "FMSSGISFRPPQ": ("FMSSGISFRPP", "FRPP", soap_frpp_items),
+    "FMSSGISASSETQ": ("FMSSGISASSET", "ASSETS", soap_asset_items),
+    "FMSSGISWOQ": ("FMSSGISWO", "WORKORDER", soap_work_order_items),
+}
+
+# The query fields (in any SOAP request) that select the items.
+QUERY_FIELDS = ["SITEID", "LO2", "LOCATION", "FRPP"]
+
+
+def soap_response(service_path, request, scale=1.0):
+    """Return the SOAP response (text) to a request, or None for an unknown path."""
+
+    service_name = service_path.rstrip("/").split("/")[-1]
+    if service_name not in SOAP_SERVICES:
+        return None
+    service, tag, make_items = SOAP_SERVICES[service_name]
+    query = {}
+    for field in QUERY_FIELDS:
+        value = query_value(request, field)
+        if value:
+            query[field] = value
+    items = make_items(query, scale)
+    body = "\n".join(xml_element(tag, item) for item in items)
+    return SOAP_TEMPLATE.format(
+        "Query" + service, SOAP_NAMESPACE, len(items), service, body
+    )
+
+
+def query_value(body, tag):
+    """Return the value of the first (namespaced) tag in the request body."""
+
+    match = re.search(r"<(?:\w+:)?{0}\b[^>]*>([^<]*)<".format(tag), body)
+    return match.group(1).strip() if match else None
+
+
+REST_PATHS = {"/fmss/api/locations": make_location, "/fmss/api/assets": make_asset}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Responds to the FMSS web service requests with synthetic data."""
+
+    # Keep the connection open for the next request
+    protocol_version = "HTTP/1.1"
+    # The headers and body are written separately; do not wait to send the body
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in REST_PATHS:
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        try:
+            site_id = query["siteid"][0]
+            page = int(query.get("page", ["1"])[0])
+        except (KeyError, ValueError):
+            self.send_error(400)
+            return
+        data = rest_page(REST_PATHS[url.path], site_id, page, self.server.scale)
+        self.respond(json.dumps(data).encode("utf-8"), "application/json")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = self.rfile.read(length).decode("utf-8")
+        text = soap_response(self.path, request, self.server.scale)
+        if text is None:
+            self.send_error(404)
+            return
+        self.respond(text.encode("utf-8"), "application/soap+xml; charset=utf-8")
+
+    def respond(self, body, content_type):
+        fail, delay = self.server.next_request()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            body = b"Service Unavailable (simulated)"
+            self.send_response(503)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", "{0}".format(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            buffer = io.BytesIO()
+            with gzip.GzipFile(fileobj=buffer, mode="wb") as gzip_file:
+                gzip_file.write(body)
+            body = buffer.getvalue()
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", "{0}".format(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # pylint: disable=arguments-differ
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    """A multi-threaded HTTP server for the mock FMSS services."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port=0,
+        delay=0,
+        scale=1.0,
+        verbose=False,
+        error_rate=0,
+        jitter=0,
+        seed=None,
+    ):
+        # pylint: disable=too-many-arguments
+        HTTPServer.__init__(self, ("127.0.0.1", port), MockHandler)
+        self.delay = delay
+        self.scale = scale
+        self.verbose = verbose
+        self.error_rate = error_rate
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self.base_url = "http://127.0.0.1:{0}".format(self.server_address[1])
+
+    def next_request(self):
+        """Count a request, and return if it fails and how long to delay it."""
+
+        with self.lock:
+            self.request_count += 1
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.error_count += 1
+            delay = self.delay + self.random.uniform(0, self.jitter)
+        return fail, delay
+
+
+def start(port=0, delay=0, scale=1.0, verbose=False, **options):
+    """
+    Start a MockServer in a background thread and return it.
+
+    options are the error_rate (the fraction of requests that get a 503 error),
+    the jitter (a random extra delay up to jitter seconds), and the seed for the
+    random errors and jitter.
+    """
+
+    server = MockServer(port, delay, scale, verbose, **options)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    PORT = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    DELAY = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    ERROR_RATE = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+    SCALE = float(sys.argv[4]) if len(sys.argv) > 4 else 1.0
+    SERVER = MockServer(PORT, DELAY, SCALE, True, ERROR_RATE)
+    print("Mock FMSS service at {0}".format(SERVER.base_url))
+    try:
+        SERVER.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Tests the retries and circuit breaker in `fmss.py` (used by the REST client
+and the SOAP client in `fmss2.py`) against `mock_fmss.py`, and the conversion
+of the SOAP text to column types in `fmss2.py`.
+
+Usage:
+
+python -m unittest test_fmss
+
+or `python -m pytest` in this folder.
+
+Written for Python 2.7; it may work with Python 3.x.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+import unittest
+
+import fmss
+import fmss_http
+import mock_fmss
+
+try:
+    import fmss2
+except ImportError:
+    # fmss2 needs pyodbc
+    fmss2 = None
+
+
+class Quiet(object):
+    """A replacement for sys.stdout that ignores the client's output."""
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+class PagerTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = fmss.BACKOFF, fmss.BREAKER_RESET, sys.stdout
+        fmss.BACKOFF = 0.01
+        fmss.BREAKER_RESET = 0.05
+        sys.stdout = Quiet()
+        fmss_http.transport = fmss_http.Transport()
+        self.parks = list(fmss.sites)
+
+    def tearDown(self):
+        fmss.BACKOFF, fmss.BREAKER_RESET, sys.stdout = self.saved
+
+    def rows(self, pager, workers, **options):
+        """Return the asset rows from a mock service started with options."""
+
+        server = mock_fmss.start(seed=1, **options)
+        url = server.base_url + "/fmss/api/assets?siteid={0}&page={1}"
+        try:
+            pager.url_template = url
+            rows = fmss.paged_rows(url, fmss.asset_data, self.parks, workers, pager)
+            return list(rows), server
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_no_rows_lost_when_flaky(self):
+        expected, _ = self.rows(fmss.Pager(None), 4)
+        for workers in (1, 8):
+            # A low breaker limit, so the breaker opens and requests must wait
+            pager = fmss.Pager(None, retries=10, budget=100, breaker_limit=2)
+            rows, server = self.rows(pager, workers, error_rate=0.3)
+            self.assertGreater(server.error_count, 0)
+            self.assertEqual(pager.failed, [])
+            self.assertEqual(rows, expected)
+
+    def test_down_service_fails_after_max_wait(self):
+        pager = fmss.Pager(None, max_wait=0.5)
+        rows, server = self.rows(pager, 8, error_rate=1.0)
+        self.assertEqual(rows, [])
+        self.assertEqual(len(pager.failed), len(self.parks))
+        # Fewer requests than retrying every page (one trial per BREAKER_RESET)
+        self.assertLess(server.request_count, len(self.parks) * (fmss.MAX_RETRIES + 1))
+
+    @unittest.skipIf(fmss2 is None, "pyodbc is not installed")
+    def test_no_location_rows_lost_when_flaky(self):
+        saved = fmss2.location_endpoint
+        try:
+            server = mock_fmss.start(seed=1)
+            fmss2.location_endpoint = server.base_url + "/meaweb/services/FMSSGISLOCQ"
+            expected = list(fmss2.all_location_rows())
+            server.shutdown()
+            server.server_close()
+            server = mock_fmss.start(seed=1, error_rate=0.3)
+            fmss2.location_endpoint = server.base_url + "/meaweb/services/FMSSGISLOCQ"
+            # The default retry budget, which is for each query (not each site)
+            pager = fmss.Pager(fmss2.location_endpoint, retries=10, breaker_limit=2)
+            rows = list(fmss2.all_location_rows(workers=8, pager=pager))
+            server.shutdown()
+            server.server_close()
+        finally:
+            fmss2.location_endpoint = saved
+        self.assertGreater(server.error_count, 0)
+        self.assertEqual(pager.failed, [])
+        self.assertEqual(rows, expected)
+
+
+@unittest.skipIf(fmss2 is None, "pyodbc is not installed")
+class TypedRowTest(unittest.TestCase):
+    def test_fractional_int_is_rejected(self):
+        self.assertEqual(fmss2.as_int(" 12.0 "), 12)
+        self.assertIsNone(fmss2.as_int(""))
+        for value in ("12.7", "-0.5", "Infinity"):
+            self.assertRaises(ValueError, fmss2.as_int, value)
+
+
+if __name__ == "__main__":
+    unittest.main()
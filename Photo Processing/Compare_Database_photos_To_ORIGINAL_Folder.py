@@ -20,6 +20,8 @@ import sys
 import pyodbc
 
 import csv23
+import db_fetch
+import photo_match
 
 
 def get_connection_or_die(server, database):
@@ -55,23 +57,27 @@ def get_connection_or_die(server, database):
 
 
 def get_database_photos(connection):
+    """
+    Return the set of web photo paths (lower case) in the database, or None if
+    there is an error.
+
+    The rows are fetched in batches as the set is built, so a database error
+    can happen while reading the rows as well as when running the query.
+    """
     try:
-        rows = (
-            connection.cursor()
-            .execute(
-                """
+        rows = db_fetch.query(
+            connection,
+            """
             SELECT REPLACE(ATCHLINK, 'https://akrgis.nps.gov/fmss/photos/web/', '')
               FROM gis.AKR_ATTACH_evw
              WHERE ATCHTYPE = 'Photo'
                AND ATCHLINK LIKE 'https://akrgis.nps.gov/fmss/photos/web/%'
-        """
-            )
-            .fetchall()
+        """,
         )
+        return set([row[0].lower() for row in rows])
     except pyodbc.Error as de:
         print("Database error ocurred", de)
-        rows = None
-    return rows
+        return None
 
 
 def files_for_folders(root):
@@ -136,6 +142,19 @@ def files_in_csv(csv_path):
     return files
 
 
+def print_with_suggestions(missing, candidates):
+    """
+    Print each path in missing followed by the likely matches in candidates.
+
+    candidates is indexed once, so this is fast even for large lists.
+    """
+    matcher = photo_match.PathMatcher(candidates)
+    for path in sorted(list(missing)):
+        print("  {0}".format(path))
+        for _, match, reason in matcher.suggest(path):
+            print("      maybe: {0} ({1})".format(match, reason))
+
+
 def is_image(name):
     ext = os.path.splitext(name)[1].lower()
     return ext in [".jpg", ".jpeg", ".png", ".gif"]
@@ -152,7 +171,9 @@ if __name__ == "__main__":
     # duplicate paths in the database are OK;
     #  two different features could be in the same photo
     # so we want to unique-ify the list of photo links
-    db_photo_set = set([row[0].lower() for row in get_database_photos(conn)])
+    db_photo_set = get_database_photos(conn)
+    if db_photo_set is None:
+        sys.exit()
     print("Found {0} unique files in the Database.".format(len(db_photo_set)))
 
     csv_file = "PhotoCSVLoader.csv"
@@ -184,23 +205,20 @@ if __name__ == "__main__":
                 len(fs_not_db)
             )
         )
-        for i in sorted(list(fs_not_db)):
-            print("  {0}".format(i))
+        print_with_suggestions(fs_not_db, db_not_fs | csv_not_fs)
     if db_not_fs:
         print(
             "ERROR: The following {0} files are in the Database but not the Filesystem".format(
                 len(db_not_fs)
             )
         )
-        for i in sorted(list(db_not_fs)):
-            print("  {0}".format(i))
+        print_with_suggestions(db_not_fs, fs_photo_set - db_photo_set)
     if csv_not_fs:
         print(
             "ERROR: The following {0} files are in the CSV but not the Filesystem".format(
                 len(csv_not_fs)
             )
         )
-        for i in sorted(list(csv_not_fs)):
-            print("  {0}".format(i))
+        print_with_suggestions(csv_not_fs, fs_not_db)
     if not fs_not_db and not db_not_fs and not csv_not_fs:
         print("Woot, Woot, No issues found.")
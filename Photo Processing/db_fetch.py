@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Stream the rows of a database query in batches.
+
+`cursor.fetchall()` creates a pyodbc Row object for every row in the result
+before any of them can be processed.  These functions use `cursor.fetchmany()`
+to get the rows in batches, and yield each row as a plain tuple, so memory use
+is independent of the size of the result.
+
+Works with any DB-API 2.0 connection (pyodbc, sqlite3, ...).
+
+Usage:
+
+import db_fetch
+for row in db_fetch.query(connection, "SELECT a, b FROM t WHERE c = ?", ["x"]):
+    # row is a tuple (a, b)
+
+Also provides `sqlite_connection()`, a local stand-in for the facilities
+database for testing scripts that read or write `gis.AKR_ATTACH_evw` without
+access to the production database.
+
+Written for Python 2.7 and 3.6.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sqlite3
+
+# The number of rows to fetch from the database in each round trip.
+# Larger values use more memory, smaller values make more round trips.
+BATCH_SIZE = 5000
+
+
+def iter_rows(cursor, batch_size=BATCH_SIZE):
+    """
+    Yield each row in the current result set of cursor as a tuple.
+
+    The rows are fetched batch_size rows at a time.
+    The cursor is closed when the results are exhausted (or the generator is closed).
+    """
+
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield tuple(row)
+    finally:
+        cursor.close()
+
+
+def query(connection, sql, params=None, batch_size=BATCH_SIZE):
+    """
+    Execute sql (with optional params) on a new cursor for connection.
+
+    The SQL is executed immediately (so database errors are raised by this
+    function), but the rows are not fetched until the returned iterator
+    (see iter_rows()) is consumed.
+    """
+
+    cursor = connection.cursor()
+    if params is None:
+        cursor.execute(sql)
+    else:
+        cursor.execute(sql, params)
+    return iter_rows(cursor, batch_size)
+
+
+# A subset of the AKR_ATTACH columns used by the photo processing scripts.
+ATTACH_COLUMNS = [
+    "ATCHLINK",
+    "ATCHTYPE",
+    "UNITCODE",
+    "ATCHALTNAME",
+    "ATCHDATE",
+    "FACLOCID",
+    "FACASSETID",
+    "FEATUREID",
+    "GEOMETRYID",
+    "ATCHNAME",
+    "ATCHSOURCE",
+    "CREATEUSER",
+    "CREATEDATE",
+    "NOTES",
+]
+
+
+def sqlite_connection(path=":memory:", schemas=("gis", "dbo", "sde")):
+    """
+    Return a sqlite3 connection that can stand in for the facilities database.
+
+    Each name in schemas is attached as an in memory database, so schema
+    qualified names like `gis.AKR_ATTACH_evw` work in SQL statements.
+    An empty `gis.AKR_ATTACH_evw` table is created with the ATTACH_COLUMNS.
+    """
+
+    connection = sqlite3.connect(path)
+    for schema in schemas:
+        connection.execute("ATTACH DATABASE ':memory:' AS {0}".format(schema))
+    if "gis" in schemas:
+        columns = ", ".join("{0} TEXT".format(name) for name in ATTACH_COLUMNS)
+        connection.execute("CREATE TABLE gis.AKR_ATTACH_evw ({0})".format(columns))
+    return connection
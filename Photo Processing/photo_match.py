@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Suggest likely matches for photo paths that are missing from a list of paths.
+
+Used by `Compare_Database_photos_To_ORIGINAL_Folder.py` to help find the
+misspelled, renamed or moved photo file for a database or CSV record.
+
+Paths are indexed once, so a lookup does not compare against every path:
+* A dictionary of normalized keys finds case, separator, extension and
+  numeric suffix variants of the full path or just the file name (moved files).
+* A deletion-variant index (a hash of every string made by deleting up to
+  max_distance characters from each file name, per park) finds file names
+  within a small edit distance with a few hash lookups, in the manner of the
+  SymSpell algorithm.  The candidates are then checked with a real edit distance.
+
+Usage:
+
+import photo_match
+matcher = photo_match.PathMatcher(filesystem_paths)
+for score, path, reason in matcher.suggest("akro/folder/name.jpg"):
+    print(path, reason)
+
+Written for Python 2.7 and 3.6.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import re
+
+# Extensions that are considered equivalent when matching paths
+EXTENSION_ALIASES = {
+    ".jpeg": ".jpg",
+    ".jpe": ".jpg",
+    ".tiff": ".tif",
+}
+
+# Matches a numeric suffix added to make a file name unique,
+# i.e. "name-1", "name_02", "name (3)"
+SUFFIX_PATTERN = re.compile(r"(?:[ _-]+\d{1,3}|\s*\(\d{1,3}\))$")
+
+SEPARATOR_PATTERN = re.compile(r"[ _.-]+")
+
+
+def split_ext(path):
+    """Return the (path without extension, lowercase extension) of path."""
+
+    slash = path.rfind("/")
+    dot = path.rfind(".")
+    if dot <= slash + 1:
+        return path, ""
+    return path[:dot], path[dot:].lower()
+
+
+def levenshtein(a, b, limit=None):
+    """
+    Return the edit distance between strings a and b.
+
+    If limit is given, the search is abandoned as soon as the distance is
+    known to exceed limit, and limit + 1 is returned.
+    """
+
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            cost = 0 if char_a == char_b else 1
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            )
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def deletions(word, max_distance):
+    """Return the set of strings made by deleting up to max_distance characters from word."""
+
+    results = set([word])
+    edge = set([word])
+    for _ in range(max_distance):
+        edge = set(w[:i] + w[i + 1 :] for w in edge for i in range(len(w)))
+        results |= edge
+    return results
+
+
+class PathMatcher(object):
+    """
+    An index of photo paths (i.e. "unit/folder/name.jpg") for suggesting matches.
+
+    Paths use a forward slash as the separator.
+    """
+
+    # Smaller scores are better matches; edit distance matches are scored
+    # as EDIT_SCORE + distance.
+    SCORES = {
+        "case": 1,
+        "extension": 2,
+        "separator": 3,
+        "suffix number": 4,
+        "moved": 5,
+        "moved, renamed": 6,
+    }
+    EDIT_SCORE = 10
+
+    def __init__(self, paths, max_distance=1):
+        self.max_distance = max_distance
+        self.by_key = {}
+        self.by_name_key = {}
+        self.by_deletion = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path):
+        """Add path to the index."""
+
+        self.by_key.setdefault(self.full_key(path), []).append(path)
+        self.by_name_key.setdefault(self.name_key(path), []).append(path)
+        unit, stem = self.unit_stem(path)
+        for variant in deletions(stem, self.max_distance):
+            self.by_deletion.setdefault((unit, variant), []).append(path)
+
+    @staticmethod
+    def normalize(path, drop_suffix=False):
+        """
+        Return a lowercase version of path with equivalent extensions, and
+        without separators (space, dash, underscore, dot) in the names.
+        If drop_suffix is True, a trailing numeric suffix is also removed.
+        """
+
+        base, ext = split_ext(path.lower().replace("\\", "/"))
+        ext = EXTENSION_ALIASES.get(ext, ext)
+        if drop_suffix:
+            base = SUFFIX_PATTERN.sub("", base)
+        parts = [SEPARATOR_PATTERN.sub("", part) for part in base.split("/")]
+        return "/".join(parts) + ext
+
+    @staticmethod
+    def unit_stem(path):
+        """Return the lowercase (unit, file name without extension) of path."""
+
+        base = split_ext(path.lower())[0]
+        return base.split("/", 1)[0], base.rsplit("/", 1)[-1]
+
+    def full_key(self, path):
+        return self.normalize(path, drop_suffix=True)
+
+    def name_key(self, path):
+        return self.full_key(path).rsplit("/", 1)[-1]
+
+    @staticmethod
+    def reason(path, candidate):
+        """Describe the difference between path and a candidate with the same key."""
+
+        if path.lower() == candidate.lower():
+            return "case"
+        base, ext = split_ext(path.lower())
+        other_base, other_ext = split_ext(candidate.lower())
+        if base == other_base:
+            return "extension"
+        norm = PathMatcher.normalize
+        if norm(path) == norm(candidate):
+            return "separator"
+        return "suffix number"
+
+    def suggest(self, path, limit=3):
+        """
+        Return up to limit (score, candidate, reason) tuples for path, best first.
+
+        path is not suggested as a match for itself.
+        """
+
+        found = {}
+
+        def found_match(score, candidate, reason):
+            if candidate != path and (
+                candidate not in found or score < found[candidate][0]
+            ):
+                found[candidate] = (score, reason)
+
+        for candidate in self.by_key.get(self.full_key(path), []):
+            reason = self.reason(path, candidate)
+            found_match(self.SCORES[reason], candidate, reason)
+        name = path.lower().rsplit("/", 1)[-1]
+        for candidate in self.by_name_key.get(self.name_key(path), []):
+            if candidate.lower().rsplit("/", 1)[-1] == name:
+                found_match(self.SCORES["moved"], candidate, "moved")
+            else:
+                found_match(self.SCORES["moved, renamed"], candidate, "moved, renamed")
+        unit, stem = self.unit_stem(path)
+        checked = set()
+        for variant in deletions(stem, self.max_distance):
+            for candidate in self.by_deletion.get((unit, variant), []):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                other_stem = self.unit_stem(candidate)[1]
+                distance = levenshtein(stem, other_stem, self.max_distance)
+                if 0 < distance <= self.max_distance:
+                    reason = "edit distance {0}".format(distance)
+                    found_match(self.EDIT_SCORE + distance, candidate, reason)
+        ranked = sorted((s, c, r) for c, (s, r) in found.items())
+        return ranked[:limit]
@@ -12,6 +12,12 @@ Database error:
 EXEC dbo.Calc_Attachments 'DBO.photo_update_20181211';
 ('25000', u'[25000] [Microsoft][ODBC Driver 13 for SQL Server][SQL Server]Transaction count after EXECUTE indicates a mismatching number of BEGIN and COMMIT statements. Previous count = 1, current count = 0. (266) (SQLExecDirectW); [25000] [Microsoft][ODBC Driver 13 for SQL Server][SQL Server]Transaction count after EXECUTE indicates a mismatching number of BEGIN and COMMIT statements. Previous count = 1, current count = 0. (266)')
 
+The photos that are loaded are recorded in PhotoCSVLoader_journal.csv.  If the
+load fails part way through, it can be rerun; the load will resume in the same
+version, and photos that are already in the version are skipped.  When all the
+photos are loaded, the load is marked done in the journal, so the next load
+(even with the same journal) starts a new version.
+
 File paths are hard coded in the script relative to the scipt's location.
 The database connection string and schema are also hardcoded in the script.
 
@@ -25,12 +31,15 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import csv
 import datetime
+from io import open
 import os
 import sys
+import time
 
 import pyodbc
 
 import csv23
+import db_fetch
 
 
 def get_connection_or_die(server, database):
@@ -125,34 +134,188 @@ def make_new_version(conn):
     return None
 
 
-def write_photos(connection, version, photos):
+# The number of rows sent to the database in each executemany() call
+BATCH_SIZE = 1000
+
+LINK_PREFIX = "https://akrgis.nps.gov/fmss/photos/web/"
+
+EXISTING_SQL = (
+    "SELECT ATCHLINK, FACLOCID, FACASSETID, FEATUREID, GEOMETRYID "
+    "FROM gis.AKR_ATTACH_evw WHERE ATCHLINK LIKE ?"
+)
+
+JOURNAL_HEADER = ["KEY", "VERSION", "LOADED"]
+
+# The KEY in the journal row that marks a load (of a version) as done.
+LOAD_DONE = "*DONE*"
+
+INSERT_SQL = (
+    "INSERT INTO gis.AKR_ATTACH_evw "
+    "(ATCHLINK, UNITCODE, ATCHALTNAME, ATCHDATE, FACLOCID, FACASSETID, FEATUREID, GEOMETRYID, ATCHNAME, ATCHSOURCE, CREATEUSER, CREATEDATE, NOTES) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);"
+)
+
+
+def photo_link(photo):
+    """Return the ATCHLINK (web URL) for a photo (a row in the CSV)."""
+    if photo[1]:
+        return "{0}{1}/{2}/{3}".format(LINK_PREFIX, photo[0], photo[1], photo[2])
+    return "{0}{1}/{2}".format(LINK_PREFIX, photo[0], photo[2])
+
+
+def photo_params(photo):
+    """Return the INSERT_SQL parameters for a photo; empty values are NULL."""
+    # UNITCODE,FOLDER,FILENAME,TIMESTAMP,FACLOCID,FACASSETID,FEATUREID,GEOMETRYID,DESCRIPTION,ORIGINALPATH,CREATEUSER,CREATEDATE,NOTES
+    # FOLDER is only used in the link
+    values = [photo[0]] + list(photo[2:13])
+    return [photo_link(photo)] + [i if i else None for i in values]
+
+
+def photo_key(photo):
+    """
+    Return the content key for a photo (a row in the CSV).
+
+    The key is the lowercase unit/folder/filename of the photo and the foreign keys,
+    since the same photo file can be linked to more than one feature.
+    """
+    link = photo_link(photo)[len(LINK_PREFIX) :].lower()
+    return "|".join([link] + [i or "" for i in photo[4:8]])
+
+
+def existing_keys(connection):
+    """
+    Return the set of photo keys in gis.AKR_ATTACH_evw in the current version.
+
+    Uses a single query for all the photos, not one query per photo.
+    """
+    keys = set()
+    for row in db_fetch.query(connection, EXISTING_SQL, [LINK_PREFIX + "%"]):
+        link = row[0][len(LINK_PREFIX) :].lower()
+        keys.add("|".join([link] + [i or "" for i in row[1:]]))
+    return keys
+
+
+def read_journal(journal_path):
+    """
+    Return a list of (key, version, timestamp) rows in the load journal.
+
+    Returns an empty list if there is no journal.
+    """
+    if not os.path.exists(journal_path):
+        return []
+    rows = []
+    with csv23.open(journal_path, "r") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        next(csv_reader)  # skip the header
+        for row in csv_reader:
+            rows.append(tuple(csv23.fix(row)))
+    return rows
+
+
+def open_journal(journal_path):
+    """Open the load journal for appending; a header is written to a new journal."""
+    is_new = not os.path.exists(journal_path)
+    if sys.version_info[0] < 3:
+        journal = open(journal_path, "ab")
+    else:
+        journal = open(journal_path, "a", encoding="utf-8", newline="")
+    if is_new:
+        csv23.write(csv.writer(journal), JOURNAL_HEADER)
+    return journal
+
+
+def insert_photos(cursor, photos, batch_size=BATCH_SIZE, journal=None, version=None):
+    """
+    Insert the photos with a parameterized executemany() in batches of batch_size.
+
+    Uses the pyodbc fast_executemany option (parameter arrays) when available.
+    Works with any DB-API cursor using the qmark parameter style (i.e. sqlite3).
+    Each batch is committed, and if journal (an open file) is provided,
+    the key of each photo in the batch is then recorded in the journal.
+    Returns the number of rows inserted.
+    """
+    if hasattr(cursor, "fast_executemany"):
+        cursor.fast_executemany = True
+    journal_writer = csv.writer(journal) if journal is not None else None
+    count = 0
+    start = time.time()
+    for i in range(0, len(photos), batch_size):
+        batch = photos[i : i + batch_size]
+        cursor.executemany(INSERT_SQL, [photo_params(photo) for photo in batch])
+        cursor.connection.commit()
+        count += len(batch)
+        if journal_writer is not None:
+            now = datetime.datetime.now().isoformat()
+            for photo in batch:
+                csv23.write(journal_writer, [photo_key(photo), version, now])
+            journal.flush()
+    seconds = time.time() - start
+    rate = count / seconds if seconds else float("inf")
+    msg = "Inserted {0} photos in {1:.2f} seconds ({2:.0f} rows/sec)"
+    print(msg.format(count, seconds, rate))
+    return count
+
+
+def new_photos_only(connection, photos, journal_rows):
+    """
+    Return the photos that are not already in the current version of the database.
+
+    Photos in the load journal that are not in the database (i.e. removed during QC)
+    are reported and will be loaded again.
+    """
+    existing = existing_keys(connection)
+    seen = set()
+    new_photos = []
+    skipped = 0
+    duplicates = 0
+    for photo in photos:
+        key = photo_key(photo)
+        if key in existing:
+            skipped += 1
+        elif key in seen:
+            duplicates += 1
+        else:
+            seen.add(key)
+            new_photos.append(photo)
+    if skipped:
+        print("Skipping {0} photos already in the database".format(skipped))
+    if duplicates:
+        print("Skipping {0} duplicate rows in the CSV".format(duplicates))
+    journal_keys = set(row[0] for row in journal_rows if row[0] != LOAD_DONE)
+    missing = [p for p in new_photos if photo_key(p) in journal_keys]
+    if missing:
+        msg = "WARNING: {0} photos in the journal are not in the database."
+        print(msg.format(len(missing)))
+        print("  They will be loaded again.")
+    return new_photos
+
+
+def write_photos(connection, version, photos, journal_path=None):
+    """
+    Add the photos to version in an SDE edit session.
+
+    Photos already in the version are skipped, so a failed load can be rerun.
+    If journal_path is provided, the loaded photos are recorded there.
+    """
     sql = None
+    journal = None
     try:
         with connection.cursor() as wcursor:
             sql = "EXEC sde.set_current_version '{0}';".format(version)
             wcursor.execute(sql)
             sql = "EXEC sde.edit_version '{0}', 1;".format(version)  # Start editing
             wcursor.execute(sql)
-            # UNITCODE,FOLDER,FILENAME,TIMESTAMP,FACLOCID,FACASSETID,FEATUREID,GEOMETRYID,DESCRIPTION,ORIGINALPATH,CREATEUSER,CREATEDATE,NOTES
-            for photo in photos:
-                if photo[1]:
-                    link = "https://akrgis.nps.gov/fmss/photos/web/{0}/{1}/{2}".format(
-                        photo[0], photo[1], photo[2]
-                    )
-                else:
-                    link = "https://akrgis.nps.gov/fmss/photos/web/{0}/{1}".format(
-                        photo[0], photo[2]
-                    )
-                photo_db = [
-                    "'{0}'".format(i) if i else "NULL" for i in photo
-                ]  # all attributes are either string or NULL
-                sql = (
-                    "INSERT gis.AKR_ATTACH_evw "
-                    "(ATCHLINK, UNITCODE, ATCHALTNAME, ATCHDATE, FACLOCID, FACASSETID, FEATUREID, GEOMETRYID, ATCHNAME, ATCHSOURCE, CREATEUSER, CREATEDATE, NOTES) "
-                    "VALUES ('{0}', {1}, {3}, {4}, {5}, {6}, {7}, {8}, {9}, {10}, {11}, {12}, {13});"
-                )
-                sql = sql.format(link, *photo_db)
-                wcursor.execute(sql)
+            sql = EXISTING_SQL
+            journal_rows = read_journal(journal_path) if journal_path else []
+            photos = new_photos_only(connection, photos, journal_rows)
+            sql = INSERT_SQL
+            if journal_path:
+                journal = open_journal(journal_path)
+            insert_photos(wcursor, photos, journal=journal, version=version)
+            if journal is not None:
+                now = datetime.datetime.now().isoformat()
+                csv23.write(csv.writer(journal), [LOAD_DONE, version, now])
+                journal.flush()
             # Do automated calcs
             sql = "EXEC dbo.Calc_Attachments '{0}';".format(version)
             wcursor.execute(sql)
@@ -162,6 +325,32 @@ def write_photos(connection, version, photos):
         err = "Database error:\n{0}\n{1}".format(sql, de)
         print(err)
         return err
+    finally:
+        if journal is not None:
+            journal.close()
+    return None
+
+
+def journal_version(connection, journal_rows):
+    """
+    Return the version of the last load in the journal, if it is not done and
+    still exists in the database.
+    """
+    if not journal_rows:
+        return None
+    key, version = journal_rows[-1][:2]
+    if key == LOAD_DONE:
+        return None
+    owner, _, name = version.partition(".")
+    sql = "SELECT COUNT(*) FROM sde.SDE_versions WHERE owner = ? AND name = ?"
+    try:
+        row = connection.cursor().execute(sql, [owner, name]).fetchone()
+    except pyodbc.Error as de:
+        err = "Database error:\n{0}\n{1}".format(sql, de)
+        print(err)
+        return None
+    if row and row[0]:
+        return version
     return None
 
 
@@ -189,6 +378,12 @@ if __name__ == "__main__":
     if len(new_photos[0]) != 13:
         print("There are the wrong number of columns in the Photos CSV")
         sys.exit()
+    # The journal records the photos that were loaded, so a failed load can be rerun
+    journal_file = os.path.join(script_dir, "PhotoCSVLoader_journal.csv")
     conn = get_connection_or_die("inpakrovmais", "akr_facility2")
-    version = make_new_version(conn)
-    write_photos(conn, version, fix_photos(new_photos))
+    version = journal_version(conn, read_journal(journal_file))
+    if version:
+        print("Resuming the load into version {0}".format(version))
+    else:
+        version = make_new_version(conn)
+    write_photos(conn, version, fix_photos(new_photos), journal_file)
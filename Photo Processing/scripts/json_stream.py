@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Write a large JSON object to a file one member at a time.
+
+`json.dumps()` needs the whole object (typically a dictionary) in memory, and
+then creates the whole output as a single string before it can be written.
+`write_object()` writes each (key, value) pair as it is produced, so only one
+value is in memory at a time when the items come from a generator.
+
+The output is byte-identical to
+`json.dumps(dict(items), sort_keys=True, indent=indent, separators=separators)`
+as long as the items are provided in sorted key order (the order is checked).
+
+Usage:
+
+import json_stream
+with open("out.json", "w", encoding="utf-8") as out_file:
+    json_stream.write_object(out_file, sorted(data.items()), indent=2)
+
+Written for Python 2.7 and 3.6.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import json
+
+
+def write_object(out_file, items, indent=None, separators=None):
+    """
+    Write the (key, value) pairs in items to out_file as a JSON object.
+
+    The keys must be unique strings in ascending order, or a ValueError is raised.
+    Nested dictionaries in the values are written with sorted keys.
+    indent (an integer or None) and separators are the same as for json.dumps().
+    Returns the number of items written.
+    """
+
+    if separators is None:
+        separators = (", ", ": ") if indent is None else (",", ": ")
+    item_separator, key_separator = separators
+    if indent is None:
+        newline = ""
+    else:
+        newline = "\n" + " " * indent
+    count = 0
+    previous_key = None
+    for key, value in items:
+        if previous_key is not None and not previous_key < key:
+            msg = "JSON keys are not unique and in sorted order: {0!r} then {1!r}"
+            raise ValueError(msg.format(previous_key, key))
+        previous_key = key
+        text = json.dumps(value, sort_keys=True, indent=indent, separators=separators)
+        if newline:
+            text = text.replace("\n", newline)
+        out_file.write(
+            "{0}{1}{2}{3}{4}".format(
+                "{" if count == 0 else item_separator,
+                newline,
+                json.dumps(key),
+                key_separator,
+                text,
+            )
+        )
+        count += 1
+    if count == 0:
+        out_file.write("{}")
+    elif indent is None:
+        out_file.write("}")
+    else:
+        out_file.write("\n}")
+    return count
@@ -1,6 +1,21 @@
 # -*- coding: utf-8 -*-
 """
-Create a photos.json file which lists each photo in the database with a URL and foreign key.
+Create a photos.json file which lists the photos in the database for each foreign key.
+
+The keys are in sorted order, and each key (with its photos) is written as the
+rows are read from the database, so the whole file is not held in memory
+(unless the `--shards` or `--binary` options are used).
+
+A delta file with the changes from the previous version of photos.json, and a
+manifest of the recent deltas are also created (see `json_delta.py`).
+
+Run with the `--shards` option to also write a `photos` folder with minified
+JSON files that each hold the photos for the IDs starting with the same
+characters, and an `index.json` that lists the shards.  Each shard is also
+written precompressed as `.gz` and `.br` (if the brotli module is installed).
+
+Run with the `--binary` option to also write `photos.idx`, a compact binary
+version of photos.json that can be searched without parsing it (see `photo_index.py`).
 
 File paths are hard coded in the script relative to the scipt's location.
 The database connection string and schema are also hardcoded in the script.
@@ -9,17 +24,32 @@ Written for Python 2.7; may work with Python 3.x.
 
 Third party requirements:
 * pyodbc - https://pypi.python.org/pypi/pyodbc
+* brotli - https://pypi.python.org/pypi/Brotli (optional)
 """
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import gzip
 from io import open
+import itertools
 import json
 import os.path
+import re
 import sys
 
 import pyodbc
 
+try:
+    import brotli
+except ImportError:
+    # brotli is optional; .br files are not written without it
+    brotli = None
+
+import db_fetch
+import json_delta
+import json_stream
+import photo_index
+
 
 def get_connection_or_die(server, database):
     """
@@ -53,40 +83,129 @@ def get_connection_or_die(server, database):
     sys.exit()
 
 
-def get_photo_data(connection):
-    photos = {}
+# The start of ATCHLINK that is not in photos.json.
+LINK_PREFIX = "https://akrgis.nps.gov/fmss/photos/web/"
+
+# One row for each ID a photo is linked to, grouped by ID in binary (code
+# point) order, which is the same as the sorted order of the IDs in Python.
+PHOTO_LINKS_SQL = """
+    SELECT id, ATCHLINK
+      FROM (SELECT FACLOCID AS id, ATCHDATE, ATCHLINK FROM gis.AKR_ATTACH_evw
+             WHERE ATCHALTNAME IS NOT NULL AND FACLOCID IS NOT NULL
+            UNION ALL
+            SELECT FEATUREID, ATCHDATE, ATCHLINK FROM gis.AKR_ATTACH_evw
+             WHERE ATCHALTNAME IS NOT NULL AND FEATUREID IS NOT NULL
+            UNION ALL
+            SELECT FACASSETID, ATCHDATE, ATCHLINK FROM gis.AKR_ATTACH_evw
+             WHERE ATCHALTNAME IS NOT NULL AND FACASSETID IS NOT NULL
+            UNION ALL
+            SELECT GEOMETRYID, ATCHDATE, ATCHLINK FROM gis.AKR_ATTACH_evw
+             WHERE ATCHALTNAME IS NOT NULL AND GEOMETRYID IS NOT NULL) AS links
+  ORDER BY id COLLATE Latin1_General_BIN2, ATCHDATE DESC
+"""
+
+
+def photo_items(connection):
+    """
+    Yield (ID, photo list) for each ID that photos are linked to, in sorted ID order.
+
+    A photo is listed under each of its FACLOCID, FEATUREID, FACASSETID, and
+    GEOMETRYID values.  Each list is in ATCHDATE order (newest first) without
+    duplicates.  The rows are streamed from the database already grouped by
+    ID, so only the photos for one ID are in memory at a time.
+    """
     try:
-        # FIXME - This only returns one ID for each photo
-        #   some photos have multiple IDs (some buildings and building assets have FMSS ID(s) and a FEATUREID)
-        rows = (
-            connection.cursor()
-            .execute(
-                """
-             SELECT COALESCE(FACLOCID, COALESCE(FEATUREID, COALESCE(FACASSETID, GEOMETRYID))) AS id,
-			        REPLACE(ATCHLINK, 'https://akrgis.nps.gov/fmss/photos/web/', '') AS photo
-               FROM gis.AKR_ATTACH_evw
-              WHERE ATCHALTNAME IS NOT NULL AND (FACLOCID IS NOT NULL OR FACASSETID IS NOT NULL OR FEATUREID IS NOT NULL OR GEOMETRYID IS NOT NULL)
-           ORDER BY id, ATCHDATE DESC
-                """
-            )
-            .fetchall()
-        )
+        rows = db_fetch.query(connection, PHOTO_LINKS_SQL)
+        for photo_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+            photos = []
+            for row in group:
+                photo = row[1].replace(LINK_PREFIX, "")
+                if photo not in photos:
+                    photos.append(photo)
+            yield photo_id, photos
     except pyodbc.Error as de:
         print("Database error ocurred", de)
-        rows = None
-    if rows:
-        for row in rows:
-            if row.id in photos:
-                photos[row.id].append(row.photo)
-            else:
-                photos[row.id] = [row.photo]
-    return photos
+
+
+def get_photo_data(connection):
+    """Return a dictionary of photo lists keyed by each ID (see photo_items())."""
+    return dict(photo_items(connection))
+
+
+def keep_items(items, data):
+    """Yield the (key, value) pairs in items, and also add them to data."""
+    for key, value in items:
+        data[key] = value
+        yield key, value
+
+
+# The number of leading characters of an ID used to pick its shard
+SHARD_PREFIX_LENGTH = 2
+
+
+def shard_name(photo_id, prefix_length=SHARD_PREFIX_LENGTH):
+    """Return the shard for photo_id; the first letters and digits of the id."""
+    name = re.sub(r"[^0-9a-z]", "", photo_id.lower())[:prefix_length]
+    return name or "_"
+
+
+def write_compressed(path, content):
+    """Write content (bytes) to path, path.gz, and path.br (if brotli is installed)."""
+    with open(path, "wb") as fh:
+        fh.write(content)
+    with open(path + ".gz", "wb") as fh:
+        # mtime=0 so the output does not change unless the content changes
+        with gzip.GzipFile(fileobj=fh, mode="wb", compresslevel=9, mtime=0) as gz:
+            gz.write(content)
+    if brotli is not None:
+        with open(path + ".br", "wb") as fh:
+            fh.write(brotli.compress(content))
+
+
+def write_shards(data, out_dir, prefix_length=SHARD_PREFIX_LENGTH):
+    """
+    Write data (a dictionary of photo lists) as minified JSON shards in out_dir.
+
+    Each shard has the IDs that start with the same prefix_length characters
+    (see shard_name()).  The index.json file in out_dir maps shard names to file names.
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    shards = {}
+    for photo_id in data:
+        shards.setdefault(shard_name(photo_id, prefix_length), []).append(photo_id)
+    index = {"prefix_length": prefix_length, "ids": len(data), "shards": {}}
+    for name in sorted(shards):
+        shard = dict((photo_id, data[photo_id]) for photo_id in shards[name])
+        filename = "photos_{0}.json".format(name)
+        content = json.dumps(shard, sort_keys=True, separators=(",", ":"))
+        write_compressed(os.path.join(out_dir, filename), content.encode("utf-8"))
+        index["shards"][name] = filename
+    content = json.dumps(index, sort_keys=True, separators=(",", ":"))
+    write_compressed(os.path.join(out_dir, "index.json"), content.encode("utf-8"))
+    print("Wrote {0} shards to {1}".format(len(shards), out_dir))
+    if brotli is None:
+        print("The brotli module is not installed; .br files were not created.")
 
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
     outfile = os.path.join(script_dir, "photos.json")
     conn = get_connection_or_die("inpakrovmais", "akr_facility2")
-    data = get_photo_data(conn)
+    options = sys.argv[1:]
+    items = photo_items(conn)
+    data = None
+    if "--shards" in options or "--binary" in options:
+        # These outputs need all the photos at once
+        data = {}
+        items = keep_items(items, data)
+    delta = json_delta.Delta(outfile)
     with open(outfile, "w", encoding="utf-8") as fh:
-        fh.write(json.dumps(data, indent=2, separators=(",", ": ")))
+        json_stream.write_object(
+            fh, delta.track(items), indent=2, separators=(",", ": ")
+        )
+    delta.save()
+    if "--shards" in options:
+        write_shards(data, os.path.join(script_dir, "photos"))
+    if "--binary" in options:
+        photo_index.write_index(os.path.join(script_dir, "photos.idx"), data)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+A compact binary version of photos.json for fast lookups.
+
+`photos.json` must be completely parsed before the first photo can be found.
+The binary index can be memory mapped and searched without parsing it.
+The file has a header followed by five arrays:
+
+* string offsets - the start of each string in the string data (plus the end)
+* string data - the UTF-8 bytes of each unique ID and photo path
+  (a photo linked to several IDs is only stored once)
+* keys - the string number of each ID, sorted by the UTF-8 bytes of the ID
+* list offsets - the start of each key's photo list in the photo list (plus the end)
+* photo list - the string numbers of the photos for each key (in order)
+
+All numbers are unsigned 32 bit little endian integers.  The header is the
+magic bytes `PIDX`, the format version, the number of strings, the number of
+keys, and the byte offset of each of the five arrays.
+
+Usage:
+
+import photo_index
+photo_index.write_index("photos.idx", data)  # data is {id: [photo, ...]}
+index = photo_index.PhotoIndex("photos.idx")
+photos = index.get("95774")  # a list of photo paths, or None
+index.close()
+
+Run this script to build `photos.idx` from `photos.json` (in the same folder),
+and compare the time to load and search each file.
+
+Written for Python 2.7 and 3.6.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import mmap
+import os.path
+import struct
+import time
+
+MAGIC = b"PIDX"
+VERSION = 1
+HEADER = struct.Struct("<4s8I")
+
+
+def pack_uints(numbers):
+    return struct.pack("<{0}I".format(len(numbers)), *numbers)
+
+
+def write_index(path, data):
+    """Write data (a dictionary of photo lists keyed by ID) to a binary index at path."""
+
+    strings = {}
+    string_data = []
+
+    def string_number(text):
+        if text not in strings:
+            strings[text] = len(string_data)
+            string_data.append(text.encode("utf-8"))
+        return strings[text]
+
+    encoded_keys = sorted((key.encode("utf-8"), key) for key in data)
+    keys = [string_number(key) for _, key in encoded_keys]
+    list_offsets = [0]
+    photo_list = []
+    for _, key in encoded_keys:
+        photo_list.extend(string_number(photo) for photo in data[key])
+        list_offsets.append(len(photo_list))
+    string_offsets = [0]
+    for item in string_data:
+        string_offsets.append(string_offsets[-1] + len(item))
+
+    sections = [
+        pack_uints(string_offsets),
+        b"".join(string_data),
+        pack_uints(keys),
+        pack_uints(list_offsets),
+        pack_uints(photo_list),
+    ]
+    positions = []
+    position = HEADER.size
+    for section in sections:
+        # Keep the integer arrays aligned on 4 byte boundaries
+        position += (4 - position % 4) % 4
+        positions.append(position)
+        position += len(section)
+    with open(path, "wb") as out_file:
+        out_file.write(
+            HEADER.pack(MAGIC, VERSION, len(string_data), len(keys), *positions)
+        )
+        for section, position in zip(sections, positions):
+            out_file.write(b"\0" * (position - out_file.tell()))
+            out_file.write(section)
+
+
+class PhotoIndex(object):
+    """A read only, memory mapped binary photo index (see write_index())."""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.buffer, 0)
+        if header[0] != MAGIC or header[1] != VERSION:
+            self.close()
+            msg = "{0} is not a version {1} photo index"
+            raise ValueError(msg.format(path, VERSION))
+        self.string_count, self.key_count = header[2:4]
+        (
+            self.string_offsets_pos,
+            self.string_data_pos,
+            self.keys_pos,
+            self.list_offsets_pos,
+            self.photo_list_pos,
+        ) = header[4:]
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+    def __len__(self):
+        return self.key_count
+
+    def _uint(self, position, index):
+        return struct.unpack_from("<I", self.buffer, position + 4 * index)[0]
+
+    def _string_bytes(self, number):
+        start = self._uint(self.string_offsets_pos, number)
+        end = self._uint(self.string_offsets_pos, number + 1)
+        position = self.string_data_pos
+        return self.buffer[position + start : position + end]
+
+    def _string(self, number):
+        return self._string_bytes(number).decode("utf-8")
+
+    def key(self, index):
+        """Return the ID at index (in sorted order)."""
+        return self._string(self._uint(self.keys_pos, index))
+
+    def keys(self):
+        return [self.key(i) for i in range(self.key_count)]
+
+    def find(self, key):
+        """Return the index of key with a binary search, or -1 if it is not found."""
+        target = key.encode("utf-8")
+        low, high = 0, self.key_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._string_bytes(self._uint(self.keys_pos, middle)) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.key_count:
+            if self._string_bytes(self._uint(self.keys_pos, low)) == target:
+                return low
+        return -1
+
+    def photos(self, index):
+        """Return the list of photos for the key at index."""
+        start = self._uint(self.list_offsets_pos, index)
+        end = self._uint(self.list_offsets_pos, index + 1)
+        refs = struct.unpack_from(
+            "<{0}I".format(end - start), self.buffer, self.photo_list_pos + 4 * start
+        )
+        return [self._string(ref) for ref in refs]
+
+    def get(self, key, default=None):
+        """Return the list of photos for key, or default if key is not in the index."""
+        index = self.find(key)
+        if index < 0:
+            return default
+        return self.photos(index)
+
+
+def benchmark(json_path, index_path, lookups=1000):
+    """Print the time to load and search photos.json and the binary index."""
+
+    start = time.time()
+    with open(json_path, "r", encoding="utf-8") as in_file:
+        data = json.load(in_file)
+    json_load = time.time() - start
+    keys = sorted(data)
+    step = max(1, len(keys) // lookups)
+    sample = keys[::step][:lookups] + ["not a key"]
+
+    start = time.time()
+    for key in sample:
+        data.get(key)
+    json_search = time.time() - start
+
+    start = time.time()
+    index = PhotoIndex(index_path)
+    index_load = time.time() - start
+    start = time.time()
+    for key in sample:
+        assert index.get(key) == data.get(key)
+    index_search = time.time() - start
+    index.close()
+
+    msg = "{0:<12} {1:>9.1f} KB  load {2:8.2f} ms  {3} lookups {4:8.2f} ms"
+    for name, path, load, search in [
+        ("photos.json", json_path, json_load, json_search),
+        ("binary index", index_path, index_load, index_search),
+    ]:
+        size = os.path.getsize(path) / 1024
+        print(msg.format(name, size, load * 1000, len(sample), search * 1000))
+
+
+if __name__ == "__main__":
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    json_file = os.path.join(script_dir, "photos.json")
+    index_file = os.path.join(script_dir, "photos.idx")
+    with open(json_file, "r", encoding="utf-8") as json_fh:
+        photo_data = json.load(json_fh)
+    write_index(index_file, photo_data)
+    benchmark(json_file, index_file)
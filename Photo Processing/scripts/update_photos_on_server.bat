@@ -5,4 +5,6 @@ T:\PROJECTS\AKR\FMSS\PHOTOS\PROCESSING\cmd\robocopy.exe T:\PROJECTS\AKR\FMSS\PHO
 T:\PROJECTS\AKR\FMSS\PHOTOS\PROCESSING\cmd\robocopy.exe T:\PROJECTS\AKR\FMSS\PHOTOS\THUMB \\akrgis.nps.gov\inetApps\fmss\photos\thumb /R:5 /W:5 /Z /MIR /LOG:T:\PROJECTS\AKR\FMSS\PHOTOS\PROCESSING\cmd\photothumblogfile.txt
 copy "T:\PROJECTS\AKR\FMSS\PHOTOS\PROCESSING\scripts\buildings.csv" \\akrgis.nps.gov\inetApps\buildings\data\buildings.csv
 copy "T:\PROJECTS\AKR\FMSS\PHOTOS\PROCESSING\scripts\photos.json" \\akrgis.nps.gov\inetApps\fmss\photos.json
+copy "T:\PROJECTS\AKR\FMSS\PHOTOS\PROCESSING\scripts\photos.delta.*.json" \\akrgis.nps.gov\inetApps\fmss\
+copy "T:\PROJECTS\AKR\FMSS\PHOTOS\PROCESSING\scripts\photos.manifest.json" \\akrgis.nps.gov\inetApps\fmss\photos.manifest.json
 :EOF
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+Checks PhotoCSVLoader.csv for errors before it is loaded into the database.
+
+Most of the problems with the photo list (invalid UNITCODEs, bad timestamps,
+missing files, and foreign keys that do not match any feature) are otherwise
+only found by the Enterprise QC checks after `add_photo_list_to_database.py`
+has created a new version in the database.
+
+This script does not use the production database.  The valid UNITCODEs and
+foreign keys are read from a cached export (`photo_lookups.json`) which is
+loaded once into sets, and then every row of the CSV is checked in a single
+pass against the cached values, the column widths in `schema.ini`, and the
+files in the `ORIGINAL` folder.
+
+To refresh the cache from the database (requires pyodbc and read permission
+in the facilities database), run:
+    python validate_photo_csv.py --export [path/to/facilities.sql]
+The UNITCODEs and foreign keys are read from the PHOTO_FEATURE_CLASSES, or
+from the feature classes that `facilities.sql` (in the facilities-website-tools
+folder) joins to the photos, if its path is given.
+
+File paths are hard coded in the script relative to the scipt's location.
+The database connection string and schema are also hardcoded in the script.
+
+Written for Python 2.7 and 3.6.
+
+Third party requirements:
+* pyodbc - https://pypi.python.org/pypi/pyodbc (only to refresh the cache)
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import csv
+import datetime
+from io import open
+import json
+import os
+import re
+import sys
+import time
+
+try:
+    import pyodbc
+except ImportError:
+    # pyodbc is only needed to export the lookups from the database
+    pyodbc = None
+
+import csv23
+import db_fetch
+
+LOOKUP_FILE = "photo_lookups.json"
+CSV_FILE = "PhotoCSVLoader.csv"
+SCHEMA_FILE = "schema.ini"
+
+# The foreign key columns in the CSV (and AKR_ATTACH)
+KEY_COLUMNS = ["FACLOCID", "FACASSETID", "FEATUREID", "GEOMETRYID"]
+
+# The feature classes that photos can be linked to; the ones that facilities.sql
+# (the script that builds the website data) joins to the photo IDs.  Run with
+# `--export path/to/facilities.sql` to use the feature classes in the script.
+PHOTO_FEATURE_CLASSES = [
+    "AKR_BLDG_CENTER_PT",
+    "PARKLOTS_PY",
+    "TRAILS_LN",
+    "TRAILS_FEATURE_PT",
+    "TRAILS_ATTRIBUTE_PT",
+    "ROADS_LN",
+    "ROADS_FEATURE_PT",
+    "AKR_ASSET_PT",
+    "AKR_ASSET_PY",
+    "AKR_ASSET_LN",
+]
+
+# A feature class joined to the photo IDs in facilities.sql (as in photo_ids.py)
+PHOTO_JOIN_PATTERN = re.compile(
+    r"FROM akr_facility2\.gis\.(\w+)_evw as g\s*\n"
+    r"LEFT JOIN #PhotoId_A as p1 on p1\.ID = g\.FACASSETID",
+    re.IGNORECASE,
+)
+
+# ISO 8601 date/time formats accepted by the loader
+DATE_FORMATS = [
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d",
+]
+
+
+def get_connection_or_die(server, database):
+    """
+    Get a Trusted pyodbc connection to the SQL Server database on server.
+
+    Try several connection strings.
+    See https://github.com/mkleehammer/pyodbc/wiki/Connecting-to-SQL-Server-from-Windows
+
+    Exit with an error message if there is no successful connection.
+    """
+    if pyodbc is None:
+        print("The pyodbc module is required to export lookups from the database.")
+        sys.exit()
+    drivers = [
+        "{ODBC Driver 17 for SQL Server}",  # supports SQL Server 2008 through 2017
+        "{ODBC Driver 13.1 for SQL Server}",  # supports SQL Server 2008 through 2016
+        "{ODBC Driver 13 for SQL Server}",  # supports SQL Server 2005 through 2016
+        "{ODBC Driver 11 for SQL Server}",  # supports SQL Server 2005 through 2014
+        "{SQL Server Native Client 11.0}",  # DEPRECATED: released with SQL Server 2012
+        # '{SQL Server Native Client 10.0}',    # DEPRECATED: released with SQL Server 2008
+    ]
+    conn_template = "DRIVER={0};SERVER={1};DATABASE={2};Trusted_Connection=Yes;"
+    for driver in drivers:
+        conn_string = conn_template.format(driver, server, database)
+        try:
+            connection = pyodbc.connect(conn_string)
+            return connection
+        except pyodbc.Error:
+            pass
+    print("Rats!! Unable to connect to the database.")
+    print("Make sure you have an ODBC driver installed for SQL Server")
+    print("and your AD account has the proper DB permissions.")
+    print("Contact akro_gis_helpdesk@nps.gov for assistance.")
+    sys.exit()
+
+
+def photo_feature_classes(sql_path):
+    """Return the feature classes that facilities.sql (at sql_path) joins to photos."""
+    with open(sql_path, "r", encoding="utf-8") as sql_fh:
+        sql = sql_fh.read()
+    return [match.group(1) for match in PHOTO_JOIN_PATTERN.finditer(sql)]
+
+
+def export_lookups(connection, lookup_path, feature_classes):
+    """
+    Save the UNITCODEs and the foreign keys in the feature_classes to lookup_path.
+
+    Each column of each feature class is queried separately, so a feature
+    class without one of the columns only leaves out those values (with a
+    warning).
+    """
+    lookups = {"exported": datetime.datetime.now().isoformat()}
+    for column in ["UNITCODE"] + KEY_COLUMNS:
+        values = set()
+        for fc in feature_classes:
+            sql = "SELECT DISTINCT {0} FROM gis.{1}_evw WHERE {0} IS NOT NULL"
+            try:
+                values.update(
+                    row[0] for row in db_fetch.query(connection, sql.format(column, fc))
+                )
+            except pyodbc.Error as de:
+                msg = "WARNING: Unable to read {0} from {1}; skipping. ({2})"
+                print(msg.format(column, fc, de))
+        lookups[column] = sorted(values)
+        print("Exported {0} {1} values".format(len(lookups[column]), column))
+    with open(lookup_path, "w", encoding="utf-8") as json_fh:
+        json_fh.write(json.dumps(lookups, indent=2, separators=(",", ": ")))
+
+
+def load_lookups(lookup_path):
+    """Return the date of the export and a dictionary of sets from the cached export."""
+    with open(lookup_path, "r", encoding="utf-8") as json_fh:
+        data = json.load(json_fh)
+    exported = data.pop("exported", "unknown")
+    return exported, dict((name, set(values)) for name, values in data.items())
+
+
+def read_schema_widths(schema_path, section=CSV_FILE):
+    """
+    Return a list of (column name, width) for the columns in the section of schema.ini.
+    """
+    widths = []
+    column = re.compile(r"^Col(\d+)=(\w+)\s+Text\s+Width\s+(\d+)", re.IGNORECASE)
+    in_section = False
+    with open(schema_path, "r", encoding="utf-8") as ini_fh:
+        for line in ini_fh:
+            line = line.strip()
+            if line.startswith("["):
+                in_section = line[1:-1].lower() == section.lower()
+                continue
+            match = column.match(line)
+            if in_section and match:
+                number, name, width = match.groups()
+                widths.append((int(number), name, int(width)))
+    return [(name, width) for _, name, width in sorted(widths)]
+
+
+def photo_inventory(photo_dir):
+    """Return a set of the lowercase 'unit/folder/file' paths below photo_dir."""
+    files = set()
+    for root, _, names in os.walk(photo_dir):
+        relative_path = os.path.relpath(root, photo_dir).replace("\\", "/")
+        prefix = "" if relative_path == "." else relative_path.lower() + "/"
+        for name in names:
+            files.add(prefix + name.lower())
+    return files
+
+
+def is_iso_date(text):
+    for date_format in DATE_FORMATS:
+        try:
+            datetime.datetime.strptime(text, date_format)
+            return True
+        except ValueError:
+            pass
+    return False
+
+
+def validate_rows(rows, widths, lookups, files):
+    """
+    Check each row (a list of CSV values) in a single pass.
+
+    widths is a list of (column name, width) from read_schema_widths(),
+    lookups is a dictionary of sets from load_lookups(), and files is a set from
+    photo_inventory(), or None to skip checking for files.
+    Returns a list of (line number, message) issues.  The header is line 1.
+    """
+    issues = []
+    column_count = len(widths)
+    key_indexes = [(4 + i, key) for i, key in enumerate(KEY_COLUMNS)]
+    units = lookups.get("UNITCODE")
+    seen = {}
+    for line, row in enumerate(rows, 2):
+        if len(row) != column_count:
+            msg = "Expected {0} columns, found {1}".format(column_count, len(row))
+            issues.append((line, msg))
+            continue
+        for value, (name, width) in zip(row, widths):
+            if len(value) > width:
+                msg = "{0} is longer than {1} characters".format(name, width)
+                issues.append((line, msg))
+        unit, folder, name, timestamp = row[0:4]
+        if not unit:
+            issues.append((line, "UNITCODE is required"))
+        elif units is not None and unit not in units:
+            issues.append((line, "UNITCODE {0} is not valid".format(unit)))
+        if not name:
+            issues.append((line, "FILENAME is required"))
+        elif "/" in name or "\\" in name:
+            issues.append((line, "FILENAME {0} must not include a folder".format(name)))
+        if "\\" in folder:
+            issues.append((line, "FOLDER {0} must use / not \\".format(folder)))
+        if not timestamp:
+            issues.append((line, "TIMESTAMP is required"))
+        elif not is_iso_date(timestamp):
+            issues.append((line, "TIMESTAMP {0} is not an ISO date".format(timestamp)))
+        if row[11] and not is_iso_date(row[11]):
+            issues.append((line, "CREATEDATE {0} is not an ISO date".format(row[11])))
+        has_key = False
+        for index, key in key_indexes:
+            value = row[index]
+            if value:
+                has_key = True
+                if key in lookups and value not in lookups[key]:
+                    msg = "{0} {1} does not match any feature".format(key, value)
+                    issues.append((line, msg))
+        if not has_key:
+            issues.append((line, "No FACLOCID, FACASSETID, FEATUREID, or GEOMETRYID"))
+        if unit and name:
+            if folder:
+                path = "{0}/{1}/{2}".format(unit, folder.strip("/"), name).lower()
+            else:
+                path = "{0}/{1}".format(unit, name).lower()
+            # The same photo may be linked to several features (see photo_key()
+            # in add_photo_list_to_database.py), so only identical links are duplicates.
+            key = (path,) + tuple(row[4:8])
+            if key in seen:
+                msg = "{0} with the same foreign keys is a duplicate of line {1}"
+                issues.append((line, msg.format(path, seen[key])))
+            else:
+                seen[key] = line
+            if files is not None and path not in files:
+                issues.append((line, "{0} is not in the ORIGINAL folder".format(path)))
+    return issues
+
+
+def read_csv(csv_path):
+    """Return the header and a list of rows in the CSV file at csv_path."""
+    with csv23.open(csv_path, "r") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        header = csv23.fix(next(csv_reader))
+        rows = [csv23.fix(row) for row in csv_reader]
+    return header, rows
+
+
+def main():
+    # Assumes script is in the Processing folder which is in the photos base folder.
+    #   some/path/PHOTOS/PROCESSING/this_script.py
+    #   some/path/PHOTOS/ORIGINAL/{park}/photos_files.jpg
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    lookup_path = os.path.join(script_dir, LOOKUP_FILE)
+
+    if "--export" in sys.argv[1:]:
+        feature_classes = PHOTO_FEATURE_CLASSES
+        sql_paths = sys.argv[sys.argv.index("--export") + 1 :]
+        if sql_paths:
+            sql_path = sql_paths[0]
+            if not os.path.exists(sql_path):
+                print("ERROR: {0} not found".format(sql_path))
+                return
+            feature_classes = photo_feature_classes(sql_path)
+            if not feature_classes:
+                print("ERROR: No photo feature classes found in {0}".format(sql_path))
+                return
+        conn = get_connection_or_die("inpakrovmais", "akr_facility2")
+        export_lookups(conn, lookup_path, feature_classes)
+        print("Saved {0}".format(lookup_path))
+        return
+
+    if os.path.exists(lookup_path):
+        exported, lookups = load_lookups(lookup_path)
+        print("Using UNITCODEs and foreign keys exported on {0}".format(exported))
+    else:
+        print("WARNING: {0} not found; UNITCODEs and foreign keys".format(LOOKUP_FILE))
+        print("  will not be checked. Run with --export to create it.")
+        lookups = {}
+    widths = read_schema_widths(os.path.join(script_dir, SCHEMA_FILE))
+    photo_dir = os.path.join(os.path.dirname(script_dir), "ORIGINAL")
+    if os.path.isdir(photo_dir):
+        files = photo_inventory(photo_dir)
+    else:
+        print("WARNING: {0} not found; files will not be checked".format(photo_dir))
+        files = None
+    header, rows = read_csv(os.path.join(script_dir, CSV_FILE))
+    if header != [name for name, _ in widths]:
+        print("ERROR: The CSV header does not match the columns in schema.ini")
+
+    start = time.time()
+    issues = validate_rows(rows, widths, lookups, files)
+    seconds = time.time() - start
+    for line, msg in issues:
+        print("  Line {0}: {1}".format(line, msg))
+    msg = "Checked {0} rows in {1:.3f} seconds; found {2} issues."
+    print(msg.format(len(rows), seconds, len(issues)))
+    if not issues:
+        print("Woot, Woot, No issues found.")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,8 @@ import sys
 
 import pyodbc
 
+import db_fetch
+
 
 def get_connection_or_die(server, database):
     """
@@ -54,11 +56,16 @@ def get_connection_or_die(server, database):
 
 
 def get_building_data(connection):
+    """
+    Return an iterator of building rows (tuples) from the database, or None if there is an error.
+
+    Rows are fetched in batches as the iterator is consumed, so reading the rows
+    can also raise a pyodbc.Error (see write_building_csv()).
+    """
     try:
-        rows = (
-            connection.cursor()
-            .execute(
-                """
+        rows = db_fetch.query(
+            connection,
+            """
  	 SELECT P.Shape.STY AS Latitude,  P.Shape.STX AS Longitude, P.FACLOCID as FMSS_Id,
 	        COALESCE(F.[Description], P.MAPLABEL) AS [Desc],
 	        COALESCE(FORMAT(CAST(F.CRV AS float), 'C', 'en-us'), 'unknown') AS Cost,
@@ -72,9 +79,7 @@ def get_building_data(connection):
          ON P.FACLOCID = F.Location
 	  WHERE P.ISEXTANT = 'True' AND (P.FACLOCID IS NOT NULL
          OR (P.ISOUTPARK <> 'Yes' AND P.FACMAINTAIN IN ('NPS','FEDERAL')))
-                """
-            )
-            .fetchall()
+                """,
         )
     except pyodbc.Error as de:
         print("Database error ocurred", de)
@@ -117,6 +122,18 @@ def cvs23_write(writer, row):
 
 
 def write_building_csv(csv_path, rows):
+    """
+    Write the rows (with a header) to a CSV file at csv_path.
+
+    Return the number of rows written.  If there are no rows, nothing is
+    written.  The rows are written to a temporary file that replaces csv_path
+    when all the rows have been read, so if reading the rows raises an error,
+    csv_path is not changed.
+    """
+    rows = iter(rows)
+    first_row = next(rows, None)
+    if first_row is None:
+        return 0
     header = [
         "Latitude",
         "Longitude",
@@ -131,11 +148,23 @@ def write_building_csv(csv_path, rows):
         "Park_Id",
         "Photo_Id",
     ]
-    with csv23_open(csv_path, "w") as csv_file:
-        csv_writer = csv.writer(csv_file)
-        cvs23_write(csv_writer, header)
-        for row in rows:
-            cvs23_write(csv_writer, row)
+    temp_path = csv_path + ".tmp"
+    count = 1
+    try:
+        with csv23_open(temp_path, "w") as csv_file:
+            csv_writer = csv.writer(csv_file)
+            cvs23_write(csv_writer, header)
+            cvs23_write(csv_writer, first_row)
+            for row in rows:
+                cvs23_write(csv_writer, row)
+                count += 1
+    except Exception:
+        os.remove(temp_path)
+        raise
+    if os.path.exists(csv_path):
+        os.remove(csv_path)
+    os.rename(temp_path, csv_path)
+    return count
 
 
 if __name__ == "__main__":
@@ -143,5 +172,8 @@ if __name__ == "__main__":
     outfile = os.path.join(script_dir, "buildings.csv")
     conn = get_connection_or_die("inpakrovmais", "akr_facility2")
     data = get_building_data(conn)
-    if data:
-        write_building_csv(outfile, data)
+    if data is not None:
+        try:
+            write_building_csv(outfile, data)
+        except pyodbc.Error as de:
+            print("Database error ocurred", de)
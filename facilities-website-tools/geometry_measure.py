@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+"""
+Geodesic area and length of the facility geometries, with a cache.
+
+`facilities.sql` measures every parking lot, trail and road on every run with
+`GEOGRAPHY::STGeomFromText(shape.STAsText(),4269).STArea()` (or `STLength()`),
+which converts each geometry to text and back.  This module measures the
+geometries in Python from their well known binary (`Shape.STAsBinary()`) on the
+GRS80 ellipsoid (used by NAD83, EPSG:4269) with NumPy:
+
+* Length is the sum of the Vincenty (inverse) distances between the vertices.
+* Area is the spherical excess of each ring on the authalic sphere (a sphere
+  with the same surface area as the ellipsoid, with latitudes converted to
+  authalic latitudes, so equal areas are preserved).  The area of a polygon is
+  the area of its first ring minus the area of the other rings (holes).
+
+The measurements are cached by a hash of the WKB, so a geometry that has not
+changed is never measured again.
+
+Usage:
+
+import geometry_measure
+cache = geometry_measure.MeasureCache("geometry_measures.json")
+area, length = cache.measure(wkb)  # square meters and meters
+cache.save()
+
+Run this script (or `test_geometry_measure.py`) to compare the measurements to
+the values from SQL Server in a fixture file (`geometry_fixture.csv`), which
+can be created (requires pyodbc and read permission in the facilities
+database) with:
+    python geometry_measure.py --export
+`facilities.sql` still measures the geometries with SQL Server; it should only
+use this module once the measurements match the fixture (within TOLERANCE).
+
+File paths are hard coded in the script relative to the current working directory.
+The database connection string and schema are also hardcoded in the script.
+
+Written for Python 2.7; may work with Python 3.x.
+
+Third party requirements:
+* numpy - https://pypi.python.org/pypi/numpy
+* pyodbc - https://pypi.python.org/pypi/pyodbc (only to export the fixture)
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import binascii
+import csv
+import hashlib
+from io import open
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+try:
+    import pyodbc
+except ImportError:
+    # pyodbc is only needed to export the fixture from the database
+    pyodbc = None
+
+import csv23
+
+CACHE_FILE = "geometry_measures.json"
+FIXTURE_FILE = "geometry_fixture.csv"
+
+# GRS80 ellipsoid
+A = 6378137.0
+F = 1 / 298.257222101
+B = A * (1 - F)
+E2 = F * (2 - F)
+E = np.sqrt(E2)
+
+FIXTURE_SQL = """
+SELECT TOP {1} '{0}' AS FC, OBJECTID, Shape.STAsBinary() AS WKB,
+       GEOGRAPHY::STGeomFromText(Shape.STAsText(), 4269).STArea() AS Area,
+       GEOGRAPHY::STGeomFromText(Shape.STAsText(), 4269).STLength() AS Length
+  FROM akr_facility2.gis.{0}_evw
+ WHERE Shape IS NOT NULL
+"""
+
+# The feature classes that are measured in facilities.sql
+FIXTURE_FEATURE_CLASSES = ["PARKLOTS_PY", "TRAILS_LN", "ROADS_LN"]
+
+# The number of features from each feature class in the fixture
+FIXTURE_SIZE = 20
+
+# The largest relative difference from the SQL Server values that is expected
+TOLERANCE = 0.001
+
+
+def get_connection_or_die(server, database):
+    """
+    Get a Trusted pyodbc connection to the SQL Server database on server.
+
+    Try several connection strings.
+    See https://github.com/mkleehammer/pyodbc/wiki/Connecting-to-SQL-Server-from-Windows
+
+    Exit with an error message if there is no successful connection.
+    """
+    if pyodbc is None:
+        print("The pyodbc module is required to export the fixture from the database.")
+        sys.exit()
+    drivers = [
+        "{ODBC Driver 17 for SQL Server}",  # supports SQL Server 2008 through 2017
+        "{ODBC Driver 13.1 for SQL Server}",  # supports SQL Server 2008 through 2016
+        "{ODBC Driver 13 for SQL Server}",  # supports SQL Server 2005 through 2016
+        "{ODBC Driver 11 for SQL Server}",  # supports SQL Server 2005 through 2014
+        "{SQL Server Native Client 11.0}",  # DEPRECATED: released with SQL Server 2012
+        # '{SQL Server Native Client 10.0}',    # DEPRECATED: released with SQL Server 2008
+    ]
+    conn_template = "DRIVER={0};SERVER={1};DATABASE={2};Trusted_Connection=Yes;"
+    for driver in drivers:
+        conn_string = conn_template.format(driver, server, database)
+        try:
+            connection = pyodbc.connect(conn_string)
+            return connection
+        except pyodbc.Error:
+            pass
+    print("Rats!! Unable to connect to the database.")
+    print("Make sure you have an ODBC driver installed for SQL Server")
+    print("and your AD account has the proper DB permissions.")
+    print("Contact akro_gis_helpdesk@nps.gov for assistance.")
+    sys.exit()
+
+
+def parse_wkb(wkb):
+    """
+    Return the polygons and lines in the well known binary geometry.
+
+    Returns (polygons, lines) where polygons is a list of polygons (a list of
+    rings) and lines is a list of lines.  Each ring or line is an (n, 2) NumPy
+    array of (x, y) or (longitude, latitude).  Points are ignored.  Z and M
+    values (ISO or EWKB flags) are dropped.
+    """
+
+    polygons = []
+    lines = []
+    _parse(bytes(wkb), 0, polygons, lines)
+    return polygons, lines
+
+
+def _parse(wkb, offset, polygons, lines):
+    """Parse the geometry at offset in wkb; return the offset after it."""
+
+    endian = "<" if wkb[offset : offset + 1] == b"\x01" else ">"
+    (code,) = struct.unpack_from(endian + "I", wkb, offset + 1)
+    offset += 5
+    dimensions = 2
+    if code & 0x80000000:  # EWKB Z flag
+        dimensions += 1
+    if code & 0x40000000:  # EWKB M flag
+        dimensions += 1
+    if code & 0x20000000:  # EWKB SRID flag
+        offset += 4
+    code &= 0x0FFFFFFF
+    if code >= 1000:  # ISO Z, M and ZM
+        dimensions += 1 if code < 3000 else 2
+        code %= 1000
+    if code == 1:
+        return offset + 8 * dimensions
+    if code == 2:
+        line, offset = _points(wkb, offset, endian, dimensions)
+        lines.append(line)
+        return offset
+    if code == 3:
+        (count,) = struct.unpack_from(endian + "I", wkb, offset)
+        offset += 4
+        rings = []
+        for _ in range(count):
+            ring, offset = _points(wkb, offset, endian, dimensions)
+            rings.append(ring)
+        polygons.append(rings)
+        return offset
+    if code in (4, 5, 6, 7):
+        (count,) = struct.unpack_from(endian + "I", wkb, offset)
+        offset += 4
+        for _ in range(count):
+            offset = _parse(wkb, offset, polygons, lines)
+        return offset
+    raise ValueError("Unsupported WKB geometry type {0}".format(code))
+
+
+def _points(wkb, offset, endian, dimensions):
+    """Return an (n, 2) array of the points at offset in wkb, and the offset after."""
+
+    (count,) = struct.unpack_from(endian + "I", wkb, offset)
+    offset += 4
+    size = count * dimensions
+    values = np.frombuffer(wkb, dtype=endian + "f8", count=size, offset=offset)
+    return values.reshape(count, dimensions)[:, :2], offset + 8 * size
+
+
+def geodesic_lengths(lon1, lat1, lon2, lat2, iterations=100, tolerance=1e-12):
+    """
+    Return the distances in meters between the points (arrays of degrees).
+
+    Uses Vincenty's inverse formula on the ellipsoid for all the points at once.
+    """
+
+    u1 = np.arctan((1 - F) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - F) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    big_l = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    lam = big_l
+    for _ in range(iterations):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.hypot(
+            cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam
+        )
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        safe_sin_sigma = np.where(sin_sigma == 0, 1.0, sin_sigma)
+        sin_alpha = cos_u1 * cos_u2 * sin_lam / safe_sin_sigma
+        cos2_alpha = 1 - sin_alpha ** 2
+        safe_cos2_alpha = np.where(cos2_alpha == 0, 1.0, cos2_alpha)
+        cos_2sm = np.where(
+            cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / safe_cos2_alpha
+        )
+        c = F / 16 * cos2_alpha * (4 + F * (4 - 3 * cos2_alpha))
+        previous = lam
+        lam = big_l + (1 - c) * F * sin_alpha * (
+            sigma
+            + c * sin_sigma * (cos_2sm + c * cos_sigma * (-1 + 2 * cos_2sm ** 2))
+        )
+        if np.all(np.abs(lam - previous) < tolerance):
+            break
+    u_sq = cos2_alpha * (A ** 2 - B ** 2) / B ** 2
+    big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = (
+        big_b
+        * sin_sigma
+        * (
+            cos_2sm
+            + big_b
+            / 4
+            * (
+                cos_sigma * (-1 + 2 * cos_2sm ** 2)
+                - big_b
+                / 6
+                * cos_2sm
+                * (-3 + 4 * sin_sigma ** 2)
+                * (-3 + 4 * cos_2sm ** 2)
+            )
+        )
+    )
+    return B * big_a * (sigma - delta_sigma)
+
+
+def line_length(points):
+    """Return the geodesic length in meters of an (n, 2) array of (lon, lat)."""
+
+    if len(points) < 2:
+        return 0.0
+    lon, lat = points[:, 0], points[:, 1]
+    return float(np.sum(geodesic_lengths(lon[:-1], lat[:-1], lon[1:], lat[1:])))
+
+
+def _q(sin_lat):
+    return (1 - E2) * (
+        sin_lat / (1 - E2 * sin_lat ** 2)
+        - np.log((1 - E * sin_lat) / (1 + E * sin_lat)) / (2 * E)
+    )
+
+
+Q_POLE = _q(1.0)
+AUTHALIC_RADIUS = A * np.sqrt(Q_POLE / 2)
+
+
+def ring_area(points):
+    """Return the geodesic area in square meters of a closed ring of (lon, lat)."""
+
+    if len(points) < 4:
+        return 0.0
+    lon = np.radians(points[:, 0])
+    beta = np.arcsin(np.clip(_q(np.sin(np.radians(points[:, 1]))) / Q_POLE, -1, 1))
+    t = np.tan(beta / 2)
+    d_lon = np.diff(lon)
+    d_lon = (d_lon + np.pi) % (2 * np.pi) - np.pi
+    excess = np.sum(
+        2 * np.arctan2(np.tan(d_lon / 2) * (t[:-1] + t[1:]), 1 + t[:-1] * t[1:])
+    )
+    return float(abs(excess) * AUTHALIC_RADIUS ** 2)
+
+
+def measure(wkb):
+    """Return the geodesic (area, length) of a WKB geometry in meters² and meters."""
+
+    polygons, lines = parse_wkb(wkb)
+    area = 0.0
+    length = 0.0
+    for rings in polygons:
+        if rings:
+            area += ring_area(rings[0]) - sum(ring_area(ring) for ring in rings[1:])
+        length += sum(line_length(ring) for ring in rings)
+    length += sum(line_length(line) for line in lines)
+    return area, length
+
+
+def geometry_hash(wkb):
+    """Return the cache key for a WKB geometry."""
+
+    return hashlib.sha1(bytes(wkb)).hexdigest()
+
+
+class MeasureCache(object):
+    """Geodesic measurements of WKB geometries, saved in a JSON file."""
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.values = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as json_fh:
+                self.values = json.load(json_fh)
+        self.used = set()
+
+    def measure(self, wkb):
+        """Return the (area, length) of the WKB geometry, measuring it if needed."""
+
+        key = geometry_hash(wkb)
+        self.used.add(key)
+        if key in self.values:
+            self.hits += 1
+            return tuple(self.values[key])
+        self.misses += 1
+        value = measure(wkb)
+        self.values[key] = list(value)
+        return value
+
+    def save(self):
+        """Save the measurements of the geometries used since the cache was loaded."""
+
+        values = dict((key, self.values[key]) for key in self.used)
+        with open(self.path, "w", encoding="utf-8") as json_fh:
+            json_fh.write(json.dumps(values, sort_keys=True, separators=(",", ":")))
+        msg = "Measured {0} geometries; {1} were unchanged (cached)"
+        print(msg.format(self.misses + self.hits, self.hits))
+
+
+def export_fixture(connection, fixture_path, size=FIXTURE_SIZE):
+    """Save the WKB and SQL Server area and length of some features to fixture_path."""
+
+    with csv23.open(fixture_path, "w") as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv23.write(csv_writer, ["FC", "OBJECTID", "WKB", "Area", "Length"])
+        for feature_class in FIXTURE_FEATURE_CLASSES:
+            cursor = connection.cursor()
+            for row in cursor.execute(FIXTURE_SQL.format(feature_class, size)):
+                wkb = binascii.hexlify(bytes(row[2])).decode("ascii")
+                values = [row[0], row[1], wkb, repr(row[3]), repr(row[4])]
+                csv23.write(csv_writer, values)
+
+
+def validate(fixture_path):
+    """
+    Compare the measurements to the SQL Server values in the fixture.
+
+    Prints the largest relative difference of the areas and lengths (for
+    values larger than 1 m² or 1 m) and returns them.
+    """
+
+    worst = {"Area": (0.0, None), "Length": (0.0, None)}
+    count = 0
+    with csv23.open(fixture_path, "r") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        next(csv_reader)  # remove header
+        for row in csv_reader:
+            feature_class, objectid, wkb, sql_area, sql_length = csv23.fix(row)
+            area, length = measure(binascii.unhexlify(wkb))
+            count += 1
+            for name, value, expected in [
+                ("Area", area, float(sql_area)),
+                ("Length", length, float(sql_length)),
+            ]:
+                if expected > 1:
+                    difference = abs(value - expected) / expected
+                    if difference > worst[name][0]:
+                        feature = "{0}:{1}".format(feature_class, objectid)
+                        worst[name] = (difference, feature)
+    print("Compared {0} geometries to the SQL Server values".format(count))
+    for name in ["Area", "Length"]:
+        difference, feature = worst[name]
+        msg = "  {0}: largest difference {1:.6%} ({2}){3}"
+        warning = " MORE THAN THE TOLERANCE" if difference > TOLERANCE else ""
+        print(msg.format(name, difference, feature or "none", warning))
+    return worst["Area"][0], worst["Length"][0]
+
+
+def main():
+    if "--export" in sys.argv[1:]:
+        conn = get_connection_or_die("inpakrovmais", "akr_facility2")
+        export_fixture(conn, FIXTURE_FILE)
+        print("Saved {0}".format(FIXTURE_FILE))
+        return
+    if not os.path.exists(FIXTURE_FILE):
+        print("{0} not found. Run with --export to create it.".format(FIXTURE_FILE))
+        return
+    validate(FIXTURE_FILE)
+
+
+if __name__ == "__main__":
+    main()
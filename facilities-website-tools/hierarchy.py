@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Number the FMSS location and asset hierarchy as nested sets.
+
+Each location and asset is given a (left, right) interval from a depth first
+walk of the parent/child tree (left is assigned when a node is entered, and
+right when it is left).  With these numbers, the website can answer questions
+about the whole tree without walking it:
+
+* B is in the subtree of A if `A.left < B.left < A.right`
+* The number of descendants of A (locations and assets) is `(A.right - A.left - 1) / 2`
+
+The locations come from `parents.csv` (Parent, Location, ...) and the assets
+from `all_assets.csv` (Location, Asset, ...).  Assets are leaves below their
+location.  Location and asset IDs are numbered in one sequence, but kept in
+separate objects because the IDs may overlap.
+
+Problems in the data are reported, not fixed:
+
+* cycles - locations that are their own ancestor; they (and any descendants)
+  can not be reached from a top level location, and are not numbered.
+* multiple parents - a location listed with more than one parent; only the
+  first parent is used.
+* orphans - assets with a location that is not in `parents.csv` or in the
+  list of GIS locations; these are numbered with their location as a top level
+  location.
+
+Usage:
+
+import hierarchy
+tree = hierarchy.Hierarchy()
+tree.add_locations(rows)  # rows of (parent, location, ...)
+tree.add_assets(rows)  # rows of (location, asset, ...)
+locations, assets = tree.number()  # {id: [left, right]}
+tree.report(known_locations)
+
+Written for Python 2.7 and 3.6.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+# The number of problem IDs to print for each kind of problem.
+REPORT_LIMIT = 20
+
+
+class Hierarchy(object):
+    """The parent/child graph of locations, with assets at the leaves."""
+
+    def __init__(self):
+        self.parent = {}
+        self.children = {}
+        self.assets = {}
+        self.multiple_parents = []
+        self.cycles = []
+
+    def add_locations(self, rows):
+        """Add the (parent, location, ...) rows to the tree."""
+
+        for row in rows:
+            self.add_location(row[0], row[1])
+
+    def add_location(self, parent, location):
+        """Add a location below parent."""
+
+        if location in self.parent:
+            if self.parent[location] != parent:
+                self.multiple_parents.append((location, parent))
+            return
+        self.parent[location] = parent
+        if parent in self.children:
+            self.children[parent].append(location)
+        else:
+            self.children[parent] = [location]
+
+    def add_assets(self, rows):
+        """Add the (location, asset, ...) rows to the tree."""
+
+        for row in rows:
+            self.add_asset(row[0], row[1])
+
+    def add_asset(self, location, asset):
+        """Add an asset in location."""
+
+        if location in self.assets:
+            self.assets[location].append(asset)
+        else:
+            self.assets[location] = [asset]
+
+    def roots(self):
+        """Return the sorted list of locations without a parent."""
+
+        nodes = set(self.children)
+        nodes.update(self.assets)
+        return sorted(node for node in nodes if node not in self.parent)
+
+    def number(self):
+        """
+        Return the nested set numbers for the locations and assets.
+
+        Returns two dictionaries, of locations and assets, of ID: [left, right].
+        Children (and then assets) are visited in sorted order so that the
+        numbering is stable when the data does not change.
+        """
+
+        locations = {}
+        assets = {}
+        counter = 0
+        for root in self.roots():
+            # An explicit stack (instead of recursion) for very deep trees.
+            # Each entry is (location, left, iterator over the children).
+            stack = [(root, counter, iter(sorted(self.children.get(root, []))))]
+            counter += 1
+            while stack:
+                location, left, children = stack[-1]
+                child = next(children, None)
+                if child is not None:
+                    grandchildren = iter(sorted(self.children.get(child, [])))
+                    stack.append((child, counter, grandchildren))
+                    counter += 1
+                    continue
+                for asset in sorted(self.assets.get(location, [])):
+                    assets[asset] = [counter, counter + 1]
+                    counter += 2
+                locations[location] = [left, counter]
+                counter += 1
+                stack.pop()
+        self.cycles = self.find_cycles(locations)
+        return locations, assets
+
+    def find_cycles(self, numbered):
+        """
+        Return a list of cycles (lists of locations) among the locations that
+        were not numbered.
+        """
+
+        cycles = []
+        checked = set(numbered)
+        for start in sorted(self.parent):
+            if start in checked:
+                continue
+            path = []
+            on_path = {}
+            node = start
+            while node is not None and node not in checked:
+                on_path[node] = len(path)
+                path.append(node)
+                checked.add(node)
+                node = self.parent.get(node)
+            if node in on_path:
+                cycles.append(path[on_path[node] :])
+        return cycles
+
+    def report(self, known_locations=None):
+        """
+        Print a summary of the tree and any cycles, multiple parents and orphans.
+
+        known_locations is a set (or dictionary) of locations that are not
+        orphans even if they are not in parents.csv (i.e. the GIS locations).
+        """
+
+        print("Hierarchy: {0} top level locations".format(len(self.roots())))
+        for location, parent in self.multiple_parents[:REPORT_LIMIT]:
+            msg = "  Location {0} has more than one parent; ignoring parent {1}"
+            print(msg.format(location, parent))
+        if len(self.multiple_parents) > REPORT_LIMIT:
+            msg = "  ... and {0} more locations with more than one parent"
+            print(msg.format(len(self.multiple_parents) - REPORT_LIMIT))
+        for cycle in self.cycles[:REPORT_LIMIT]:
+            print("  Cycle: {0} -> {1}".format(" -> ".join(cycle), cycle[0]))
+        if len(self.cycles) > REPORT_LIMIT:
+            print("  ... and {0} more cycles".format(len(self.cycles) - REPORT_LIMIT))
+        known = set(self.parent)
+        known.update(self.children)
+        if known_locations is not None:
+            known.update(known_locations)
+        orphans = sorted(loc for loc in self.assets if loc not in known)
+        for location in orphans[:REPORT_LIMIT]:
+            msg = "  Orphan: {0} assets are in unknown location {1}"
+            print(msg.format(len(self.assets[location]), location))
+        if len(orphans) > REPORT_LIMIT:
+            msg = "  ... and {0} more unknown locations with assets"
+            print(msg.format(len(orphans) - REPORT_LIMIT))
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Create small versioned patches (deltas) for JSON files published to a website.
+
+When a JSON object file (i.e. `photos.json`) is recreated, the new members are
+compared to the previously published file, and a delta file with just the
+added, changed and removed keys is written next to it (`photos.delta.7.json`).
+The previous file is copied (to `photos.previous.json`) before it is replaced,
+and read one member at a time while the new members are written, so neither
+version is ever all in memory; only the changes are.  Both versions must have
+their keys in sorted order (as written by json_stream).  There is no delta for
+the first version.
+A manifest (`photos.manifest.json`) lists the current version and the recent
+deltas, so a website with a cached copy of an older version can download and
+apply the deltas instead of the whole file.
+
+Delta files look like:
+    {"from": 6, "to": 7, "add": {key: value}, "change": {key: value}, "remove": [key]}
+and are applied by deleting the `remove` keys and setting the `add` and `change` keys.
+
+Usage (with json_stream):
+
+import json_delta
+import json_stream
+delta = json_delta.Delta("photos.json")  # copies the previous version, if any
+with open("photos.json", "w", encoding="utf-8") as out_file:
+    json_stream.write_object(out_file, delta.track(sorted(data.items())))
+delta.save()
+
+Written for Python 2.7 and 3.6.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import json
+import os
+import shutil
+
+# The number of deltas to keep (and list in the manifest).
+KEEP = 10
+
+# The number of characters to read from a previous version at a time.
+CHUNK_SIZE = 65536
+
+
+def read_json(path, default=None):
+    """Return the object in the JSON file at path, or default if there is no file."""
+
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as in_file:
+        return json.load(in_file)
+
+
+class MemberReader(object):
+    """
+    Reads the (key, value) members of a JSON object from a file, one at a time.
+
+    The file is read chunk_size characters at a time, so only one member (and
+    one chunk) is in memory at a time.  Iterating raises a ValueError if the
+    file is not a JSON object.
+    """
+
+    def __init__(self, in_file, chunk_size=CHUNK_SIZE):
+        self.in_file = in_file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text = ""
+        self.pos = 0
+        self.eof = False
+
+    def __iter__(self):
+        self.expect("{")
+        if self.next_char() == "}":
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key, self.value()
+            if self.expect(",}") == "}":
+                return
+
+    def more(self):
+        """Read another chunk; return False at the end of the file."""
+
+        chunk = self.in_file.read(self.chunk_size)
+        self.text = self.text[self.pos :] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+    def next_char(self):
+        """Skip the whitespace, and return the next character ("" at the end)."""
+
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.more():
+                return ""
+
+    def expect(self, chars):
+        """Skip the next character (and return it) if it is one of chars."""
+
+        char = self.next_char()
+        if not char or char not in chars:
+            msg = "Expected one of {0!r} in a JSON object, not {1!r}"
+            raise ValueError(msg.format(chars, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Return the next JSON value, reading more of the file as needed."""
+
+        self.next_char()
+        while True:
+            try:
+                result, end = self.decoder.raw_decode(self.text, self.pos)
+                # A number at the end of a chunk may continue in the next one
+                if self.eof or (end < len(self.text) and self.text[end] in ",} \t\r\n"):
+                    self.pos = end
+                    return result
+            except ValueError:
+                if self.eof:
+                    raise
+            self.more()
+
+
+def read_members(path, chunk_size=CHUNK_SIZE):
+    """Yield the (key, value) members of the JSON object in the file at path."""
+
+    with open(path, "r", encoding="utf-8") as in_file:
+        for member in MemberReader(in_file, chunk_size):
+            yield member
+
+
+def write_json(path, data):
+    """Write data to path as minified JSON."""
+
+    with open(path, "w", encoding="utf-8") as out_file:
+        out_file.write(json.dumps(data, sort_keys=True, separators=(",", ":")))
+
+
+def same_json(old_value, new_value):
+    """Return True if the values are the same in JSON (i.e. a list and a tuple)."""
+
+    old_text = json.dumps(old_value, sort_keys=True)
+    return old_text == json.dumps(new_value, sort_keys=True)
+
+
+class Delta(object):
+    """
+    The changes between the published version of a JSON object file and a new version.
+    """
+
+    def __init__(self, path, keep=KEEP):
+        self.path = path
+        self.keep = keep
+        base = os.path.splitext(path)[0]
+        self.manifest_path = base + ".manifest.json"
+        self.delta_template = base + ".delta.{0}.json"
+        # A copy of the previous version, since path is replaced by the new one
+        self.previous = None
+        if os.path.exists(path):
+            self.previous = base + ".previous.json"
+            shutil.copyfile(path, self.previous)
+        # True if there is no previous version to make a delta from
+        self.baseline = self.previous is None
+        self.add = {}
+        self.change = {}
+        self.remove = []
+
+    def track(self, items):
+        """
+        Yield the (key, value) pairs in items, while recording how they differ
+        from the previous version.
+
+        The items must be in sorted key order.  Nothing is recorded if there is
+        no previous version, or if its keys are not in sorted order.
+        """
+
+        if self.baseline:
+            for item in items:
+                yield item
+            return
+        previous = read_members(self.previous)
+        old_key, old_value = next(previous, (None, None))
+        for key, value in items:
+            while old_key is not None and old_key < key:
+                self.remove.append(old_key)
+                old_key, old_value = self.next_member(previous, old_key)
+            if old_key == key:
+                if not same_json(old_value, value):
+                    self.change[key] = value
+                old_key, old_value = self.next_member(previous, old_key)
+            elif not self.baseline:
+                self.add[key] = value
+            yield key, value
+        while old_key is not None:
+            self.remove.append(old_key)
+            old_key, old_value = self.next_member(previous, old_key)
+
+    def next_member(self, previous, old_key):
+        """
+        Return the next (key, value) in the previous version, or (None, None).
+
+        If the keys are not in sorted order, the previous version can not be
+        compared, and this version starts a new list of deltas (see save()).
+        """
+
+        key, value = next(previous, (None, None))
+        if key is not None and not old_key < key:
+            msg = "{0}: the previous version is not sorted; no delta will be made"
+            print(msg.format(os.path.basename(self.path)))
+            self.baseline = True
+            return None, None
+        return key, value
+
+    def has_changes(self):
+        return bool(self.add or self.change or self.remove)
+
+    def save(self):
+        """
+        Write the delta file and update the manifest; return the new version number.
+
+        If there was no previous version (or manifest), only the manifest is
+        written.  If nothing changed, nothing is written.
+        """
+
+        if self.previous is not None and os.path.exists(self.previous):
+            os.remove(self.previous)
+        manifest = read_json(self.manifest_path)
+        # Without a previous version (and its manifest) there is no baseline
+        # for a delta, so this version starts a new list of deltas.
+        baseline = self.baseline or manifest is None
+        if manifest is None:
+            manifest = {"version": 0, "deltas": []}
+        if not baseline and not self.has_changes():
+            return manifest["version"]
+        old_version = manifest["version"]
+        version = old_version + 1
+        deltas = manifest["deltas"]
+        if baseline:
+            deltas = []
+        else:
+            delta_path = self.delta_template.format(version)
+            delta = {
+                "from": old_version,
+                "to": version,
+                "add": self.add,
+                "change": self.change,
+                "remove": self.remove,
+            }
+            write_json(delta_path, delta)
+            deltas.append(
+                {
+                    "from": old_version,
+                    "to": version,
+                    "file": os.path.basename(delta_path),
+                    "size": os.path.getsize(delta_path),
+                }
+            )
+            for old in deltas[: -self.keep]:
+                old_path = os.path.join(os.path.dirname(self.path), old["file"])
+                if os.path.exists(old_path):
+                    os.remove(old_path)
+            deltas = deltas[-self.keep :]
+            msg = "{0}: version {1}; {2} added, {3} changed, {4} removed"
+            print(
+                msg.format(
+                    os.path.basename(self.path),
+                    version,
+                    len(self.add),
+                    len(self.change),
+                    len(self.remove),
+                )
+            )
+        manifest = {
+            "file": os.path.basename(self.path),
+            "version": version,
+            "deltas": deltas,
+        }
+        write_json(self.manifest_path, manifest)
+        return version
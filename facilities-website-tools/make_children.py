@@ -4,6 +4,10 @@ Converts CSV data from the database into JSON files that the web app can load.
 
 See `facilities.sql` for how to create the various input files.
 File paths are hard coded in the script relative to the current working directory.
+A delta file with the changes from the previous version of each JSON file, and
+a manifest of the recent deltas are also created (see `json_delta.py`).
+The nested set numbering of the whole location and asset tree is written to
+`hierarchy.json` and `asset_hierarchy.json` (see `hierarchy.py`).
 
 Written for Python 2.7; may work with Python 3.x.
 """
@@ -13,9 +17,12 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import collections
 import csv
 from io import open
-import json
 import sys
 
+import hierarchy
+import json_delta
+import json_stream
+
 
 # pylint: disable=redefined-builtin
 def csv23_open(filename, mode="r"):
@@ -38,60 +45,112 @@ def csv23_fix(row):
     return row
 
 
-def fix23(item):
-    """Return a unicode string from a Python 2 or Python 3 string."""
+def read_rows(csv_path):
+    """Yield each row (a list of unicode strings) after the header in the CSV file."""
 
-    if sys.version_info[0] < 3:
-        return item.decode("utf-8")
-    return item
+    with csv23_open(csv_path, "r") as csv_file:
+        csv_reader = csv.reader(csv_file)
+        next(csv_reader)  # remove header
+        for row in csv_reader:
+            yield csv23_fix(row)
+
+
+def count_ids(rows):
+    """Return a Counter of the IDs (the second column) in rows."""
+
+    return collections.Counter(row[1] for row in rows)
+
+
+def group_children(rows, parent_counts, child_counts):
+    """
+    Group rows of (parent, child, description, ...) by parent as they are read.
+
+    Only rows with a parent in parent_counts are kept.  Each child is stored as a
+    compact (id, description, count) tuple, where count is from child_counts.
+    Returns a dictionary of parent: list of child tuples.
+    """
+
+    groups = {}
+    for row in rows:
+        parent = row[0]
+        if parent not in parent_counts:
+            continue
+        child = (row[1], row[2], child_counts[row[1]])
+        if parent in groups:
+            groups[parent].append(child)
+        else:
+            groups[parent] = [child]
+    return groups
+
+
+def child_items(groups):
+    """Yield (parent, list of child objects) for the web app in sorted parent order."""
+
+    for parent in sorted(groups):
+        yield parent, [{"i": i, "d": d, "c": c} for i, d, c in groups[parent]]
+
+
+def write_items(json_path, items, indent=None):
+    """
+    Write the sorted (key, value) items to json_path, one item at a time.
+
+    Also writes a delta from the previous version (see json_delta.py).
+    """
+
+    delta = json_delta.Delta(json_path)
+    with open(json_path, "w", encoding="utf-8") as json_fh:
+        json_stream.write_object(
+            json_fh, delta.track(items), indent=indent, separators=(",", ":")
+        )
+    delta.save()
+
+
+def write_children(json_path, groups):
+    """Write the grouped children to json_path, one parent at a time."""
+
+    write_items(json_path, child_items(groups), indent=2)
+
+
+def write_hierarchy(gis_locations):
+    """
+    Number the whole location/asset tree as nested sets (see hierarchy.py).
+
+    Writes hierarchy.json and asset_hierarchy.json with {id: [left, right]},
+    and reports any cycles and orphans in the tree.
+    """
+
+    tree = hierarchy.Hierarchy()
+    tree.add_locations(read_rows("parents.csv"))
+    tree.add_assets(read_rows("all_assets.csv"))
+    write_tree(tree, gis_locations)
+
+
+def write_tree(tree, gis_locations):
+    """Write and report the nested set numbers for a hierarchy.Hierarchy."""
+
+    locations, assets = tree.number()
+    tree.report(gis_locations)
+    write_items("hierarchy.json", sorted(locations.items()))
+    write_items("asset_hierarchy.json", sorted(assets.items()))
 
 
 def main():
     """Create JSON files for web app"""
 
-    with csv23_open("facilities.csv", "r") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        next(csv_reader)  # remove header
-        gis_loc_counts = collections.Counter([fix23(row[1]) for row in csv_reader])
+    gis_loc_counts = count_ids(read_rows("facilities.csv"))
+    gis_asset_counts = count_ids(read_rows("assets.csv"))
 
-    with csv23_open("assets.csv", "r") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        next(csv_reader)  # remove header
-        gis_asset_counts = collections.Counter([fix23(row[1]) for row in csv_reader])
+    children = group_children(read_rows("parents.csv"), gis_loc_counts, gis_loc_counts)
+    write_children("children.json", children)
+    del children
 
-    children = {}
-    with csv23_open("parents.csv", "r") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        next(csv_reader)  # remove header
-        for row in [r for r in csv_reader if fix23(r[0]) in gis_loc_counts]:
-            row = csv23_fix(row)
-            parent = row[0]
-            child = {"i": row[1], "d": row[2], "c": gis_loc_counts[row[1]]}
-            if parent not in children:
-                children[parent] = []
-            children[parent].append(child)
-
-    with open("children.json", "w", encoding="utf-8") as json_fh:
-        json_fh.write(
-            json.dumps(children, sort_keys=True, indent=2, separators=(",", ":"))
-        )
+    assets = group_children(
+        read_rows("all_assets.csv"), gis_loc_counts, gis_asset_counts
+    )
+    write_children("assets.json", assets)
+    del assets
 
-    assets = {}
-    with csv23_open("all_assets.csv", "r") as csv_file:
-        csv_reader = csv.reader(csv_file)
-        next(csv_reader)  # remove header
-        for row in [r for r in csv_reader if fix23(r[0]) in gis_loc_counts]:
-            row = csv23_fix(row)
-            parent = row[0]
-            child = {"i": row[1], "d": row[2], "c": gis_asset_counts[row[1]]}
-            if parent not in assets:
-                assets[parent] = []
-            assets[parent].append(child)
-
-    with open("assets.json", "w", encoding="utf-8") as json_fh:
-        json_fh.write(
-            json.dumps(assets, sort_keys=True, indent=2, separators=(",", ":"))
-        )
+    write_hierarchy(gis_loc_counts)
 
 
 if __name__ == "__main__":
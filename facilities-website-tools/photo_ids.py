@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Finds the photo IDs of the GIS features in Python instead of in facilities.sql.
+
+`facilities.sql` copies the distinct FACASSETID, FEATUREID, GEOMETRYID and
+FACLOCID values in the photo attachments to four temp tables, then LEFT JOINs
+each of the ten feature classes to all four tables to compute the Photo_Id
+with `dbo.concat4id()`.  This module reads the attachment IDs once into
+dictionaries, and reads just the ID columns of each feature class once to
+find the Photo_Id of each feature in a single pass.  The features with a
+Photo_Id are loaded into one temp table (`#PhotoIds`) keyed by feature class and
+OBJECTID, and `rewrite_script()` changes facilities.sql to join that table
+instead.  The output of the script does not change.
+
+Usage (on the same connection, because temp tables are per session):
+
+import photo_ids
+script, feature_classes = photo_ids.rewrite_script(sql)
+photo_ids.create_photo_id_table(connection, feature_classes)
+cursor.execute(script)
+
+Written for Python 2.7; may work with Python 3.x.
+
+Third party requirements:
+* pyodbc - https://pypi.python.org/pypi/pyodbc
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import re
+import time
+
+# The attachment ID columns in the order of the dbo.concat4id() parameters.
+ID_COLUMNS = ["FACASSETID", "FEATUREID", "GEOMETRYID", "FACLOCID"]
+
+# The number of rows to fetch from (or insert into) the database at a time.
+BATCH_SIZE = 5000
+
+TABLE_SQL = """
+CREATE TABLE #PhotoIds (
+  FC nvarchar(50) NOT NULL,
+  OBJECTID int NOT NULL,
+  PhotoId nvarchar(400) NOT NULL,
+  PRIMARY KEY (FC, OBJECTID)
+)
+"""
+
+# A SELECT INTO in facilities.sql with the four LEFT JOINs for the Photo_Id.
+JOIN_PATTERN = re.compile(
+    r"dbo\.concat4id\(p1\.ID, p2\.ID, p3\.ID, p4\.ID\)"
+    r"(?P<columns>.*?)"
+    r"FROM akr_facility2\.gis\.(?P<fc>\w+)_evw as g\s*\n"
+    r"LEFT JOIN #PhotoId_A as p1 on p1\.ID = g\.FACASSETID\s*\n"
+    r"LEFT JOIN #PhotoId_F as p2 on p2\.ID = g\.FEATUREID\s*\n"
+    r"LEFT JOIN #PhotoId_G as p3 on p3\.ID = g\.GEOMETRYID\s*\n"
+    r"LEFT JOIN #PhotoId_L as p4 on p4\.ID = g\.FACLOCID\s*\n"
+    r"WHERE \(p1\.ID IS NOT NULL OR p2\.ID IS NOT NULL"
+    r" OR p3\.ID IS NOT NULL OR p4\.ID IS NOT NULL",
+    re.DOTALL,
+)
+
+JOIN_REPLACEMENT = (
+    r"p.PhotoId\g<columns>"
+    r"FROM akr_facility2.gis.\g<fc>_evw as g\n"
+    r"LEFT JOIN #PhotoIds as p on p.FC = '\g<fc>' AND p.OBJECTID = g.OBJECTID\n"
+    r"WHERE (p.PhotoId IS NOT NULL"
+)
+
+# The statements in facilities.sql that create, fill, and drop the four temp tables.
+TEMP_TABLE_PATTERN = re.compile(
+    r"^(create TABLE|INSERT INTO|DROP TABLE) #PhotoId_[AFGL]\b.*\n",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def id_key(value):
+    """
+    Return the key for comparing IDs like SQL Server does.
+
+    The default collation ignores case and trailing spaces.
+    """
+
+    return value.rstrip().lower()
+
+
+def get_attachment_ids(connection, batch_size=BATCH_SIZE):
+    """
+    Return a list of dictionaries (one per ID_COLUMNS) of the IDs in the attachments.
+
+    Each dictionary maps id_key(ID) to the ID as it is spelled in the attachments.
+    The attachments are read once.
+    """
+
+    attachment_ids = [{} for _ in ID_COLUMNS]
+    cursor = connection.cursor()
+    sql = "SELECT {0} FROM akr_facility2.gis.AKR_ATTACH_evw"
+    cursor.execute(sql.format(", ".join(ID_COLUMNS)))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            for ids, value in zip(attachment_ids, row):
+                if value is not None:
+                    ids.setdefault(id_key(value), value)
+    cursor.close()
+    return attachment_ids
+
+
+def concat_ids(ids):
+    """Return the IDs that are not None joined with '|', or None (like concat4id)."""
+
+    ids = [item for item in ids if item is not None]
+    if not ids:
+        return None
+    return "|".join(ids)
+
+
+def photo_id(feature_ids, attachment_ids):
+    """
+    Return the Photo_Id for a feature.
+
+    feature_ids are the feature's values (or None) for ID_COLUMNS, and
+    attachment_ids is from get_attachment_ids().
+    """
+
+    return concat_ids(
+        None if value is None else ids.get(id_key(value))
+        for ids, value in zip(attachment_ids, feature_ids)
+    )
+
+
+def feature_photo_ids(connection, feature_class, attachment_ids, batch_size=BATCH_SIZE):
+    """Yield the (OBJECTID, Photo_Id) of the features in feature_class with photos."""
+
+    cursor = connection.cursor()
+    sql = "SELECT OBJECTID, {0} FROM akr_facility2.gis.{1}_evw"
+    cursor.execute(sql.format(", ".join(ID_COLUMNS), feature_class))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        for row in rows:
+            value = photo_id(row[1:], attachment_ids)
+            if value is not None:
+                yield row[0], value
+    cursor.close()
+
+
+def create_photo_id_table(connection, feature_classes, batch_size=BATCH_SIZE):
+    """Create and fill the #PhotoIds temp table for the feature classes."""
+
+    start = time.time()
+    connection.cursor().execute("exec sde.set_default")
+    attachment_ids = get_attachment_ids(connection, batch_size)
+    cursor = connection.cursor()
+    cursor.execute(TABLE_SQL)
+    if hasattr(cursor, "fast_executemany"):
+        cursor.fast_executemany = True
+    sql = "INSERT INTO #PhotoIds (FC, OBJECTID, PhotoId) VALUES (?, ?, ?)"
+    total = 0
+    for feature_class in feature_classes:
+        rows = [
+            (feature_class, objectid, value)
+            for objectid, value in feature_photo_ids(
+                connection, feature_class, attachment_ids, batch_size
+            )
+        ]
+        for index in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[index : index + batch_size])
+        total += len(rows)
+    cursor.close()
+    msg = "Found {0} features with photos in {1} feature classes in {2:.1f} seconds"
+    print(msg.format(total, len(feature_classes), time.time() - start))
+
+
+def rewrite_script(sql):
+    """
+    Return facilities.sql changed to use #PhotoIds, and the feature classes it uses.
+
+    Raises a ValueError if the script does not have the expected joins.
+    """
+
+    feature_classes = [match.group("fc") for match in JOIN_PATTERN.finditer(sql)]
+    if not feature_classes:
+        raise ValueError("The SQL script does not join the #PhotoId_* tables")
+    sql = JOIN_PATTERN.sub(JOIN_REPLACEMENT, sql)
+    sql = TEMP_TABLE_PATTERN.sub("", sql)
+    if "#PhotoId_" in sql or "concat4id" in sql:
+        msg = "The SQL script uses the #PhotoId_* tables in an unexpected way"
+        raise ValueError(msg)
+    return sql, feature_classes
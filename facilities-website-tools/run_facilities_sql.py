@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Runs facilities.sql and creates the CSV and JSON files for the web app.
+
+This replaces running `facilities.sql` in SSMS, saving the four result windows
+as `facilities.csv`, `assets.csv`, `parents.csv`, and `all_assets.csv`, and then
+running `make_children.py`.  The script is executed once, and each result set
+is written to its CSV file as it is read from the database, while the same rows
+are counted and grouped for the JSON files (see `make_children.py`).  The CSV
+files are not read back.
+
+Run with the `--python-photo-ids` option to find the Photo_Id of each GIS
+feature in Python (see `photo_ids.py`) instead of with the four `#PhotoId_*`
+temp tables and `dbo.concat4id()` in the SQL script.
+
+File paths are hard coded in the script relative to the current working directory.
+The database connection string is also hardcoded in the script.
+
+Written for Python 2.7; may work with Python 3.x.
+
+Third party requirements:
+* pyodbc - https://pypi.python.org/pypi/pyodbc
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import csv
+from io import open
+import sys
+import time
+
+import pyodbc
+
+import csv23
+import hierarchy
+import make_children
+import photo_ids
+
+SQL_FILE = "facilities.sql"
+
+# The result sets in facilities.sql are saved to these files (in order).
+CSV_FILES = ["facilities.csv", "assets.csv", "parents.csv", "all_assets.csv"]
+
+# The number of rows to fetch from the database at a time.
+BATCH_SIZE = 5000
+
+
+def get_connection_or_die(server, database):
+    """
+    Get a Trusted pyodbc connection to the SQL Server database on server.
+
+    Try several connection strings.
+    See https://github.com/mkleehammer/pyodbc/wiki/Connecting-to-SQL-Server-from-Windows
+
+    Exit with an error message if there is no successful connection.
+    """
+    drivers = [
+        "{ODBC Driver 17 for SQL Server}",  # supports SQL Server 2008 through 2017
+        "{ODBC Driver 13.1 for SQL Server}",  # supports SQL Server 2008 through 2016
+        "{ODBC Driver 13 for SQL Server}",  # supports SQL Server 2005 through 2016
+        "{ODBC Driver 11 for SQL Server}",  # supports SQL Server 2005 through 2014
+        "{SQL Server Native Client 11.0}",  # DEPRECATED: released with SQL Server 2012
+        # '{SQL Server Native Client 10.0}',    # DEPRECATED: released with SQL Server 2008
+    ]
+    conn_template = "DRIVER={0};SERVER={1};DATABASE={2};Trusted_Connection=Yes;"
+    for driver in drivers:
+        conn_string = conn_template.format(driver, server, database)
+        try:
+            connection = pyodbc.connect(conn_string)
+            return connection
+        except pyodbc.Error:
+            pass
+    print("Rats!! Unable to connect to the database.")
+    print("Make sure you have an ODBC driver installed for SQL Server")
+    print("and your AD account has the proper DB permissions.")
+    print("Contact akro_gis_helpdesk@nps.gov for assistance.")
+    sys.exit()
+
+
+def read_script(sql_path):
+    """
+    Return the SQL script with row counts turned off.
+
+    Without `SET NOCOUNT ON` each INSERT, SELECT INTO and DROP in the script
+    returns a row count as an extra result set (with no rows).
+    """
+
+    with open(sql_path, "r", encoding="utf-8") as sql_file:
+        return "SET NOCOUNT ON;\n" + sql_file.read()
+
+
+def result_sets(cursor):
+    """
+    Yield the cursor after moving to each result set with rows (columns).
+
+    Result sets without columns (i.e. messages) are skipped.  Each result set
+    must be read before asking for the next one.
+    """
+
+    if cursor.description is not None:
+        yield cursor
+    while cursor.nextset():
+        if cursor.description is not None:
+            yield cursor
+
+
+def as_text(value):
+    """Return a database value as it would be read back from a CSV file."""
+
+    if value is None:
+        return ""
+    return "{0}".format(value)
+
+
+def export_rows(cursor, csv_path, batch_size=BATCH_SIZE):
+    """
+    Write the cursor's current result set to csv_path while yielding each row.
+
+    The header is the column names.  The rows are yielded as lists of unicode
+    strings, the same as the rows from make_children.read_rows().
+    """
+
+    count = 0
+    with csv23.open(csv_path, "w") as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv23.write(csv_writer, [column[0] for column in cursor.description])
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                row = [as_text(value) for value in row]
+                csv23.write(csv_writer, row)
+                count += 1
+                yield row
+    print("Wrote {0} rows to {1}".format(count, csv_path))
+
+
+def add_to_tree(rows, add):
+    """Call add(row[0], row[1]) for each row while yielding the rows."""
+
+    for row in rows:
+        add(row[0], row[1])
+        yield row
+
+
+def next_export(results, csv_path):
+    """Move to the next result set, and return export_rows() for it."""
+
+    cursor = next(results, None)
+    if cursor is None:
+        raise ValueError("No result set was returned for {0}".format(csv_path))
+    return export_rows(cursor, csv_path)
+
+
+def run(connection, sql_path, python_photo_ids=False):
+    """
+    Execute the SQL script and create the CSV and JSON files.
+
+    If python_photo_ids is True, the Photo_Ids are found with photo_ids.py.
+
+    Each result set is completely read (and written) before moving to the next.
+    Raises a ValueError if the script returns fewer result sets than CSV_FILES.
+    """
+
+    script = read_script(sql_path)
+    if python_photo_ids:
+        script, feature_classes = photo_ids.rewrite_script(script)
+        photo_ids.create_photo_id_table(connection, feature_classes)
+    cursor = connection.cursor()
+    cursor.execute(script)
+    results = result_sets(cursor)
+    facilities_csv, assets_csv, parents_csv, all_assets_csv = CSV_FILES
+    tree = hierarchy.Hierarchy()
+
+    gis_loc_counts = make_children.count_ids(next_export(results, facilities_csv))
+    gis_asset_counts = make_children.count_ids(next_export(results, assets_csv))
+
+    rows = add_to_tree(next_export(results, parents_csv), tree.add_location)
+    children = make_children.group_children(rows, gis_loc_counts, gis_loc_counts)
+    make_children.write_children("children.json", children)
+    del children
+
+    rows = add_to_tree(next_export(results, all_assets_csv), tree.add_asset)
+    assets = make_children.group_children(rows, gis_loc_counts, gis_asset_counts)
+    make_children.write_children("assets.json", assets)
+    del assets
+
+    make_children.write_tree(tree, gis_loc_counts)
+
+
+def main():
+    """Run facilities.sql and create the files for the web app."""
+
+    start = time.time()
+    conn = get_connection_or_die("inpakrovmais", "akr_facility2")
+    try:
+        run(conn, SQL_FILE, python_photo_ids="--python-photo-ids" in sys.argv[1:])
+    except pyodbc.Error as de:
+        print("Database error ocurred", de)
+    except ValueError as ex:
+        print("ERROR:", ex)
+    print("Finished in {0:.1f} seconds".format(time.time() - start))
+
+
+if __name__ == "__main__":
+    main()
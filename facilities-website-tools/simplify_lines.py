@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+Simplifies the trail and road lines for each zoom level of the web map.
+
+The `TRAILS_LN` and `ROADS_LN` shapes have far more vertices than can be seen
+at the zoom levels the website uses.  This module simplifies the lines with
+the Douglas-Peucker algorithm (using NumPy for the distances) for each zoom
+level, with a tolerance of half a pixel (in Web Mercator, like the web map),
+so each simplified line is within half a pixel of the original.  The end
+points of every line and any vertices shared with another line (i.e. a trail
+junction or where a trail meets a road) are always kept, so lines that were
+connected stay connected at every zoom level.  After each zoom level is
+simplified, the crossings of every pair of lines (and of each line with itself)
+are counted and compared to the original lines; a line that crosses (or stops
+crossing) a line differently is simplified again with half the tolerance, up
+to TOPOLOGY_RETRIES times, and then keeps the vertices it has at the next
+larger zoom level (which has the same crossings as the original).
+
+Usage:
+
+import simplify_lines
+lines = [points, ...]  # (n, 2) NumPy arrays of (longitude, latitude)
+by_zoom = simplify_lines.simplify_all(lines, zooms=[8, 10, 12])
+# by_zoom[10][i] is the i-th line simplified for zoom level 10
+
+Run this script to read the lines from the database, and write a GeoJSON file
+(`lines_z{zoom}.json`) for each of the ZOOMS.
+
+File paths are hard coded in the script relative to the current working directory.
+The database connection string and schema are also hardcoded in the script.
+
+Written for Python 2.7; may work with Python 3.x.
+
+Third party requirements:
+* numpy - https://pypi.python.org/pypi/numpy
+* pyodbc - https://pypi.python.org/pypi/pyodbc (only to read the lines)
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from io import open
+import sys
+import time
+
+import numpy as np
+
+try:
+    import pyodbc
+except ImportError:
+    # pyodbc is only needed to read the lines from the database
+    pyodbc = None
+
+import geometry_measure
+import json_stream
+
+# The zoom levels to create simplified lines for.
+ZOOMS = [6, 8, 10, 12, 14]
+
+# The size of a pixel (in Web Mercator meters) at zoom level 0 (256 pixel tiles).
+PIXEL_SIZE_Z0 = 2 * np.pi * 6378137.0 / 256
+
+# The largest distance a simplified line may be from the original (in pixels).
+TOLERANCE_PIXELS = 0.5
+
+# The number of times to halve the tolerance of a line that crosses another
+# line differently after it is simplified.
+TOPOLOGY_RETRIES = 3
+
+# The number of decimal places for the longitude and latitude in the GeoJSON.
+PRECISION = 6
+
+LINES_SQL = """
+SELECT '{0}' AS Kind, FACLOCID, FACASSETID, Shape.STAsBinary() AS WKB
+  FROM akr_facility2.gis.{1}_evw
+ WHERE Shape IS NOT NULL AND LINETYPE = 'Center line'
+"""
+
+LINE_FEATURE_CLASSES = [("Trail", "TRAILS_LN"), ("Road", "ROADS_LN")]
+
+
+def get_connection_or_die(server, database):
+    """
+    Get a Trusted pyodbc connection to the SQL Server database on server.
+
+    Try several connection strings.
+    See https://github.com/mkleehammer/pyodbc/wiki/Connecting-to-SQL-Server-from-Windows
+
+    Exit with an error message if there is no successful connection.
+    """
+    if pyodbc is None:
+        print("The pyodbc module is required to read the lines from the database.")
+        sys.exit()
+    drivers = [
+        "{ODBC Driver 17 for SQL Server}",  # supports SQL Server 2008 through 2017
+        "{ODBC Driver 13.1 for SQL Server}",  # supports SQL Server 2008 through 2016
+        "{ODBC Driver 13 for SQL Server}",  # supports SQL Server 2005 through 2016
+        "{ODBC Driver 11 for SQL Server}",  # supports SQL Server 2005 through 2014
+        "{SQL Server Native Client 11.0}",  # DEPRECATED: released with SQL Server 2012
+        # '{SQL Server Native Client 10.0}',    # DEPRECATED: released with SQL Server 2008
+    ]
+    conn_template = "DRIVER={0};SERVER={1};DATABASE={2};Trusted_Connection=Yes;"
+    for driver in drivers:
+        conn_string = conn_template.format(driver, server, database)
+        try:
+            connection = pyodbc.connect(conn_string)
+            return connection
+        except pyodbc.Error:
+            pass
+    print("Rats!! Unable to connect to the database.")
+    print("Make sure you have an ODBC driver installed for SQL Server")
+    print("and your AD account has the proper DB permissions.")
+    print("Contact akro_gis_helpdesk@nps.gov for assistance.")
+    sys.exit()
+
+
+def tolerance(zoom, pixels=TOLERANCE_PIXELS):
+    """Return the simplification tolerance (in Web Mercator meters) for zoom."""
+
+    return PIXEL_SIZE_Z0 / 2 ** zoom * pixels
+
+
+def web_mercator(points):
+    """Return an (n, 2) array of Web Mercator x, y for an array of (lon, lat)."""
+
+    lon = np.radians(points[:, 0])
+    lat = np.radians(np.clip(points[:, 1], -85.0511, 85.0511))
+    return np.column_stack(
+        (6378137.0 * lon, 6378137.0 * np.log(np.tan(np.pi / 4 + lat / 2)))
+    )
+
+
+def douglas_peucker(points, max_distance, fixed):
+    """
+    Return a boolean mask of the points to keep in the simplified lines.
+
+    points is an (n, 2) array (in a projected coordinate system) of one or more
+    lines end to end, and fixed is a boolean array that is True for the points
+    that must be kept, which must include the first and last point of each line.
+    Every removed point is within max_distance of the simplified line.
+    max_distance may also be an array with a distance for each point (the same
+    for all the points of a line); a negative distance keeps all the points.
+
+    All the lines are simplified together: each round finds the farthest point
+    from every segment that still needs splitting with NumPy, so the number of
+    rounds depends on the depth of the splitting, not on the number of lines.
+    """
+
+    mask = fixed.copy()
+    kept = np.flatnonzero(mask)
+    # The last point of one line and the first point of the next are adjacent,
+    # so there is never a segment between two lines.
+    starts, ends = kept[:-1], kept[1:]
+    while True:
+        wide = ends - starts > 1
+        starts, ends = starts[wide], ends[wide]
+        if len(starts) == 0:
+            break
+        counts = ends - starts - 1
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        segment = np.repeat(np.arange(len(starts)), counts)
+        indexes = np.arange(counts.sum()) - offsets[segment] + starts[segment] + 1
+        p0 = points[starts][segment]
+        direction = points[ends][segment] - p0
+        offset = points[indexes] - p0
+        length_sq = np.einsum("ij,ij->i", direction, direction)
+        t = np.einsum("ij,ij->i", offset, direction)
+        np.divide(t, length_sq, out=t, where=length_sq > 0)
+        t[length_sq == 0] = 0
+        t = np.clip(t, 0, 1)
+        error = offset - direction * t[:, np.newaxis]
+        distances = np.hypot(error[:, 0], error[:, 1])
+        largest = np.maximum.reduceat(distances, offsets)
+        # The first point in each segment with the largest distance
+        candidates = np.flatnonzero(distances == largest[segment])
+        _, first = np.unique(segment[candidates], return_index=True)
+        farthest = indexes[candidates[first]]
+        limit = max_distance[starts] if np.ndim(max_distance) else max_distance
+        split = largest > limit
+        middles = farthest[split]
+        mask[middles] = True
+        starts, ends = (
+            np.concatenate((starts[split], middles)),
+            np.concatenate((middles, ends[split])),
+        )
+    return mask
+
+
+def keep_loops_open(lines, masks, loops):
+    """
+    Make sure a closed line (i.e. a loop trail) does not collapse to a point.
+
+    loops is a list of the indexes of the closed lines.
+    """
+
+    for index in loops:
+        line, mask = lines[index], masks[index]
+        if mask.sum() < 3:
+            offsets = line[1:-1] - line[0]
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+            mask[1 + int(np.argmax(distances))] = True
+
+
+def shared_vertices(lines):
+    """
+    Return a list of boolean arrays (one per line) that are True for the vertices
+    that are also a vertex in another line.
+    """
+
+    if not lines:
+        return []
+    sizes = [len(line) for line in lines]
+    vertices = np.concatenate(lines)
+    owners = np.repeat(np.arange(len(lines)), sizes)
+    # Sort the vertices by location (and line), then count the different lines
+    # at each location.
+    x, y = vertices[:, 0], vertices[:, 1]
+    order = np.lexsort((owners, y, x))
+    x, y, owners = x[order], y[order], owners[order]
+    new_vertex = np.concatenate(([True], (x[1:] != x[:-1]) | (y[1:] != y[:-1])))
+    new_owner = new_vertex | np.concatenate(([True], owners[1:] != owners[:-1]))
+    group = np.cumsum(new_vertex) - 1
+    line_counts = np.bincount(group, weights=new_owner)
+    is_shared = np.empty(len(vertices), dtype=bool)
+    is_shared[order] = line_counts[group] > 1
+    return np.split(is_shared, np.cumsum(sizes)[:-1])
+
+
+def segment_pairs(x0, y0, x1, y1):
+    """
+    Return two arrays of the indexes of the pairs of segments that may intersect.
+
+    The segments are from (x0, y0) to (x1, y1).  Each segment is put in the
+    cells of a grid that its bounding box overlaps, and the pairs are the
+    segments that share a cell and have overlapping bounding boxes (each pair
+    once, with the smaller index first).
+    """
+
+    left, right = np.minimum(x0, x1), np.maximum(x0, x1)
+    bottom, top = np.minimum(y0, y1), np.maximum(y0, y1)
+    # Cells as big as almost all the segments, so most are in 1 to 4 cells
+    size = max(np.percentile(np.maximum(right - left, top - bottom), 99), 1e-9)
+    col0 = np.floor((left - left.min()) / size).astype(np.int64)
+    col1 = np.floor((right - left.min()) / size).astype(np.int64)
+    row0 = np.floor((bottom - bottom.min()) / size).astype(np.int64)
+    row1 = np.floor((top - bottom.min()) / size).astype(np.int64)
+    rows = row1 - row0 + 1
+    cells = (col1 - col0 + 1) * rows
+    segment = np.repeat(np.arange(len(x0)), cells)
+    local = np.arange(cells.sum()) - np.repeat(np.cumsum(cells) - cells, cells)
+    col = col0[segment] + local // rows[segment]
+    row = row0[segment] + local % rows[segment]
+    order = np.argsort(col * (row1.max() + 1) + row, kind="mergesort")
+    col, row, segment = col[order], row[order], segment[order]
+    # Pair each segment with the ones after it in the same cell
+    new_cell = (col[1:] != col[:-1]) | (row[1:] != row[:-1])
+    first_in_cell = np.flatnonzero(np.concatenate(([True], new_cell)))
+    cell_sizes = np.diff(np.append(first_in_cell, len(col)))
+    rank = np.arange(len(col)) - np.repeat(first_in_cell, cell_sizes)
+    partners = np.repeat(cell_sizes, cell_sizes) - rank - 1
+    first = np.repeat(np.arange(len(col)), partners)
+    second = (
+        first
+        + 1
+        + np.arange(partners.sum())
+        - np.repeat(np.cumsum(partners) - partners, partners)
+    )
+    a, b = segment[first], segment[second]
+    # Two segments may share several cells; keep the pair only in the first
+    # cell of the overlap of their bounding boxes (if they overlap at all).
+    keep = (
+        (col[first] == np.maximum(col0[a], col0[b]))
+        & (row[first] == np.maximum(row0[a], row0[b]))
+        & (np.maximum(left[a], left[b]) <= np.minimum(right[a], right[b]))
+        & (np.maximum(bottom[a], bottom[b]) <= np.minimum(top[a], top[b]))
+    )
+    a, b = a[keep], b[keep]
+    return np.minimum(a, b), np.maximum(a, b)
+
+
+def crossing_counts(lines):
+    """
+    Return a dictionary of (i, j): the number of times lines i and j cross.
+
+    lines is a list of (n, 2) arrays in a projected coordinate system, and
+    i <= j (i == j for a line that crosses itself).  Segments that only touch
+    (i.e. at a shared vertex or the end of a line) or overlap do not cross.
+    """
+
+    if not lines:
+        return {}
+    sizes = np.array([len(line) for line in lines])
+    points = np.concatenate(lines)
+    owners = np.repeat(np.arange(len(lines)), sizes)
+    # A segment starts at every point except the last point of each line
+    is_start = np.ones(len(points), dtype=bool)
+    is_start[np.cumsum(sizes) - 1] = False
+    starts = np.flatnonzero(is_start)
+    if len(starts) < 2:
+        return {}
+    p0, p1, owner = points[starts], points[starts + 1], owners[starts]
+    a, b = segment_pairs(p0[:, 0], p0[:, 1], p1[:, 0], p1[:, 1])
+
+    def side(origin, end, point):
+        # > 0 if point is left of the line from origin to end, < 0 if right
+        return np.sign(
+            (end[:, 0] - origin[:, 0]) * (point[:, 1] - origin[:, 1])
+            - (end[:, 1] - origin[:, 1]) * (point[:, 0] - origin[:, 0])
+        )
+
+    crosses = (
+        side(p0[a], p1[a], p0[b]) * side(p0[a], p1[a], p1[b]) < 0
+    ) & (side(p0[b], p1[b], p0[a]) * side(p0[b], p1[b], p1[a]) < 0)
+    line_a, line_b = owner[a[crosses]], owner[b[crosses]]
+    count = len(lines)
+    pairs, counts = np.unique(
+        np.minimum(line_a, line_b) * count + np.maximum(line_a, line_b),
+        return_counts=True,
+    )
+    return dict(
+        ((int(pair // count), int(pair % count)), int(n))
+        for pair, n in zip(pairs, counts)
+    )
+
+
+def changed_lines(before, after):
+    """Return the lines in the pairs that cross a different number of times."""
+
+    lines = set()
+    for pair in set(before) | set(after):
+        if before.get(pair, 0) != after.get(pair, 0):
+            lines.update(pair)
+    return sorted(lines)
+
+
+def simplify_all(lines, zooms=ZOOMS):
+    """
+    Return a dictionary of zoom: list of the lines simplified for that zoom.
+
+    lines is a list of (n, 2) arrays of (longitude, latitude).  Each simplified
+    line is the original array with some vertices removed.  The lines for one
+    zoom level are the starting point for the next smaller zoom level, so the
+    lines at smaller zoom levels have a subset of the vertices at larger ones.
+    The simplified lines cross each other (and themselves) the same number of
+    times as the original lines.
+    """
+
+    if not lines:
+        return dict((zoom, []) for zoom in zooms)
+    sizes = [len(line) for line in lines]
+    points = web_mercator(np.concatenate(lines))
+    owners = np.repeat(np.arange(len(lines)), sizes)
+    fixed = np.concatenate(shared_vertices(lines))
+    ends = np.cumsum(sizes)
+    fixed[ends - 1] = True
+    fixed[ends - np.array(sizes)] = True
+    loops = [
+        index
+        for index, line in enumerate(lines)
+        if len(line) > 3 and np.array_equal(line[0], line[-1])
+    ]
+    original = crossing_counts(np.split(points, ends[:-1]))
+    subset = np.arange(len(points))
+    result = {}
+    for zoom in sorted(zooms, reverse=True):
+        line_tolerance = np.full(len(lines), tolerance(zoom))
+        retries = 0
+        while True:
+            sub_mask = douglas_peucker(
+                points[subset], line_tolerance[owners[subset]], fixed[subset]
+            )
+            mask = np.zeros(len(points), dtype=bool)
+            mask[subset[sub_mask]] = True
+            masks = np.split(mask, ends[:-1])
+            keep_loops_open(lines, masks, loops)
+            simplified = [
+                line[line_mask]
+                for line, line_mask in zip(np.split(points, ends[:-1]), masks)
+            ]
+            changed = changed_lines(original, crossing_counts(simplified))
+            if not changed:
+                break
+            if retries < TOPOLOGY_RETRIES:
+                line_tolerance[changed] /= 2
+                retries += 1
+            else:
+                # Keep the vertices from the larger zoom level
+                line_tolerance[changed] = -1.0
+        subset = np.flatnonzero(np.concatenate(masks))
+        result[zoom] = [line[line_mask] for line, line_mask in zip(lines, masks)]
+    return result
+
+
+def get_lines(connection):
+    """Return a list of (properties, line) for the trail and road center lines."""
+
+    lines = []
+    for kind, feature_class in LINE_FEATURE_CLASSES:
+        cursor = connection.cursor()
+        for row in cursor.execute(LINES_SQL.format(kind, feature_class)):
+            properties = {"k": row[0], "l": row[1], "a": row[2]}
+            _, parts = geometry_measure.parse_wkb(row[3])
+            for part in parts:
+                if len(part) > 1:
+                    lines.append((properties, np.ascontiguousarray(part)))
+    return lines
+
+
+def feature_items(properties, lines):
+    """Yield the GeoJSON members of a FeatureCollection of the lines."""
+
+    yield "features", [
+        {
+            "geometry": {
+                "coordinates": np.round(line, PRECISION).tolist(),
+                "type": "LineString",
+            },
+            "properties": props,
+            "type": "Feature",
+        }
+        for props, line in zip(properties, lines)
+    ]
+    yield "type", "FeatureCollection"
+
+
+def main():
+    conn = get_connection_or_die("inpakrovmais", "akr_facility2")
+    features = get_lines(conn)
+    properties = [props for props, _ in features]
+    lines = [line for _, line in features]
+    start = time.time()
+    by_zoom = simplify_all(lines)
+    seconds = time.time() - start
+    total = sum(len(line) for line in lines)
+    msg = "Simplified {0} lines ({1} vertices) for {2} zoom levels in {3:.1f} seconds"
+    print(msg.format(len(lines), total, len(by_zoom), seconds))
+    for zoom in sorted(by_zoom):
+        json_path = "lines_z{0}.json".format(zoom)
+        with open(json_path, "w", encoding="utf-8") as json_fh:
+            json_stream.write_object(
+                json_fh,
+                feature_items(properties, by_zoom[zoom]),
+                separators=(",", ":"),
+            )
+        vertices = sum(len(line) for line in by_zoom[zoom])
+        print("  Zoom {0}: {1} vertices in {2}".format(zoom, vertices, json_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Tests `geometry_measure.py` against the SQL Server values in `geometry_fixture.csv`.
+
+The fixture is exported from the facilities database with
+`python geometry_measure.py --export` (see geometry_measure.py); the test is
+skipped until it is.
+
+Usage:
+
+python -m unittest test_geometry_measure
+
+or `python -m pytest` in this folder.
+
+Written for Python 2.7; may work with Python 3.x.
+
+Third party requirements:
+* numpy - https://pypi.python.org/pypi/numpy
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import os
+import sys
+import unittest
+
+import geometry_measure
+
+FIXTURE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), geometry_measure.FIXTURE_FILE
+)
+
+
+class Quiet(object):
+    """A replacement for sys.stdout that ignores the printed report."""
+
+    def write(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+
+class MeasureTest(unittest.TestCase):
+    @unittest.skipUnless(
+        os.path.exists(FIXTURE_PATH), "geometry_fixture.csv has not been exported"
+    )
+    def test_matches_sql_server(self):
+        stdout = sys.stdout
+        sys.stdout = Quiet()
+        try:
+            area, length = geometry_measure.validate(FIXTURE_PATH)
+        finally:
+            sys.stdout = stdout
+        self.assertLessEqual(area, geometry_measure.TOLERANCE)
+        self.assertLessEqual(length, geometry_measure.TOLERANCE)
+
+
+if __name__ == "__main__":
+    unittest.main()